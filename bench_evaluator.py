@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+评估工具压测脚本
+================
+engine:   在本地 Mock 服务上对比线程池引擎与异步引擎的吞吐 (rows/sec)；--check 时异步引擎低于线程池则失败
+template: 用真实的 Holistic_Analysis 模板对比逐行 str.replace、fill_prompt 与 render_frame
+suite:    回归基准：两种引擎 × (正常 / 注入故障) × 100 / 1k / 10k 行，记录 rows/sec、p95 延迟、
+          峰值 RSS 与故障恢复率，换算成与机器无关的相对指标（异步 / 线程池加速比、故障下保留的吞吐比例等）
+          后与 JSON 基线比较，超出容差时以非零状态退出（不需要网络，可在 CI 中运行）
+
+用法：
+    python bench_evaluator.py engine --rows 2000 --latency 0.2
+    python bench_evaluator.py engine --rows 500 --latency 0.5 --jitter 0.45 --check
+    python bench_evaluator.py template --rows 10000
+    python bench_evaluator.py suite                    # 与 bench_baseline.json 比较
+    python bench_evaluator.py suite --save-baseline    # 在当前机器上重新生成基线
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+from openai import OpenAI
+
+from evaluator.clients import connection_report, connection_snapshot, format_connection_report, get_client
+from evaluator.engine import batch_evaluate, percentile
+from evaluator.templates import extract_placeholders, fill_prompt, render_frame
+from mock_llm_server import LATENCY_DISTRIBUTIONS, MockLLMServer
+
+HOLISTIC_TEMPLATE = (Path(__file__).parent / "Strategy_Library" / "01_Modules" /
+                     "Status_Analysis" / "Holistic_Analysis" / "prompts.md")
+
+BASELINE_PATH = Path(__file__).parent / "bench_baseline.json"
+SUITE_SIZES = (100, 1000, 10000)
+# 线程池取侧边栏的并发上限，异步引擎取默认的并发上限
+SUITE_ENGINES = {"thread": 10, "async": 256}
+# Mock 服务参数：faulty 注入 5% 的 5xx 与 2% 的 429，检验重试后的恢复率
+SUITE_SCENARIOS = {
+    "clean": {},
+    "faulty": {"error_rate": 0.05, "throttle_rate": 0.02},
+}
+# 与基线比较的相对指标（绝对的 rows/sec、p95、RSS 随机器变化，只写入基线供参考），True 表示越大越好：
+#   speedup/<场景>/<行数>            异步引擎 ÷ 线程池的吞吐
+#   fault_throughput/<引擎>/<行数>   faulty ÷ clean 的吞吐，即注入故障后保留的吞吐比例
+#   p95_ratio/async/clean/<行数>     异步引擎的 p95 延迟 ÷ 同行数 thread/clean 的 p95
+#   rss_ratio/<引擎>/<场景>/<行数>   峰值 RSS ÷ 压测开始前的 RSS
+#   success_rate / recovery_rate     本身就是比例
+SUITE_METRICS = {
+    "speedup": True,
+    "fault_throughput": True,
+    "p95_ratio": False,
+    "rss_ratio": False,
+    "success_rate": True,
+    "recovery_rate": True,
+}
+# faulty 场景中行数少于此值的组合只比较成功率与恢复率。100 行时异步引擎一次发出全部请求，
+# 正常请求约一个延迟周期就完成，总耗时等于最慢一行的重试链（429 的 Retry-After 为 1s，5xx 指数退避）；
+# 线程池的重试等待与队列中其余行重叠，受影响较小。同一台机器上连续 5 次的 async/faulty/100 在 26~74 rows/sec
+# 之间波动（thread 为 43~64），吞吐由注入故障落在哪几行决定而不是引擎本身，不能作为基线
+FAULTY_TIMED_ROWS = 1000
+# 绝对容差：差值同时超过相对容差与绝对容差才算回归；成功率 / 恢复率只按绝对容差比较。
+# 异步引擎遇到 429 即把并发减半，p95 主要是自适应并发窗口内的排队时间，故障下的吞吐也取决于回退落在何时：
+# 同一台机器上 async/clean 的 p95_ratio 在 1.1~6.0 之间、async 的 fault_throughput 在 0.27~0.42 之间，
+# 这两项只用于发现成倍的退化
+SUITE_SLACK = {
+    "speedup": 0.2,
+    "fault_throughput": 0.15,
+    "p95_ratio": 4.0,
+    "rss_ratio": 0.15,
+    "success_rate": 0.01,
+    "recovery_rate": 0.01,
+}
+
+
+def bench_engine(args):
+    """线程池 vs 异步引擎吞吐对比"""
+    server = MockLLMServer(latency=args.latency, jitter=args.jitter,
+                           max_in_flight=args.max_in_flight).start()
+    prompts = [f"row {i}: 分析以下聊天记录" for i in range(args.rows)]
+    print(f"🧪 Mock 服务 {server.base_url}，{args.rows} 行，延迟 {args.latency}s")
+
+    runs = [("thread", args.threads), ("async", args.max_concurrency)]
+    throughput = {}
+    for engine, workers in runs:
+        server.stats.update(requests=0, throttled=0, peak_in_flight=0)
+        client = get_client(server.base_url, "mock", workers)
+        connections = connection_snapshot()
+        start = time.perf_counter()
+        results = batch_evaluate(prompts, client, "mock-model", None, 0.7, 256,
+                                 max_workers=workers, engine=engine)
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for r in results if r["response"].startswith("[ERROR]"))
+        throughput[engine] = len(results) / elapsed
+        print(f"  {engine:<6} workers={workers:<4} {elapsed:7.2f}s  "
+              f"{len(results) / elapsed:8.1f} rows/sec  errors={errors}  "
+              f"peak_in_flight={server.stats['peak_in_flight']}  throttled={server.stats['throttled']}")
+        for line in format_connection_report(connection_report(connections, connection_snapshot())):
+            print(f"         🔌 {line}")
+
+    server.shutdown()
+    if args.check and throughput["async"] < throughput["thread"]:
+        print(f"❌ 异步引擎 {throughput['async']:.1f} rows/sec 低于线程池 {throughput['thread']:.1f} rows/sec",
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+def _legacy_fill_prompt(template: str, mapping: dict, row: pd.Series) -> str:
+    """旧版实现：每个占位符扫描一遍整个模板"""
+    filled = template
+    for placeholder, excel_field in mapping.items():
+        if excel_field and excel_field in row.index:
+            value = str(row[excel_field]) if pd.notna(row[excel_field]) else ""
+            filled = filled.replace(f"{{{{{placeholder}}}}}", value)
+    return filled
+
+
+def bench_template(args):
+    """模板渲染微基准"""
+    template = HOLISTIC_TEMPLATE.read_text(encoding="utf-8")
+    placeholders = extract_placeholders(template)
+    df = pd.DataFrame({
+        name: [f"{name} 第 {i} 行的取值" * 5 for i in range(args.rows)]
+        for name in placeholders
+    })
+    mapping = {name: name for name in placeholders}
+    print(f"🧪 模板 {HOLISTIC_TEMPLATE.name} ({len(template)} 字符, {len(placeholders)} 个占位符)，{args.rows} 行")
+
+    def legacy():
+        return [_legacy_fill_prompt(template, mapping, df.iloc[i]) for i in range(len(df))]
+
+    def per_row():
+        return [fill_prompt(template, mapping, df.iloc[i]) for i in range(len(df))]
+
+    def vectorized():
+        return render_frame(template, mapping, df)
+
+    baseline = None
+    for name, fn in [("str.replace", legacy), ("fill_prompt", per_row), ("render_frame", vectorized)]:
+        start = time.perf_counter()
+        prompts = fn()
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = prompts
+        assert prompts == baseline, f"{name} 输出与旧版不一致"
+        print(f"  {name:<13} {elapsed:7.3f}s  {len(prompts) / elapsed:10.0f} rows/sec")
+
+
+def _rss_mb() -> float:
+    """当前进程的常驻内存（MB）；非 Linux 时退化为 getrusage 的历史峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class RSSSampler:
+    """后台线程定期采样 RSS，记录一次运行期间的峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RSSSampler":
+        self.peak = _rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _rss_mb())
+
+
+def run_case(engine: str, workers: int, rows: int, latency: float, jitter: float, distribution: str,
+             scenario: dict) -> dict:
+    """在独立的 Mock 服务上跑一组 batch_evaluate，返回该组的指标"""
+    server = MockLLMServer(latency=latency, jitter=jitter, distribution=distribution, **scenario).start()
+    client = OpenAI(base_url=server.base_url, api_key="mock", max_retries=0)
+    prompts = [f"row {i}: 分析以下聊天记录" for i in range(rows)]
+    try:
+        with RSSSampler() as rss:
+            start = time.perf_counter()
+            results = batch_evaluate(prompts, client, "mock-model", None, 0.7, 256,
+                                     max_workers=workers, engine=engine)
+            elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    failed = sum(1 for r in results if r.get("error"))
+    faults = server.stats["errors"] + server.stats["throttled"]
+    return {
+        "rows_per_sec": round(rows / elapsed, 1),
+        "p95_latency": round(percentile(sorted(r["time"] for r in results), 95), 3),
+        "peak_rss_mb": round(rss.peak, 1),
+        "success_rate": round(1 - failed / rows, 4),
+        # 注入的故障中最终被重试恢复的比例；没有注入故障时为 1
+        "recovery_rate": round(1 - failed / faults, 4) if faults else 1.0,
+        "faults": faults,
+    }
+
+
+def relative_metrics(results: dict, start_rss: float) -> dict[str, float]:
+    """把各组合的原始指标换算成 SUITE_METRICS 中的相对指标"""
+    relative = {}
+    for case, metrics in results.items():
+        engine, scenario, rows = case.split("/")
+        timed = scenario == "clean" or int(rows) >= FAULTY_TIMED_ROWS
+        thread = results.get(f"thread/{scenario}/{rows}")
+        clean = results.get(f"{engine}/clean/{rows}")
+        reference = results.get(f"thread/clean/{rows}")
+        if engine == "async" and timed and thread:
+            relative[f"speedup/{scenario}/{rows}"] = round(metrics["rows_per_sec"] / thread["rows_per_sec"], 3)
+        if scenario == "faulty" and timed and clean:
+            relative[f"fault_throughput/{engine}/{rows}"] = round(metrics["rows_per_sec"] / clean["rows_per_sec"], 3)
+        if scenario == "clean" and engine != "thread" and reference and reference["p95_latency"] > 0:
+            relative[f"p95_ratio/{case}"] = round(metrics["p95_latency"] / reference["p95_latency"], 3)
+        relative[f"rss_ratio/{case}"] = round(metrics["peak_rss_mb"] / start_rss, 3)
+        relative[f"success_rate/{case}"] = metrics["success_rate"]
+        relative[f"recovery_rate/{case}"] = metrics["recovery_rate"]
+    return relative
+
+
+def compare(relative: dict, baseline: dict, tolerance: float) -> list[str]:
+    """相对指标与基线比较，返回超出容差的回归描述；基线中没有的指标跳过"""
+    regressions = []
+    for name, value in relative.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        metric = name.split("/", 1)[0]
+        if metric in ("success_rate", "recovery_rate"):
+            allowed = SUITE_SLACK[metric]
+        else:
+            allowed = max(abs(expected) * tolerance, SUITE_SLACK[metric])
+        delta = expected - value if SUITE_METRICS[metric] else value - expected
+        if delta > allowed:
+            regressions.append(f"{name}: {value} (基线 {expected})")
+    return regressions
+
+
+def check_floors(results: dict) -> list[str]:
+    """与基线无关的底线：clean 场景下异步引擎的吞吐不低于同行数的线程池
+
+    faulty 场景注入的 429 会让异步引擎按设计回退并发，小样本下吞吐主要取决于重试退避，不参与比较。
+    """
+    failures = []
+    for case, metrics in results.items():
+        engine, scenario, rows = case.split("/")
+        thread = results.get(f"thread/{scenario}/{rows}")
+        if engine == "async" and scenario == "clean" and thread \
+                and metrics["rows_per_sec"] < thread["rows_per_sec"]:
+            failures.append(f"{case} rows_per_sec: {metrics['rows_per_sec']} 低于线程池 {thread['rows_per_sec']}")
+    return failures
+
+
+def bench_suite(args):
+    """回归基准：结果与基线比较，出现回归时返回 1"""
+    sizes = [int(size) for size in args.sizes.split(",")]
+    results = {}
+    start_rss = _rss_mb()
+    print(f"🧪 回归基准：{len(SUITE_ENGINES)} 个引擎 × {len(SUITE_SCENARIOS)} 个场景 × {sizes} 行，"
+          f"延迟 {args.latency}s ({args.distribution}, jitter {args.jitter})")
+    for scenario, server_args in SUITE_SCENARIOS.items():
+        for engine, workers in SUITE_ENGINES.items():
+            for rows in sizes:
+                case = f"{engine}/{scenario}/{rows}"
+                results[case] = metrics = run_case(engine, workers, rows, args.latency, args.jitter,
+                                                  args.distribution, server_args)
+                print(f"  {case:<22} {metrics['rows_per_sec']:8.1f} rows/sec  p95 {metrics['p95_latency']:6.3f}s  "
+                      f"RSS {metrics['peak_rss_mb']:7.1f}MB  成功 {metrics['success_rate']:.2%}  "
+                      f"恢复 {metrics['recovery_rate']:.2%} ({metrics['faults']} 次故障)")
+
+    relative = relative_metrics(results, start_rss)
+    for name, value in relative.items():
+        if name.startswith(("speedup/", "fault_throughput/")):
+            print(f"  {name:<30} {value:6.2f}x")
+
+    failures = check_floors(results)
+    if failures:
+        print(f"❌ {len(failures)} 项低于底线:", file=sys.stderr)
+        for line in failures:
+            print(f"   {line}", file=sys.stderr)
+        return 1
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps({
+            "meta": {"python": platform.python_version(), "platform": platform.platform(),
+                     "latency": args.latency, "jitter": args.jitter, "distribution": args.distribution,
+                     "created_at": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "relative": relative,
+            "results": results,
+        }, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"💾 已写入基线 {baseline_path}")
+        return 0
+    if not baseline_path.exists():
+        print(f"⚠️ 没有基线 {baseline_path}，使用 --save-baseline 生成", file=sys.stderr)
+        return 0
+    baseline = json.loads(baseline_path.read_text(encoding="utf-8"))
+    if "relative" not in baseline:
+        print(f"❌ 基线 {baseline_path} 只有绝对指标，使用 --save-baseline 重新生成", file=sys.stderr)
+        return 1
+    regressions = compare(relative, baseline["relative"], args.tolerance)
+    if regressions:
+        print(f"❌ {len(regressions)} 项超出容差 {args.tolerance:.0%}:", file=sys.stderr)
+        for line in regressions:
+            print(f"   {line}", file=sys.stderr)
+        return 1
+    print(f"✅ 与基线一致（容差 {args.tolerance:.0%}）")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评估工具压测")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_engine = sub.add_parser("engine", help="线程池 vs 异步引擎吞吐对比")
+    p_engine.add_argument("--rows", type=int, default=2000)
+    p_engine.add_argument("--latency", type=float, default=0.2)
+    p_engine.add_argument("--jitter", type=float, default=0.05)
+    p_engine.add_argument("--max-in-flight", type=int, default=0, help="Mock 服务的 429 阈值（0 表示不限）")
+    p_engine.add_argument("--threads", type=int, default=10, help="线程池引擎的线程数（侧边栏上限）")
+    p_engine.add_argument("--max-concurrency", type=int, default=256, help="异步引擎并发上限")
+    p_engine.add_argument("--check", action="store_true", help="异步引擎吞吐低于线程池时以非零状态退出")
+    p_engine.set_defaults(func=bench_engine)
+
+    p_template = sub.add_parser("template", help="模板渲染微基准")
+    p_template.add_argument("--rows", type=int, default=10000)
+    p_template.set_defaults(func=bench_template)
+
+    p_suite = sub.add_parser("suite", help="回归基准，与 JSON 基线比较")
+    p_suite.add_argument("--sizes", default=",".join(map(str, SUITE_SIZES)), help="逗号分隔的行数")
+    p_suite.add_argument("--latency", type=float, default=0.05, help="Mock 服务基础延迟（秒）")
+    p_suite.add_argument("--jitter", type=float, default=0.01, help="延迟抖动（含义见 mock_llm_server.py）")
+    p_suite.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default="uniform", help="延迟分布")
+    p_suite.add_argument("--baseline", default=str(BASELINE_PATH), help="基线 JSON 路径")
+    p_suite.add_argument("--save-baseline", action="store_true", help="把本次结果写为基线，不做比较")
+    p_suite.add_argument("--tolerance", type=float, default=0.2,
+                         help="相对指标允许的退化比例")
+    p_suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
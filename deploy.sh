@@ -13,11 +13,11 @@ fi
 
 # 更新 index.html
 echo "📝 更新 index.html..."
-cp prompt_builder.html index.html
+python3 update_prompts.py || exit 1
 
 # 添加文件
 echo "➕ 添加文件到 Git..."
-git add index.html .gitignore
+git add index.html prompt_builder.html .gitignore
 
 # 检查是否有更改
 if git diff --staged --quiet; then
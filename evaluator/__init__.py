@@ -0,0 +1,18 @@
+"""
+Prompt 批量评估工具的实现
+========================
+入口是仓库根目录的 prompt_evaluator.py（Streamlit 页面与命令行），各模块：
+    config      模型配置（model_configs.json）
+    templates   {{占位符}} 模板的解析与按列渲染
+    clients     进程内共享的客户端与 HTTP 连接池
+    ratelimit   按 endpoint 的 RPM / TPM 限流与重试策略
+    tokens      调用前的 token 预检
+    engine      线程池 / 异步引擎、前缀缓存与流式延迟指标
+    storage     响应缓存与运行日志（断点续跑）
+    batch       Batch API 后端
+    judge       LLM 评分
+    pipeline    多阶段流水线
+    dataset     评估集读取
+    export      结果导出
+    cli         命令行
+"""
@@ -0,0 +1,442 @@
+"""Batch API：离线批量提交与结果回收（OpenAI / 本地后端）"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from openai import OpenAI, APIStatusError
+
+from evaluator.clients import client_for
+from evaluator.config import BASE_DIR
+from evaluator.engine import PrefixCachePlan, usage_dict
+from evaluator.judge import JudgePipeline
+from evaluator.ratelimit import message_text
+from evaluator.storage import ResponseCache, RunJournal, write_skipped
+from evaluator.tokens import approx_token_count
+
+# ============== Batch API ==============
+
+# 单个批次文件的请求数上限（OpenAI Batch API 为 50000）
+BATCH_MAX_REQUESTS = 50000
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_DIR = BASE_DIR / ".eval_cache" / "batches"
+BATCH_DONE_STATES = ("completed", "failed", "expired", "cancelled")
+_BATCH_FILE_CHARS = re.compile(r'[^\w.-]')
+
+
+class BatchBackend(ABC):
+    """Batch API 后端：提交 JSONL 请求文件、查询状态、取回输出
+
+    输入 / 输出均为 OpenAI Batch API 的 JSONL 格式，每行以 custom_id 对应一个请求。
+    四个方法都是抽象方法，缺少任何一个的子类在实例化时即报错。
+    """
+
+    name = None
+
+    @abstractmethod
+    def submit(self, path: Path, metadata: dict = None) -> str:
+        """上传请求文件并创建批次，返回批次 id"""
+
+    @abstractmethod
+    def poll(self, batch_id: str) -> dict:
+        """返回 {"status": ..., "completed": n, "failed": n, "total": n}"""
+
+    @abstractmethod
+    def fetch(self, batch_id: str):
+        """逐条返回输出文件（含错误文件）中的记录"""
+
+    @abstractmethod
+    def cancel(self, batch_id: str):
+        """取消尚未结束的批次"""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI 及兼容 Batch API 的服务（/v1/files + /v1/batches）"""
+
+    name = "openai"
+
+    def __init__(self, client: OpenAI, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, path: Path, metadata: dict = None) -> str:
+        try:
+            with open(path, 'rb') as f:
+                input_file = self.client.files.create(file=f, purpose="batch")
+        except APIStatusError as e:
+            # 很多兼容服务（以及 mock_llm_server）只实现了 /chat/completions
+            if e.status_code not in (404, 405, 501):
+                raise
+            raise ValueError(
+                f"{self.client.base_url} 不支持 Batch API（/files 返回 HTTP {e.status_code}）。"
+                f"请在 model_configs.json 中把该模型的 batch 字段设为 \"local-forward\""
+                f"（页面中「Batch 后端」选择本地排队转发），或改用 --engine async"
+            ) from e
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window=self.completion_window,
+            metadata=metadata
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> dict:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {"status": batch.status, "completed": counts.completed if counts else 0,
+                "failed": counts.failed if counts else 0, "total": counts.total if counts else 0}
+
+    def fetch(self, batch_id: str):
+        batch = self.client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def cancel(self, batch_id: str):
+        self.client.batches.cancel(batch_id)
+
+
+class LocalBatchBackend(BatchBackend):
+    """基于本地文件的 Batch API 替身，用于测试和没有 Batch API 的服务
+
+    每个批次一个目录（input.jsonl / state.json / output.jsonl）。首次 poll 时处理整个批次：
+    传入 client 时逐条转发给该 endpoint（同步调用，不享受批量折扣），否则返回 Mock 响应。
+    """
+
+    name = "local"
+
+    def __init__(self, root: Path = BATCH_DIR, client: OpenAI = None, max_workers: int = 8):
+        self.root = Path(root)
+        self.client = client
+        self.max_workers = max_workers
+
+    def _dir(self, batch_id: str) -> Path:
+        return self.root / batch_id
+
+    def _state(self, batch_id: str) -> dict:
+        return json.loads((self._dir(batch_id) / "state.json").read_text(encoding='utf-8'))
+
+    def _save_state(self, batch_id: str, state: dict):
+        path = self._dir(batch_id) / "state.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    def submit(self, path: Path, metadata: dict = None) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex[:12]}"
+        batch_dir = self._dir(batch_id)
+        batch_dir.mkdir(parents=True)
+        shutil.copyfile(path, batch_dir / "input.jsonl")
+        with open(path, 'r', encoding='utf-8') as f:
+            total = sum(1 for line in f if line.strip())
+        self._save_state(batch_id, {"status": "validating", "total": total, "completed": 0, "failed": 0,
+                                    "metadata": metadata or {}})
+        return batch_id
+
+    def _respond(self, body: dict) -> dict:
+        if self.client is not None:
+            return self.client.chat.completions.create(**body).model_dump()
+        prompt = message_text(body["messages"][-1])
+        content = f"mock response: {prompt[:50]}"
+        prompt_tokens = sum(approx_token_count(message_text(m)) for m in body["messages"])
+        completion_tokens = approx_token_count(content)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}", "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _process_line(self, line: str) -> dict:
+        request = json.loads(line)
+        try:
+            body = self._respond(request["body"])
+            return {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": body}, "error": None}
+        except Exception as e:
+            return {"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                    "response": {"status_code": getattr(e, "status_code", None) or 500,
+                                 "body": {"error": {"message": str(e)}}},
+                    "error": None}
+
+    def poll(self, batch_id: str) -> dict:
+        state = self._state(batch_id)
+        if state["status"] in ("validating", "in_progress"):
+            batch_dir = self._dir(batch_id)
+            with open(batch_dir / "input.jsonl", 'r', encoding='utf-8') as f:
+                lines = [line for line in f if line.strip()]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                outputs = list(executor.map(self._process_line, lines))
+            tmp_path = batch_dir / "output.jsonl.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for output in outputs:
+                    f.write(json.dumps(output, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, batch_dir / "output.jsonl")
+            failed = sum(1 for output in outputs if output["response"]["status_code"] != 200)
+            state.update(status="completed", completed=len(outputs) - failed, failed=failed)
+            self._save_state(batch_id, state)
+        return {key: state[key] for key in ("status", "completed", "failed", "total")}
+
+    def fetch(self, batch_id: str):
+        path = self._dir(batch_id) / "output.jsonl"
+        if not path.exists():
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def cancel(self, batch_id: str):
+        state = self._state(batch_id)
+        if state["status"] not in BATCH_DONE_STATES:
+            state["status"] = "cancelled"
+            self._save_state(batch_id, state)
+
+
+BATCH_BACKENDS = {
+    "openai": "OpenAI 兼容 Batch API（/v1/batches）",
+    "local-forward": "本地排队，逐条转发给该 endpoint（不支持 Batch API 的服务）",
+    "local": "本地 Mock（测试用，不调用 API）",
+}
+
+
+def get_batch_backend(config: dict) -> BatchBackend:
+    """按模型配置中的 batch 字段选择后端，缺省为 openai，取值见 BATCH_BACKENDS"""
+    kind = config.get("batch") or "openai"
+    if kind == "local":
+        return LocalBatchBackend()
+    client = client_for(config).with_options(max_retries=2)
+    if kind == "local-forward":
+        return LocalBatchBackend(client=client)
+    if kind == "openai":
+        return OpenAIBatchBackend(client)
+    raise ValueError(f"未知的 Batch 后端: {kind}")
+
+
+def batch_request_line(custom_id: str, model: str, messages: list[dict], temperature: float,
+                       max_tokens: int, extra_body: dict = None) -> str:
+    body = {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens,
+            **(extra_body or {})}
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                      ensure_ascii=False)
+
+
+def batch_output_result(record: dict) -> dict:
+    """把 Batch API 的一条输出转成与 call_llm_result 相同结构的结果"""
+    response = record.get("response") or {}
+    body = response.get("body") or {}
+    status = response.get("status_code")
+    if record.get("error") or status != 200:
+        error = record.get("error") or body.get("error") or {}
+        message = error.get("message") if isinstance(error, dict) else str(error)
+        transient = status is None or status in (408, 409, 429) or status >= 500
+        return {"response": f"[ERROR] {message or f'HTTP {status}'}", "attempts": 1,
+                "error": "transient" if transient else "permanent"}
+    content = body["choices"][0]["message"]["content"]
+    usage = usage_dict(body.get("usage"))
+    return {"response": content, "attempts": 1, "usage": usage,
+            "output_tokens": usage["completion_tokens"] if usage else approx_token_count(content or "")}
+
+
+class BatchLedger:
+    """运行目录下 batches.json：记录已提交的批次，进程重启后继续轮询而不是重复提交"""
+
+    def __init__(self, journal: RunJournal):
+        self.path = journal.dir / "batches.json"
+        self.dir = journal.dir / "batches"
+        self.batches = json.loads(self.path.read_text(encoding='utf-8')) if self.path.exists() else []
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.batches, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+    def pending(self) -> list[dict]:
+        return [batch for batch in self.batches if not batch.get("collected")]
+
+    def covered_rows(self) -> dict[str, set[int]]:
+        """尚未取回结果的批次中已包含的 (模型, 行)"""
+        covered = {}
+        for batch in self.pending():
+            covered.setdefault(batch["model"], set()).update(self.requests(batch))
+        return covered
+
+    def requests(self, batch: dict) -> dict[int, dict]:
+        """批次请求文件中的 {行号: 请求 body}"""
+        requests = {}
+        with open(self.dir / batch["input"], 'r', encoding='utf-8') as f:
+            for line in f:
+                request = json.loads(line)
+                requests[int(request["custom_id"].rsplit(":", 1)[1])] = request["body"]
+        return requests
+
+
+def submit_batches(journal: RunJournal, rows: range, render_chunk, targets: dict[str, dict],
+                   system_prompt: str, temperature: float, max_tokens: int,
+                   cache: ResponseCache = None, skip: dict[str, dict[int, dict]] = None,
+                   chunk_size: int = 500) -> list[dict]:
+    """把还没有结果、也不在已提交批次中的行写成 Batch API 请求文件并提交，返回新提交的批次
+
+    最后一次结果为 transient 错误的行不算完成（见 RunJournal.done_indexes），会随续跑重新提交。
+
+    渲染与 evaluate_to_journal 一样分块进行，每块只渲染一次、写入所有模型的请求文件；
+    响应缓存命中的行直接写入 journal，不进入批次。
+    """
+    ledger = BatchLedger(journal)
+    done = journal.done_indexes()
+    write_skipped(journal, rows, skip, done)
+    covered = ledger.covered_rows()
+    todo = {key: [i for i in rows if i not in done.get(key, ()) and i not in covered.get(key, ())]
+            for key in targets}
+    ledger.dir.mkdir(parents=True, exist_ok=True)
+    files = {}
+    submitted = []
+
+    def flush(key: str):
+        f, path, count = files.pop(key)
+        f.close()
+        if not count:
+            path.unlink()
+            return
+        config = targets[key]
+        batch_id = get_batch_backend(config).submit(path, {"run_id": journal.run_id, "model": key})
+        batch = {"id": batch_id, "model": key, "backend": config.get("batch") or "openai",
+                 "input": path.name, "requests": count, "submitted_at": time.time()}
+        ledger.batches.append(batch)
+        ledger.save()
+        submitted.append(batch)
+
+    all_rows = sorted(set().union(*todo.values())) if todo else []
+    try:
+        for start in range(0, len(all_rows), chunk_size):
+            chunk = all_rows[start:start + chunk_size]
+            prompts = render_chunk(chunk)
+            for key, config in targets.items():
+                wanted = set(todo[key])
+                idx = [j for j, row in enumerate(chunk) if row in wanted]
+                if not idx:
+                    continue
+                hits = {}
+                if cache is not None:
+                    keys = {j: cache.make_key(config["api_base"], config["model_name"], system_prompt, temperature,
+                                             max_tokens, prompts[j])
+                            for j in idx}
+                    cached = cache.get_many(list(keys.values()))
+                    hits = {j: cached[keys[j]] for j in idx if keys[j] in cached}
+                    for j, response in hits.items():
+                        journal.append(chunk[j], {"model": key, "response": response, "time": 0.0, "cached": True})
+                plan = PrefixCachePlan([prompts[j] for j in idx], system_prompt, config.get("prompt_cache") or "auto")
+                for j in idx:
+                    if j in hits:
+                        continue
+                    if key not in files:
+                        path = ledger.dir / f"{_BATCH_FILE_CHARS.sub('_', key)}_{uuid.uuid4().hex[:8]}.jsonl"
+                        files[key] = [open(path, 'w', encoding='utf-8'), path, 0]
+                    f = files[key]
+                    f[0].write(batch_request_line(
+                        f"{key}:{chunk[j]}", config["model_name"], plan.messages(prompts[j], system_prompt),
+                        temperature, max_tokens, plan.extra_body()) + "\n")
+                    f[2] += 1
+                    if f[2] >= BATCH_MAX_REQUESTS:
+                        flush(key)
+        for key in list(files):
+            flush(key)
+    finally:
+        for f, _, _ in files.values():
+            f.close()
+        journal.close()
+    return submitted
+
+
+def collect_batches(journal: RunJournal, targets: dict[str, dict], system_prompt: str = None,
+                    temperature: float = None, max_tokens: int = None,
+                    cache: ResponseCache = None, judge: "JudgePipeline" = None) -> dict:
+    """轮询未取回的批次，已结束的批次把输出按 custom_id 映射回行号写入 journal
+
+    返回 {"pending": 仍在运行的批次数, "collected": 本次写入的结果数, "batches": [状态...]}；
+    批次失败 / 过期 / 取消时没有输出的行记为 transient 错误，下次 submit_batches（续跑）时重新提交。
+    传入 judge 时取回的结果逐条提交评分（prompt 取自批次请求文件）。
+    """
+    ledger = BatchLedger(journal)
+    collected = 0
+    statuses = []
+    try:
+        for batch in ledger.pending():
+            config = targets.get(batch["model"])
+            if config is None:
+                continue
+            backend = get_batch_backend(config)
+            state = backend.poll(batch["id"])
+            statuses.append({"id": batch["id"], "model": batch["model"], **state})
+            if state["status"] not in BATCH_DONE_STATES:
+                continue
+            requests = ledger.requests(batch)
+            elapsed = time.time() - batch["submitted_at"]
+            fresh = {}
+            for record in backend.fetch(batch["id"]):
+                row = int(record["custom_id"].rsplit(":", 1)[1])
+                if row not in requests:
+                    continue
+                result = {"model": batch["model"], "time": elapsed, "batch_id": batch["id"],
+                          **batch_output_result(record)}
+                journal.append(row, result)
+                if "error" not in result:
+                    fresh[row] = result["response"]
+                body = requests.pop(row)
+                if judge is not None:
+                    judge.submit(row, batch["model"], message_text(body["messages"][-1]), result)
+                collected += 1
+            for row in requests:
+                journal.append(row, {"model": batch["model"], "time": elapsed, "batch_id": batch["id"],
+                                     "response": f"[ERROR] 批次 {batch['id']} {state['status']}，未返回结果",
+                                     "attempts": 1, "error": "transient"})
+                collected += 1
+            if cache is not None and fresh:
+                bodies = ledger.requests(batch)
+                cache.put_many({
+                    cache.make_key(config["api_base"], config["model_name"], system_prompt, temperature, max_tokens,
+                                   message_text(bodies[row]["messages"][-1])): response
+                    for row, response in fresh.items()
+                })
+            batch.update(collected=True, status=state["status"], collected_at=time.time())
+            ledger.save()
+    finally:
+        journal.close()
+    return {"pending": len(ledger.pending()), "collected": collected, "batches": statuses}
+
+
+def evaluate_batch_to_journal(journal: RunJournal, rows: range, render_chunk,
+                              targets: dict[str, dict], system_prompt: str, temperature: float,
+                              max_tokens: int, cache: ResponseCache = None,
+                              skip: dict[str, dict[int, dict]] = None, wait: bool = True,
+                              poll_interval: float = 30.0, status_callback=None,
+                              judge: "JudgePipeline" = None) -> dict:
+    """Batch API 模式：提交未完成的行，wait=True 时轮询到全部批次结束并写回 journal
+
+    结果与 evaluate_to_journal 写入同一个 journal、同样的结构，导出和续跑逻辑不变；
+    wait=False 时只提交并轮询一次（页面中由用户手动刷新状态）。
+    status_callback(collect_batches 的返回值) 在每次轮询后调用。
+    """
+    submitted = submit_batches(journal, rows, render_chunk, targets, system_prompt, temperature,
+                               max_tokens, cache, skip)
+    while True:
+        status = collect_batches(journal, targets, system_prompt, temperature, max_tokens, cache, judge)
+        status["submitted"] = len(submitted)
+        if status_callback:
+            status_callback(status)
+        if not wait or not status["pending"]:
+            return status
+        time.sleep(poll_interval)
@@ -0,0 +1,360 @@
+"""命令行：run / pipeline / export 子命令（不依赖 streamlit / pandas）"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import shutil
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from evaluator.batch import evaluate_batch_to_journal
+from evaluator.clients import connection_report, connection_snapshot, format_connection_report
+from evaluator.config import describe_targets, load_model_configs, resolve_targets
+from evaluator.dataset import DatasetReader
+from evaluator.engine import LATENCY_METRICS, StreamMonitor, latency_percentiles, percentile
+from evaluator.export import EXPORT_FORMATS, export_results
+from evaluator.judge import JudgePipeline, load_rubric, summarize_judgments
+from evaluator.pipeline import describe_pipeline, load_pipeline, run_pipeline
+from evaluator.storage import RUNS_DIR, ResponseCache, RunJournal, evaluate_to_journal
+from evaluator.templates import extract_placeholders, render_columns, required_columns
+from evaluator.tokens import precheck_tokens, skipped_results
+
+# ============== 命令行 ==============
+
+def summarize_journal(journal: RunJournal) -> dict[str, dict]:
+    """流式统计 journal 中每个模型的结果
+
+    临时失败的行续跑时会追加新结果，以最后一次为准：只记住仍处于临时失败的行，被重试覆盖时撤销其计数。
+    """
+    stats = {}
+    retried = {}
+    for res in journal.iter_results():
+        item = stats.setdefault(res.get("model"), {
+            "rows": 0, "transient_errors": 0, "permanent_errors": 0, "skipped": 0, "cache_hits": 0,
+            "total_time": 0.0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0
+        })
+        key = (res.get("model"), res["row"])
+        if key in retried:
+            item["rows"] -= 1
+            item["transient_errors"] -= 1
+            item["total_time"] -= retried.pop(key)
+        item["rows"] += 1
+        item["total_time"] += res["time"]
+        if res.get("error") == "transient":
+            retried[key] = res["time"]
+            item["transient_errors"] += 1
+        elif res.get("error") == "permanent":
+            item["permanent_errors"] += 1
+        elif res.get("error") == "overflow":
+            item["skipped"] += 1
+        item["cache_hits"] += bool(res.get("cached"))
+        for field, value in (res.get("usage") or {}).items():
+            item[field] = item.get(field, 0) + value
+    for item in stats.values():
+        item["avg_latency"] = item.pop("total_time") / item["rows"]
+    return stats
+
+
+def print_precheck(report: dict):
+    for key, item in report["models"].items():
+        cost = f"，预估费用 {item['cost']:.4f}" if item["cost"] is not None else ""
+        print(f"🧮 {key}: 输入 {item['input_tokens']:,} tokens（单条最多 {item['max_input']:,}），"
+              f"输出上限 {item['output_tokens']:,} tokens{cost}  [{item['tokenizer']}]")
+        if item["tokenizer_fallback"]:
+            print(f"   ⚠️ 分词器加载失败，使用近似计数: {item['tokenizer_fallback']}", file=sys.stderr)
+        if item["over_budget"]:
+            sample = ", ".join(map(str, list(item["over_budget"])[:10]))
+            print(f"   ⚠️ {len(item['over_budget'])} 行超出上下文窗口 {item['context_window']}，"
+                  f"将跳过不调用: {sample}{' ...' if len(item['over_budget']) > 10 else ''}", file=sys.stderr)
+
+
+def print_judgments(journal: RunJournal, meta: dict):
+    if not meta.get("judge"):
+        return
+    for key, stats in summarize_judgments(journal).items():
+        averages = stats["averages"]
+        dims = " / ".join(f"{dim} {averages[dim]:.2f}" for dim in meta["judge"]["dimensions"] if dim in averages)
+        weighted = f"{averages['weighted']:.2f}" if "weighted" in averages else "-"
+        print(f"⚖️ {key}: 已评分 {stats['judged']} 条，评分失败 {stats['failed']} 条，"
+              f"平均加权分 {weighted}（{dims or '-'}）")
+
+
+def cli(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m prompt_evaluator", description="Prompt 批量评估（命令行）",
+                                     epilog="页面版请用 streamlit run prompt_evaluator.py 启动")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="批量评估，结果逐条写入运行日志")
+    p_run.add_argument("--template", required=True, help="User Prompt 模板文件")
+    p_run.add_argument("--system", help="System Prompt 文件（可选）")
+    p_run.add_argument("--dataset", required=True, help="评估集 (csv / jsonl / parquet / xlsx / xls / json)")
+    p_run.add_argument("--mapping", help="占位符映射 JSON 文件，缺省时按同名字段映射")
+    p_run.add_argument("--model", nargs="+", help="model_configs.json 中的配置名称，可指定多个同时对比，缺省用默认模型")
+    p_run.add_argument("--start", type=int, default=0, help="起始行")
+    p_run.add_argument("--end", type=int, help="结束行（包含），缺省到最后一行")
+    p_run.add_argument("--temperature", type=float, default=0.7)
+    p_run.add_argument("--max-tokens", type=int, default=2000)
+    p_run.add_argument("--engine", choices=["thread", "async", "batch"], default="async",
+                       help="batch 使用 Batch API：提交后轮询到全部批次结束（可中断，--resume 继续轮询）")
+    p_run.add_argument("--poll-interval", type=float, default=30.0, help="batch 模式的轮询间隔（秒）")
+    p_run.add_argument("--concurrency", type=int, default=128, help="线程数或异步并发上限")
+    p_run.add_argument("--no-cache", action="store_true", help="不使用响应缓存")
+    p_run.add_argument("--precheck", action="store_true", help="只做 token 预检并打印估算，不调用 API")
+    p_run.add_argument("--stream", action="store_true", help="使用流式接口，记录首 token 延迟和生成速度")
+    p_run.add_argument("--judge", metavar="EVALUATION_MD",
+                       help="按模块 evaluation.md 中的 LLM Judge prompt 为每条结果评分（与生成并行）")
+    p_run.add_argument("--judge-model", help="评分用的模型配置名称，缺省用第一个被评模型")
+    p_run.add_argument("--judge-workers", type=int, default=8, help="评分并发数")
+    p_run.add_argument("--resume", metavar="RUN_ID", help="续跑已有运行")
+    p_run.add_argument("--runs-dir", default=str(RUNS_DIR), help="运行日志目录")
+    p_pipeline = sub.add_parser("pipeline", help="多阶段流水线：上游阶段的输出填入下游阶段的占位符")
+    p_pipeline.add_argument("--spec", help="流水线定义 JSON（见 load_pipeline），续跑时可省略")
+    p_pipeline.add_argument("--dataset", required=True, help="评估集 (csv / jsonl / parquet / xlsx / xls / json)")
+    p_pipeline.add_argument("--model", help="未指定 model 的阶段使用的模型配置，缺省用默认模型")
+    p_pipeline.add_argument("--start", type=int, default=0, help="起始行")
+    p_pipeline.add_argument("--end", type=int, help="结束行（包含），缺省到最后一行")
+    p_pipeline.add_argument("--temperature", type=float, default=0.7)
+    p_pipeline.add_argument("--max-tokens", type=int, default=2000)
+    p_pipeline.add_argument("--concurrency", type=int, default=16, help="所有阶段共享的并发调用上限")
+    p_pipeline.add_argument("--no-cache", action="store_true", help="不使用响应缓存")
+    p_pipeline.add_argument("--resume", metavar="RUN_ID", help="续跑已有的流水线运行")
+    p_pipeline.add_argument("--runs-dir", default=str(RUNS_DIR), help="运行日志目录")
+    p_export = sub.add_parser("export", help="把运行结果导出为 Excel / Parquet / JSONL")
+    p_export.add_argument("run_id", help="要导出的 Run ID")
+    p_export.add_argument("--format", choices=list(EXPORT_FORMATS), default="xlsx")
+    p_export.add_argument("--dataset", help="拼接原始字段用的评估集，缺省用运行创建时记录的路径")
+    p_export.add_argument("--output", help="输出路径，缺省只打印运行目录下的导出文件")
+    p_export.add_argument("--runs-dir", default=str(RUNS_DIR), help="运行日志目录")
+    if not (sys.argv[1:] if argv is None else argv):
+        parser.print_help(sys.stderr)
+        return 2
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        return cli_export(args)
+    if args.command == "pipeline":
+        return cli_pipeline(args)
+
+    dataset = DatasetReader(args.dataset)
+    if args.resume:
+        journal = RunJournal(args.resume, args.runs_dir)
+        if not journal.exists():
+            print(f"❌ 未找到运行: {args.resume}", file=sys.stderr)
+            return 2
+        meta = journal.read_meta()
+        model_keys = list(meta["models"])
+    else:
+        model_keys = args.model or [load_model_configs().get("default")]
+        template = Path(args.template).read_text(encoding='utf-8')
+        if args.mapping:
+            mapping = json.loads(Path(args.mapping).read_text(encoding='utf-8'))
+        else:
+            mapping = {p: p for p in extract_placeholders(template)}
+        end = len(dataset) - 1 if args.end is None else min(args.end, len(dataset) - 1)
+        meta = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "template": template,
+            "mapping": mapping,
+            "system_prompt": Path(args.system).read_text(encoding='utf-8') if args.system else "",
+            "models": {},
+            "temperature": args.temperature,
+            "max_tokens": args.max_tokens,
+            "start_idx": args.start,
+            "end_idx": end,
+            "stream": args.stream,
+            "engine": args.engine,
+            "concurrency": None if args.engine == "batch" else args.concurrency,
+            "dataset": str(Path(args.dataset).resolve()),
+            "dataset_rows": len(dataset)
+        }
+        journal = RunJournal(runs_dir=args.runs_dir)
+
+    try:
+        targets = resolve_targets(model_keys)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    if not args.resume:
+        meta["models"] = describe_targets(targets)
+    if args.judge:
+        try:
+            meta["judge"] = {**load_rubric(args.judge), "model": args.judge_model or model_keys[0]}
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 2
+    judge_config = None
+    if meta.get("judge"):
+        try:
+            judge_config = resolve_targets([meta["judge"]["model"]])[meta["judge"]["model"]]
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 2
+
+    rows = range(meta["start_idx"], meta["end_idx"] + 1)
+    report = precheck_tokens(meta["template"], meta["mapping"], dataset, rows, meta["system_prompt"],
+                             targets, meta["max_tokens"])
+    print_precheck(report)
+    if args.precheck:
+        return 0
+    if not args.resume or args.judge:
+        journal.write_meta(meta)
+
+    print(f"🆔 Run ID: {journal.run_id}  ({journal.results_path})")
+    if args.resume:
+        done, retries = journal.done_indexes(), journal.retry_indexes()
+        remaining = sum(1 for key in targets for i in rows if i not in done.get(key, ()))
+        retrying = sum(1 for key in targets for i in rows if i in retries.get(key, ()))
+        print(f"🔁 续跑：剩余 {remaining} 次调用，其中 {retrying} 次为临时失败（429 / 超时 / 5xx）重试")
+    columns = required_columns(meta["template"], meta["mapping"], dataset.columns)
+    render_chunk = lambda idx: render_columns(meta["template"], meta["mapping"], dataset.fetch(idx, columns), len(idx))
+    cache = None if args.no_cache else ResponseCache()
+    judge = None
+    if judge_config is not None:
+        judge = JudgePipeline(journal, meta["judge"], judge_config, args.judge_workers, cache)
+        print(f"⚖️ 评分: {meta['judge']['name']}（{meta['judge']['model']}），"
+              f"维度 {', '.join(f'{d} {w:g}' for d, w in meta['judge']['weights'].items())}")
+        judge.backfill(rows, render_chunk)
+    start_time = time.perf_counter()
+    connections = connection_snapshot()
+    # batch 运行续跑时继续轮询已提交的批次
+    if args.engine == "batch" or meta.get("engine") == "batch":
+        def print_status(status):
+            for batch in status["batches"]:
+                print(f"📨 {batch['model']} {batch['id']}: {batch['status']} "
+                      f"({batch['completed']}/{batch['total']}，失败 {batch['failed']})")
+        try:
+            status = evaluate_batch_to_journal(
+                journal, rows, render_chunk,
+                targets, meta["system_prompt"] or None, meta["temperature"], meta["max_tokens"],
+                cache=cache,
+                skip=skipped_results(report, meta["max_tokens"]),
+                poll_interval=args.poll_interval, status_callback=print_status, judge=judge
+            )
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 2
+        finally:
+            if judge is not None:
+                judge.close()
+        print(f"✅ 新提交 {status['submitted']} 个批次，用时 {time.perf_counter() - start_time:.1f}s")
+        print_judgments(journal, meta)
+        return 0
+    try:
+        finished = evaluate_to_journal(
+            journal, rows, render_chunk,
+            targets, meta["system_prompt"] or None,
+            meta["temperature"], meta["max_tokens"], args.concurrency,
+            engine=args.engine,
+            cache=cache,
+            skip=skipped_results(report, meta["max_tokens"]),
+            monitor=StreamMonitor() if meta.get("stream") else None,
+            judge=judge
+        )
+    finally:
+        if judge is not None:
+            judge.close()
+    elapsed = time.perf_counter() - start_time
+
+    print(f"✅ 本次完成 {finished} 次调用，用时 {elapsed:.1f}s，{finished / elapsed if elapsed else 0:.1f} calls/sec")
+    for key, stats in summarize_journal(journal).items():
+        print(f"📊 {key}: 累计 {stats['rows']} 条，临时失败 {stats['transient_errors']} 条，"
+              f"永久失败 {stats['permanent_errors']} 条，超出上下文跳过 {stats['skipped']} 条，"
+              f"缓存命中 {stats['cache_hits']} 条，"
+              f"平均耗时 {stats['avg_latency']:.2f}s")
+        if stats["prompt_tokens"]:
+            print(f"   输入 {stats['prompt_tokens']:,} tokens，前缀缓存命中 {stats['cached_tokens']:,} "
+                  f"({stats['cached_tokens'] / stats['prompt_tokens']:.0%})，输出 {stats['completion_tokens']:,} tokens")
+    for key, metrics in latency_percentiles(journal.iter_results()).items():
+        parts = [f"{LATENCY_METRICS[metric]} " + " / ".join("-" if v is None else f"{v:.2f}" for v in values)
+                 for metric, values in metrics.items() if values[0] is not None]
+        print(f"⏱️ {key} p50 / p95 / p99: {'；'.join(parts)}")
+    for line in format_connection_report(connection_report(connections, connection_snapshot())):
+        print(f"🔌 {line}")
+    print_judgments(journal, meta)
+    return 0
+
+
+def cli_pipeline(args) -> int:
+    dataset = DatasetReader(args.dataset)
+    if args.resume:
+        journal = RunJournal(args.resume, args.runs_dir)
+        if not journal.exists() or journal.read_meta().get("engine") != "pipeline":
+            print(f"❌ 未找到流水线运行: {args.resume}", file=sys.stderr)
+            return 2
+        meta = journal.read_meta()
+    elif not args.spec:
+        print("❌ 新建流水线运行需要 --spec", file=sys.stderr)
+        return 2
+    else:
+        try:
+            pipeline = load_pipeline(args.spec, args.model or load_model_configs().get("default"))
+            models = describe_pipeline(pipeline)
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 2
+        end = len(dataset) - 1 if args.end is None else min(args.end, len(dataset) - 1)
+        meta = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "template": "",
+            "mapping": {},
+            "system_prompt": "",
+            "pipeline": pipeline,
+            "models": models,
+            "temperature": args.temperature,
+            "max_tokens": args.max_tokens,
+            "start_idx": args.start,
+            "end_idx": end,
+            "engine": "pipeline",
+            "dataset": str(Path(args.dataset).resolve()),
+            "dataset_rows": len(dataset)
+        }
+        journal = RunJournal(runs_dir=args.runs_dir)
+        journal.write_meta(meta)
+
+    stages = meta["pipeline"]["stages"]
+    print(f"🆔 Run ID: {journal.run_id}  ({journal.results_path})")
+    print("🔗 " + "  ".join(f"{name}{'←' + ','.join(stage['deps']) if stage['deps'] else ''}"
+                           for name, stage in stages.items()))
+    start_time = time.perf_counter()
+    connections = connection_snapshot()
+    try:
+        stats = run_pipeline(journal, meta["pipeline"], dataset, range(meta["start_idx"], meta["end_idx"] + 1),
+                             meta["temperature"], meta["max_tokens"], args.concurrency,
+                             cache=None if args.no_cache else ResponseCache())
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - start_time
+
+    print(f"✅ 本次完成 {stats['calls']} 次调用（缓存命中 {stats['cache_hits']}），按条件跳过 {stats['skipped']} 个阶段，"
+          f"失败 {stats['errors']} 次，{stats['blocked']} 行因上游失败未走完，用时 {elapsed:.1f}s")
+    latencies = sorted(stats["row_latency"])
+    if latencies:
+        print(f"⏱️ 单行端到端 p50 / p95 / p99: " + " / ".join(f"{percentile(latencies, q):.2f}s" for q in (50, 95, 99))
+              + f"（{len(latencies)} 行）")
+    percentiles = latency_percentiles(journal.iter_results())
+    for name in stages:
+        if name in percentiles and percentiles[name]["time"][0] is not None:
+            values = percentiles[name]["time"]
+            print(f"   {name:<16} 阶段耗时 p50 / p95 / p99: " + " / ".join(f"{v:.2f}s" for v in values))
+    for line in format_connection_report(connection_report(connections, connection_snapshot())):
+        print(f"🔌 {line}")
+    return 0
+
+
+def cli_export(args) -> int:
+    journal = RunJournal(args.run_id, args.runs_dir)
+    if not journal.exists():
+        print(f"❌ 未找到运行: {args.run_id}", file=sys.stderr)
+        return 2
+    dataset_path = args.dataset or journal.read_meta().get("dataset")
+    dataset = DatasetReader(dataset_path) if dataset_path and Path(dataset_path).exists() else None
+    if dataset is None:
+        print("⚠️ 未找到评估集，导出文件不包含 [原] 字段", file=sys.stderr)
+    path = export_results(journal, dataset, args.format)
+    if args.output:
+        shutil.copyfile(path, args.output)
+        path = Path(args.output)
+    print(f"📦 已导出: {path}")
+    return 0
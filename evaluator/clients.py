@@ -0,0 +1,233 @@
+"""进程内共享的 OpenAI 客户端与 HTTP 连接池"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient
+
+# ============== HTTP 连接池 ==============
+
+# 每个 endpoint 保留的空闲连接数下限；实际按并发设置扩大
+MIN_POOL_SIZE = 16
+# 空闲连接的保留时间：两次运行（以及 UI 两次点击）之间复用已完成 TLS 握手的连接
+KEEPALIVE_EXPIRY = 120.0
+
+
+def _httpx():
+    """openai 1.x 基于 httpx，新版 SDK 改为接口相同的 httpx2"""
+    try:
+        import httpx
+    except ImportError:
+        import httpx2 as httpx
+    return httpx
+
+
+def http2_available() -> bool:
+    """HTTP/2 需要 h2 包（pip install h2）；开启后按 TLS ALPN 协商，endpoint 不支持时仍走 HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ConnectionStats:
+    """同一 endpoint 的连接复用统计，由 httpcore 的 trace 扩展采集
+
+    每个请求发出请求头之前若经历过 connect_tcp，记为新建连接，
+    从 connect_tcp 开始到发出请求头的耗时记为握手时间（TCP + TLS，HTTP/2 还包括连接前导）；
+    否则记为复用了连接池中的空闲连接（HTTP/2 下也包括同一连接上的多路复用）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.handshake_time = 0.0
+
+    def record(self, handshake: float = None):
+        with self._lock:
+            self.requests += 1
+            if handshake is not None:
+                self.connections += 1
+                self.handshake_time += handshake
+
+    def tracer(self):
+        """单个请求的 trace 回调"""
+        connect_started = None
+
+        def trace(event: str, info: dict):
+            nonlocal connect_started
+            if event.endswith("connect_tcp.started"):
+                connect_started = time.perf_counter()
+            elif event.endswith("send_request_headers.started"):
+                self.record(None if connect_started is None else time.perf_counter() - connect_started)
+
+        return trace
+
+    def snapshot(self) -> tuple[int, int, float]:
+        with self._lock:
+            return self.requests, self.connections, self.handshake_time
+
+
+class ClientRegistry:
+    """按 (api_base, api_key) 复用 OpenAI 客户端及其连接池
+
+    每次运行都新建客户端时，连接池随客户端丢弃，下一次运行（以及 UI 的下一次点击）要重新握手；
+    SDK 默认的空闲连接数也小于常用的并发设置，并发高时多出的连接用完即关。
+    这里每个 endpoint 一个客户端，空闲连接数不小于调用方的并发设置（需要更大时重建），
+    连接总数不设上限，线程不会因为等待连接而排队；h2 可用时开启 HTTP/2。
+    异步客户端的连接绑定事件循环：所有异步调用都在注册表常驻的后台事件循环中执行（run），
+    异步客户端同样按 (api_base, api_key) 在该循环上复用，并与同步客户端共用连接统计。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._async_clients = {}
+        self._stats = {}
+        self._loop = None
+
+    @staticmethod
+    def _key(api_base: str) -> str:
+        return str(api_base).rstrip("/")
+
+    def stats(self, api_base: str) -> ConnectionStats:
+        with self._lock:
+            return self._stats.setdefault(self._key(api_base), ConnectionStats())
+
+    def _http_options(self, api_base: str, pool_size: int) -> dict:
+        limits = _httpx().Limits(max_connections=None, max_keepalive_connections=pool_size,
+                                 keepalive_expiry=KEEPALIVE_EXPIRY)
+        return {"limits": limits, "http2": http2_available()}
+
+    def get(self, api_base: str, api_key: str, pool_size: int = MIN_POOL_SIZE) -> OpenAI:
+        """共享的同步客户端（max_retries=0，重试由调用方控制）"""
+        pool_size = max(pool_size, MIN_POOL_SIZE)
+        key = (self._key(api_base), api_key)
+        stats = self.stats(api_base)
+        with self._lock:
+            size, client = self._clients.get(key, (0, None))
+            if client is not None and size >= pool_size:
+                return client
+
+            def hook(request):
+                request.extensions["trace"] = stats.tracer()
+
+            # 旧客户端可能仍有在途请求，不主动关闭，随引用释放回收
+            client = OpenAI(base_url=api_base, api_key=api_key, max_retries=0, http_client=DefaultHttpxClient(
+                event_hooks={"request": [hook]}, **self._http_options(api_base, pool_size)))
+            self._clients[key] = (pool_size, client)
+            return client
+
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """常驻的后台事件循环（首次使用时启动）"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="async-clients", daemon=True).start()
+            return self._loop
+
+    def run(self, coro):
+        """在常驻事件循环中执行协程，阻塞调用线程直到完成"""
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop())
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+    def get_async(self, api_base: str, api_key: str, pool_size: int = MIN_POOL_SIZE) -> AsyncOpenAI:
+        """共享的异步客户端，只能在 run() 执行的协程中使用"""
+        pool_size = max(pool_size, MIN_POOL_SIZE)
+        key = (self._key(api_base), api_key)
+        stats = self.stats(api_base)
+        with self._lock:
+            size, client = self._async_clients.get(key, (0, None))
+            if client is not None and size >= pool_size:
+                return client
+
+            async def hook(request):
+                trace = stats.tracer()
+
+                async def atrace(event: str, info: dict):
+                    trace(event, info)
+
+                request.extensions["trace"] = atrace
+
+            client = AsyncOpenAI(base_url=api_base, api_key=api_key, max_retries=0,
+                                 http_client=DefaultAsyncHttpxClient(
+                                     event_hooks={"request": [hook]}, **self._http_options(api_base, pool_size)))
+            self._async_clients[key] = (pool_size, client)
+            return client
+
+    def snapshot(self) -> dict[str, tuple[int, int, float]]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {api_base: item.snapshot() for api_base, item in stats.items()}
+
+
+_CLIENTS = ClientRegistry()
+
+
+def use_client_registry(registry: ClientRegistry):
+    """替换进程内的客户端注册表（UI 每次 rerun 都会重新执行模块，用 st.cache_resource 保存的实例替换）"""
+    global _CLIENTS
+    _CLIENTS = registry
+
+
+def client_registry() -> ClientRegistry:
+    """当前进程使用的客户端注册表（可能已被 use_client_registry 替换，不要在导入时缓存）"""
+    return _CLIENTS
+
+
+def get_client(api_base: str, api_key: str, pool_size: int = MIN_POOL_SIZE) -> OpenAI:
+    """进程内按 (api_base, api_key) 共享的客户端"""
+    return _CLIENTS.get(api_base, api_key, pool_size)
+
+
+def client_for(config: dict, pool_size: int = MIN_POOL_SIZE) -> OpenAI:
+    """模型配置对应的共享客户端；配置了 timeout 时返回使用该超时的副本（共用连接池）"""
+    client = get_client(config["api_base"], config["api_key"], pool_size)
+    return client.with_options(timeout=config["timeout"]) if config.get("timeout") else client
+
+
+def model_concurrency(config: dict, max_workers: int) -> int:
+    """运行设置的并发与模型配置的 max_concurrency 取较小值"""
+    return min(max_workers, config.get("max_concurrency") or max_workers)
+
+
+def connection_report(before: dict, after: dict) -> dict[str, dict]:
+    """两次 ClientRegistry.snapshot() 之间各 endpoint 的连接情况
+
+    返回 {api_base: {"requests", "connections", "reuse_rate", "handshake_ms"（新建连接的平均握手毫秒）}}，
+    期间没有请求的 endpoint 不列出。
+    """
+    report = {}
+    for api_base, (requests, connections, handshake) in after.items():
+        requests0, connections0, handshake0 = before.get(api_base, (0, 0, 0.0))
+        requests, connections = requests - requests0, connections - connections0
+        if not requests:
+            continue
+        report[api_base] = {
+            "requests": requests,
+            "connections": connections,
+            "reuse_rate": 1 - connections / requests,
+            "handshake_ms": (handshake - handshake0) / connections * 1000 if connections else None,
+        }
+    return report
+
+
+def connection_snapshot() -> dict:
+    return _CLIENTS.snapshot()
+
+
+def format_connection_report(report: dict[str, dict]) -> list[str]:
+    """connection_report 的每个 endpoint 一行"""
+    return [f"{api_base}: {item['requests']} 次请求，新建连接 {item['connections']} 个，"
+            f"复用率 {item['reuse_rate']:.0%}"
+            + (f"，平均握手 {item['handshake_ms']:.0f}ms" if item["handshake_ms"] is not None else "")
+            for api_base, item in report.items()]
@@ -0,0 +1,203 @@
+"""模型配置：model_configs.json 的读写与多进程同步"""
+
+from __future__ import annotations
+
+import copy
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from rewrite_engine import atomic_write
+
+# 仓库根目录：配置、缓存与运行日志都放在这里
+BASE_DIR = Path(__file__).parent.parent
+
+# ============== 配置管理 ==============
+
+CONFIG_FILE = BASE_DIR / "model_configs.json"
+# 距上次检查不足该秒数时直接使用内存中的配置，不 stat 文件
+CONFIG_CHECK_INTERVAL = 1.0
+# 运行时限制：max_concurrency 为该模型的并发上限，rpm / tpm 为该 api_base 的限流，timeout 为单次请求超时（秒）
+MODEL_LIMITS = ("max_concurrency", "rpm", "tpm", "timeout")
+
+
+@contextmanager
+def file_lock(path: Path):
+    """跨进程的排他文件锁（锁文件与被保护的文件分开，原子替换后锁仍然有效）"""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class ModelRegistry:
+    """model_configs.json 的内存缓存
+
+    读取时按文件的 (mtime, size) 判断是否需要重新解析，距上次检查不足 CONFIG_CHECK_INTERVAL 秒时
+    连 stat 也省掉，引擎在热路径上取模型配置（含 MODEL_LIMITS）不访问磁盘。
+    修改在进程内锁和文件锁下以最新的文件内容为准读-改-写，再原子替换，
+    多个 Streamlit 会话或多个进程同时修改时不会丢失彼此的改动。
+    缓存的配置只整体替换、不原地修改；load() 返回副本。
+    """
+
+    def __init__(self, path: Path = None):
+        # 缺省跟随模块级 CONFIG_FILE
+        self._path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._data = None
+        self._source = None
+        self._stamp = None
+        self._checked = 0.0
+
+    @property
+    def path(self) -> Path:
+        return self._path or CONFIG_FILE
+
+    @property
+    def lock_path(self) -> Path:
+        return self.path.with_name(f".{self.path.name}.lock")
+
+    def _file_stamp(self):
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"models": {}, "default": None}
+
+    def snapshot(self) -> dict:
+        """当前配置（只读，调用方不要修改）"""
+        now = time.monotonic()
+        data = self._data
+        if data is not None and self._source == self.path and now - self._checked < CONFIG_CHECK_INTERVAL:
+            return data
+        with self._lock:
+            stamp = self._file_stamp()
+            if self._data is None or self._source != self.path or stamp != self._stamp:
+                self._data = self._read()
+                self._source = self.path
+                self._stamp = stamp
+            self._checked = now
+            return self._data
+
+    def load(self) -> dict:
+        return copy.deepcopy(self.snapshot())
+
+    def update(self, change) -> dict:
+        """change(configs) 原地修改最新配置，返回 True 时写回文件"""
+        with self._lock, file_lock(self.lock_path):
+            configs = self._read()
+            if change(configs):
+                atomic_write(str(self.path), json.dumps(configs, ensure_ascii=False, indent=2))
+            self._data = configs
+            self._source = self.path
+            self._stamp = self._file_stamp()
+            self._checked = time.monotonic()
+            return configs
+
+
+_MODEL_REGISTRY = ModelRegistry()
+
+
+def load_model_configs() -> dict:
+    """加载模型配置"""
+    return _MODEL_REGISTRY.load()
+
+def save_model_configs(configs: dict):
+    """整体覆盖保存模型配置（增删单个模型请用 add_model_config / delete_model_config）"""
+    def replace(current: dict) -> bool:
+        current.clear()
+        current.update(copy.deepcopy(configs))
+        return True
+
+    _MODEL_REGISTRY.update(replace)
+
+def get_model_list() -> list[str]:
+    """获取所有模型名称列表"""
+    return list(_MODEL_REGISTRY.snapshot().get("models", {}).keys())
+
+def get_model_config(model_key: str) -> dict:
+    """获取指定模型的配置"""
+    return dict(_MODEL_REGISTRY.snapshot().get("models", {}).get(model_key, {}))
+
+def add_model_config(name: str, api_base: str, api_key: str, model_name: str, description: str = "",
+                     rpm: int = None, tpm: int = None, context_window: int = None,
+                     price_input: float = None, price_output: float = None, tokenizer: str = None,
+                     prompt_cache: str = None, batch: str = None, max_concurrency: int = None,
+                     timeout: float = None):
+    """添加新的模型配置
+
+    可选项：rpm / tpm 为该 api_base 的每分钟请求数 / token 数上限；max_concurrency 为该模型的并发上限
+    （低于运行设置的并发时生效）；timeout 为单次请求超时（秒）；context_window 为上下文窗口 (token)；
+    price_input / price_output 为每百万输入 / 输出 token 的单价；tokenizer 见 get_token_counter；
+    prompt_cache 为前缀缓存方式，见 PROMPT_CACHE_MODES；batch 为 Batch API 后端，见 BATCH_BACKENDS。
+    """
+    config = {
+        "api_base": api_base,
+        "api_key": api_key,
+        "model_name": model_name,
+        "description": description
+    }
+    optional = {"rpm": rpm, "tpm": tpm, "max_concurrency": max_concurrency, "timeout": timeout,
+                "context_window": context_window, "price_input": price_input,
+                "price_output": price_output, "tokenizer": tokenizer, "prompt_cache": prompt_cache,
+                "batch": batch}
+    config.update({k: v for k, v in optional.items() if v})
+
+    def add(configs: dict) -> bool:
+        configs.setdefault("models", {})[name] = config
+        if not configs.get("default"):
+            configs["default"] = name
+        return True
+
+    _MODEL_REGISTRY.update(add)
+
+def resolve_targets(model_keys: list[str]) -> dict[str, dict]:
+    """把配置名列表解析为 {配置名: 模型配置}（内存中的配置，不读文件）"""
+    models = _MODEL_REGISTRY.snapshot().get("models", {})
+    missing = [key for key in model_keys if key not in models]
+    if missing:
+        raise ValueError(f"未找到模型配置: {', '.join(map(str, missing))}")
+    return {key: dict(models[key]) for key in model_keys}
+
+
+def describe_targets(targets: dict[str, dict]) -> dict[str, dict]:
+    """去掉 api_key 后写入运行记录"""
+    return {
+        key: {"model_name": config.get("model_name"), "api_base": config.get("api_base")}
+        for key, config in targets.items()
+    }
+
+
+def delete_model_config(name: str):
+    """删除模型配置"""
+    def delete(configs: dict) -> bool:
+        if name not in configs.get("models", {}):
+            return False
+        del configs["models"][name]
+        if configs.get("default") == name:
+            configs["default"] = list(configs["models"].keys())[0] if configs["models"] else None
+        return True
+
+    _MODEL_REGISTRY.update(delete)
@@ -0,0 +1,175 @@
+"""评估集读取：按需读取 CSV / JSONL / Parquet / Excel 的指定行和列"""
+
+from __future__ import annotations
+
+import csv
+import json
+import os
+import shutil
+from itertools import islice
+from pathlib import Path
+
+from evaluator.config import BASE_DIR
+
+# ============== 数据集读取 ==============
+
+DATASET_TYPES = ["csv", "jsonl", "parquet", "xlsx", "xls", "json"]
+
+UPLOAD_DIR = BASE_DIR / ".eval_cache" / "uploads"
+
+_END = object()
+
+
+class DatasetReader:
+    """按行号流式读取评估集，不把整个文件读进内存
+
+    parquet 通过 pyarrow 只解码需要的列，并从包含起始行的 row group 开始读；
+    csv / jsonl / xlsx 顺序扫描，jsonl 只解析被请求的行。按升序请求行号时游标连续前进，不会回头重读。
+    xls / json 无法流式解析，首次访问时整体读入。
+    fetch 返回列式数据 {列名: [值, ...]}，可直接交给 render_columns。
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.format = self.path.suffix.lower().lstrip(".")
+        if self.format == "xlsm":
+            self.format = "xlsx"
+        if self.format not in DATASET_TYPES:
+            raise ValueError(f"不支持的评估集格式: {self.path.suffix}")
+        self._columns = None
+        self._num_rows = None
+        self._rows = None
+        self._cursor = None
+
+    # ----- 元信息 -----
+
+    @property
+    def columns(self) -> list[str]:
+        if self._columns is None:
+            if self.format == "parquet":
+                import pyarrow.parquet as pq
+                self._columns = list(pq.ParquetFile(self.path).schema_arrow.names)
+            else:
+                first = next(self._scan(None)[1], _END)
+                # csv / xlsx 在扫描时已读取表头
+                if self._columns is None:
+                    self._columns = list(self._decode(first).keys()) if first is not _END else []
+        return self._columns
+
+    def __len__(self) -> int:
+        if self._num_rows is None:
+            if self.format == "parquet":
+                import pyarrow.parquet as pq
+                self._num_rows = pq.ParquetFile(self.path).metadata.num_rows
+            else:
+                self._num_rows = sum(1 for _ in self._scan(None)[1])
+        return self._num_rows
+
+    # ----- 读取 -----
+
+    def head(self, n: int = 10) -> dict[str, list]:
+        return self.fetch(range(min(n, len(self))))
+
+    def row(self, idx: int) -> dict:
+        data = self.fetch([idx])
+        return {col: values[0] for col, values in data.items()}
+
+    def fetch(self, indexes, columns: list[str] = None) -> dict[str, list]:
+        """读取指定行号（可只读部分列），不存在的行对应值为 None"""
+        indexes = list(indexes)
+        columns = list(columns) if columns is not None else self.columns
+        key = tuple(columns) if self.format == "parquet" else None
+        found = {}
+        wanted = sorted(set(indexes))
+        if wanted:
+            cursor = self._cursor
+            if cursor is None or cursor["key"] != key or wanted[0] < cursor["pos"]:
+                pos, it = self._scan(columns, wanted[0])
+                cursor = self._cursor = {"key": key, "pos": pos, "it": it}
+            for idx in wanted:
+                raw = next(islice(cursor["it"], idx - cursor["pos"], None), _END)
+                if raw is _END:
+                    cursor["pos"] = float("inf")
+                    break
+                cursor["pos"] = idx + 1
+                found[idx] = self._decode(raw)
+        return {
+            col: [found[i].get(col) if i in found else None for i in indexes]
+            for col in columns
+        }
+
+    def _decode(self, raw) -> dict:
+        if self.format == "jsonl":
+            return json.loads(raw)
+        return raw
+
+    def _scan(self, columns: list[str] = None, start: int = 0):
+        """返回 (第一条记录的行号, 记录迭代器)"""
+        if self.format == "parquet":
+            return self._scan_parquet(columns, start)
+        if self.format in ("xls", "json"):
+            if self._rows is None:
+                if self.format == "xls":
+                    import pandas as pd
+                    self._rows = pd.read_excel(self.path).to_dict("records")
+                else:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        self._rows = json.load(f)
+            return 0, iter(self._rows)
+        return 0, getattr(self, f"_iter_{self.format}")()
+
+    def _scan_parquet(self, columns: list[str], start: int):
+        import pyarrow.parquet as pq
+        pf = pq.ParquetFile(self.path)
+        offset = 0
+        first_group = 0
+        for i in range(pf.metadata.num_row_groups):
+            rows = pf.metadata.row_group(i).num_rows
+            if offset + rows > start:
+                break
+            offset += rows
+            first_group = i + 1
+
+        def records():
+            for batch in pf.iter_batches(batch_size=1024, columns=columns,
+                                         row_groups=range(first_group, pf.metadata.num_row_groups)):
+                yield from batch.to_pylist()
+        return offset, records()
+
+    def _iter_csv(self):
+        with open(self.path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            self._columns = header
+            for values in reader:
+                yield dict(zip(header, values))
+
+    def _iter_jsonl(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield line
+
+    def _iter_xlsx(self):
+        from openpyxl import load_workbook
+        workbook = load_workbook(self.path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(h) for h in next(rows, ())]
+            self._columns = header
+            for values in rows:
+                yield dict(zip(header, values))
+        finally:
+            workbook.close()
+
+
+def save_upload(name: str, fileobj, file_id: str) -> Path:
+    """把上传的评估集落盘，供 DatasetReader 流式读取"""
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    path = UPLOAD_DIR / f"{file_id}{Path(name).suffix.lower()}"
+    if not path.exists():
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+        os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,664 @@
+"""评估引擎：线程池与异步引擎、前缀缓存和流式延迟指标"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import math
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from typing import TYPE_CHECKING
+
+from openai import OpenAI, AsyncOpenAI, APIConnectionError
+
+from evaluator.clients import client_for, client_registry, model_concurrency
+from evaluator.ratelimit import (EndpointScheduler, estimate_request_tokens, get_scheduler, is_rate_limited,
+                                 is_transient_error, retry_delay, used_request_tokens)
+from evaluator.tokens import approx_token_count
+
+if TYPE_CHECKING:
+    from evaluator.storage import ResponseCache
+
+# ============== 同步引擎 ==============
+
+def build_messages(prompt: str, system_prompt: str = None) -> list[dict]:
+    """构造 chat.completions 的 messages 参数"""
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def call_llm(client: OpenAI, model: str, prompt: str, system_prompt: str = None, 
+             temperature: float = 0.7, max_tokens: int = 2000,
+             scheduler: "EndpointScheduler" = None, max_retries: int = 5) -> tuple[str, float]:
+    """调用 LLM API，返回 (响应内容, 耗时秒数)"""
+    result = call_llm_result(client, model, prompt, system_prompt, temperature, max_tokens,
+                             scheduler, max_retries)
+    return result["response"], result["time"]
+
+
+def call_llm_result(client: OpenAI, model: str, prompt: str, system_prompt: str = None,
+                    temperature: float = 0.7, max_tokens: int = 2000,
+                    scheduler: "EndpointScheduler" = None, max_retries: int = 5,
+                    plan: "PrefixCachePlan" = None, monitor: "StreamMonitor" = None) -> dict:
+    """调用 LLM API，返回结果 dict
+
+    可重试错误（429 / 5xx / 网络）按退避重试，失败的结果带 error: transient / permanent。
+    传入 scheduler 时每次请求前按 RPM / TPM 令牌桶排队，成功后按实际 token 用量修正 TPM。
+    plan 为该批请求的前缀缓存布局；成功的结果带 usage（含 provider 返回的 cached_tokens）。
+    传入 monitor 时使用流式接口，结果额外记录首 token 延迟 ttft，生成中的内容实时写入 monitor。
+    """
+    messages = plan.messages(prompt, system_prompt) if plan else build_messages(prompt, system_prompt)
+    extra_body = plan.extra_body() if plan else None
+    estimated = estimate_request_tokens(messages, max_tokens)
+    
+    start_time = time.time()
+    for attempt in range(max_retries + 1):
+        if scheduler:
+            time.sleep(scheduler.reserve(estimated))
+        attempt_start = time.time()
+        try:
+            if monitor is None:
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    extra_body=extra_body
+                )
+                result = success_result(response.choices[0].message.content, response.usage,
+                                        start_time, attempt_start, attempt)
+            else:
+                stream = StreamState(monitor, model)
+                try:
+                    for chunk in client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        extra_body=extra_body,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    ):
+                        stream.feed(chunk)
+                finally:
+                    stream.close()
+                result = stream.result(start_time, attempt_start, attempt)
+        except Exception as e:
+            transient = is_transient_error(e)
+            if transient and attempt < max_retries:
+                delay = retry_delay(e, attempt)
+                if scheduler and is_rate_limited(e):
+                    scheduler.pause(delay)
+                time.sleep(delay)
+                continue
+            return {"response": f"[ERROR] {str(e)}", "time": time.time() - start_time,
+                    "attempts": attempt + 1, "error": "transient" if transient else "permanent"}
+        if scheduler:
+            scheduler.settle(estimated, used_request_tokens(result, estimated, max_tokens))
+        return result
+
+
+def batch_evaluate(prompts: list[str], client: OpenAI, model: str, 
+                   system_prompt: str, temperature: float, max_tokens: int,
+                   max_workers: int = 3, progress_callback=None,
+                   engine: str = "thread", cache: "ResponseCache" = None,
+                   on_result=None, scheduler: "EndpointScheduler" = None,
+                   prompt_cache: str = "auto", monitor: "StreamMonitor" = None,
+                   slots: threading.Semaphore = None) -> list[dict]:
+    """批量调用 LLM，返回结果列表
+
+    engine="thread" 使用线程池，max_workers 为线程数；
+    engine="async" 使用异步引擎，max_workers 为自适应并发的上限。
+    传入 cache 时先查缓存，只对未命中的 prompt 调用 API，命中的结果带 "cached": True；
+    新结果在完成时逐条写入缓存（与 on_result 落盘同步），中途中断也不会丢失已完成的行。
+    on_result(idx, result) 在每条结果完成时调用，用于边跑边落盘。
+    scheduler 为该 api_base 共享的 RPM / TPM 限流器；失败结果的 error 字段区分 transient / permanent。
+    prompt_cache 为 provider 前缀缓存方式（见 PROMPT_CACHE_MODES），实际发送的 prompt 共享同一个前缀布局。
+    传入 monitor 时使用流式接口（见 call_llm_result）。
+    slots 为同一 endpoint 上多个模型共享的并发名额（线程池引擎每次调用占用一个），见 batch_evaluate_models。
+    """
+    if cache is None:
+        return _dispatch(prompts, client, model, system_prompt, temperature, max_tokens,
+                         max_workers, progress_callback, engine, on_result, scheduler, prompt_cache,
+                         monitor, slots)
+    
+    total = len(prompts)
+    keys = [cache.make_key(client.base_url, model, system_prompt, temperature, max_tokens, p) for p in prompts]
+    cached = cache.get_many(keys)
+    results = [None] * total
+    misses = []
+    for i, key in enumerate(keys):
+        if key in cached:
+            results[i] = {"response": cached[key], "time": 0.0, "cached": True}
+            if on_result:
+                on_result(i, results[i])
+        else:
+            misses.append(i)
+    
+    hits = total - len(misses)
+    miss_progress = None
+    if progress_callback:
+        if hits:
+            progress_callback(hits / total)
+        def miss_progress(p):
+            progress_callback((hits + p * len(misses)) / total)
+    
+    def miss_result(j, res):
+        res["cached"] = False
+        if not res.get("error") and not res["response"].startswith("[ERROR]"):
+            cache.put(keys[misses[j]], res["response"])
+        if on_result:
+            on_result(misses[j], res)
+    
+    fresh = _dispatch([prompts[i] for i in misses], client, model, system_prompt,
+                      temperature, max_tokens, max_workers, miss_progress, engine, miss_result,
+                      scheduler, prompt_cache, monitor, slots)
+    for i, res in zip(misses, fresh):
+        results[i] = res
+    return results
+
+
+def _dispatch(prompts: list[str], client: OpenAI, model: str,
+              system_prompt: str, temperature: float, max_tokens: int,
+              max_workers: int, progress_callback, engine: str, on_result=None,
+              scheduler: "EndpointScheduler" = None, prompt_cache: str = "auto",
+              monitor: "StreamMonitor" = None, slots: threading.Semaphore = None) -> list[dict]:
+    """按引擎实际发起调用
+
+    共享前缀足够长时先单独发出第一条，provider 写入前缀缓存后再并发发送其余行，
+    否则首批并发请求会同时错过缓存。
+    """
+    plan = PrefixCachePlan(prompts, system_prompt, prompt_cache)
+    if not plan.warmup:
+        return _send(prompts, client, model, system_prompt, temperature, max_tokens,
+                     max_workers, progress_callback, engine, on_result, scheduler, plan, monitor, slots)
+    
+    total = len(prompts)
+    with slots or nullcontext():
+        head = call_llm_result(client, model, prompts[0], system_prompt, temperature, max_tokens,
+                               scheduler, plan=plan, monitor=monitor)
+    if on_result:
+        on_result(0, head)
+    rest_progress = None
+    if progress_callback:
+        progress_callback(1 / total)
+        def rest_progress(p):
+            progress_callback((1 + p * (total - 1)) / total)
+    rest = _send(prompts[1:], client, model, system_prompt, temperature, max_tokens,
+                 max_workers, rest_progress, engine,
+                 (lambda j, res: on_result(j + 1, res)) if on_result else None, scheduler, plan, monitor,
+                 slots)
+    return [head, *rest]
+
+
+def _send(prompts: list[str], client: OpenAI, model: str,
+          system_prompt: str, temperature: float, max_tokens: int,
+          max_workers: int, progress_callback, engine: str, on_result,
+          scheduler: "EndpointScheduler", plan: "PrefixCachePlan",
+          monitor: "StreamMonitor" = None, slots: threading.Semaphore = None) -> list[dict]:
+    if engine == "async":
+        # 在注册表的常驻事件循环中执行，异步客户端的连接池跨批次、跨运行复用；沿用同步客户端的超时设置
+        registry = client_registry()
+        async_client = registry.get_async(str(client.base_url), client.api_key, max_workers)
+        return registry.run(async_batch_evaluate(
+            prompts, async_client.with_options(timeout=client.timeout), model, system_prompt, temperature,
+            max_tokens, max_concurrency=max_workers, progress_callback=progress_callback,
+            on_result=on_result, scheduler=scheduler, plan=plan, monitor=monitor
+        ))
+    
+    results = [None] * len(prompts)
+    
+    def process_one(idx: int, prompt: str):
+        with slots or nullcontext():
+            return idx, call_llm_result(client, model, prompt, system_prompt, temperature, max_tokens,
+                                        scheduler, plan=plan, monitor=monitor)
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(process_one, i, p): i for i, p in enumerate(prompts)}
+        completed = 0
+        for future in as_completed(futures):
+            idx, results[idx] = future.result()
+            if on_result:
+                on_result(idx, results[idx])
+            completed += 1
+            if progress_callback:
+                progress_callback(completed / len(prompts))
+    
+    return results
+
+
+def batch_evaluate_models(prompts: list[str], targets: dict[str, dict],
+                          system_prompt: str, temperature: float, max_tokens: int,
+                          max_workers: int = 3, progress_callback=None,
+                          engine: str = "thread", cache: "ResponseCache" = None,
+                          on_result=None, indexes: dict[str, list[int]] = None,
+                          monitor: "StreamMonitor" = None) -> dict[str, list[dict]]:
+    """同一批已渲染的 prompt 同时发给多个模型
+
+    targets 为 {配置名: 模型配置}。所有模型同时开始，总耗时约等于最慢的那个模型。
+    max_workers 按模型计：同一 api_base 上的 n 个模型共享 n × max_workers 个并发名额，
+    线程池引擎的每次调用占用一个名额，先跑完的模型让出的名额由其余模型继续使用；
+    异步引擎各模型的自适应并发上限为 max_workers。
+    同一 api_base 的所有调用共享一个 EndpointScheduler，按模型配置中的 rpm / tpm 限流；
+    前缀缓存方式取模型配置中的 prompt_cache。
+    indexes 可为每个模型指定只跑其中部分 prompt（续跑时使用），缺省为全部。
+    on_result(model_key, idx, result) 与 progress_callback 都在调用线程中触发。
+    """
+    indexes = indexes or {key: list(range(len(prompts))) for key in targets}
+    sizes = {key: len(indexes[key]) for key in targets}
+    total = sum(sizes.values()) or 1
+    groups = {}
+    for key, config in targets.items():
+        groups.setdefault(config.get("api_base"), []).append(key)
+    slots = {api_base: threading.BoundedSemaphore(max_workers * len(keys)) for api_base, keys in groups.items()}
+    
+    results = {}
+    fractions = dict.fromkeys(targets, 0.0)
+    events = queue.Queue()
+    
+    def run_model(key: str):
+        config = targets[key]
+        idx = indexes[key]
+        group = groups[config.get("api_base")]
+        shared = len(group) > 1 and engine != "async"
+        # 共享名额时线程数放大到整个 endpoint 的预算，才能接手其他模型让出的名额
+        workers = model_concurrency(config, max_workers * len(group) if shared else max_workers)
+        client = client_for(config, workers)
+        scheduler = get_scheduler(config["api_base"])
+        scheduler.configure(config.get("rpm"), config.get("tpm"))
+        results[key] = batch_evaluate(
+            [prompts[i] for i in idx], client, config["model_name"], system_prompt,
+            temperature, max_tokens, workers,
+            progress_callback=lambda p: events.put(("progress", key, p)),
+            engine=engine, cache=cache, scheduler=scheduler,
+            prompt_cache=config.get("prompt_cache") or "auto", monitor=monitor,
+            on_result=lambda j, res: events.put(("result", key, idx[j], res)),
+            slots=slots[config.get("api_base")] if shared else None
+        )
+    
+    with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+        futures = [executor.submit(run_model, key) for key in targets]
+        while not all(f.done() for f in futures) or not events.empty():
+            try:
+                kind, key, *payload = events.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == "progress":
+                fractions[key] = payload[0]
+                if progress_callback:
+                    progress_callback(sum(fractions[k] * sizes[k] for k in targets) / total)
+            elif on_result:
+                on_result(key, *payload)
+        for future in futures:
+            future.result()
+    return results
+
+
+# ============== 前缀缓存 ==============
+
+# provider 侧前缀缓存的使用方式（模型配置中的 prompt_cache）
+PROMPT_CACHE_MODES = {
+    "auto": "自动（OpenAI / DeepSeek 等按前缀自动缓存，只调整发送顺序）",
+    "openai": "自动 + prompt_cache_key（OpenAI，提高同前缀请求的路由命中）",
+    "cache_control": "cache_control 标记（Anthropic 兼容接口 / OpenRouter / DashScope）",
+    "off": "关闭",
+}
+# 共享前缀短于该值时 provider 一般不会缓存（OpenAI 为 1024 tokens），不做预热
+PREFIX_CACHE_MIN_TOKENS = 1024
+
+
+class PrefixCachePlan:
+    """一批请求的前缀缓存布局
+
+    静态前缀 = System Prompt + 这批 prompt 的最长公共前缀（模板第一个占位符之前的部分，
+    通常包含展开后的人设 / core_laws）。所有请求的 messages 都以同样的前缀开头，
+    cache_control 模式下在前缀末尾打缓存断点，openai 模式下附带按前缀计算的 prompt_cache_key。
+    """
+
+    def __init__(self, prompts: list[str], system_prompt: str = None, mode: str = "auto"):
+        self.mode = mode if mode in PROMPT_CACHE_MODES else "auto"
+        self.prefix_len = 0
+        self.prefix_tokens = 0
+        self.cache_key = None
+        if self.mode == "off" or not prompts:
+            self.warmup = False
+            return
+        # os.path.commonprefix 只比较字典序最小和最大的两个字符串
+        self.prefix_len = len(os.path.commonprefix(prompts)) if len(prompts) > 1 else 0
+        prefix = (system_prompt or "") + prompts[0][:self.prefix_len]
+        self.prefix_tokens = approx_token_count(prefix)
+        self.cache_key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()[:32]
+        self.warmup = len(prompts) > 1 and self.prefix_tokens >= PREFIX_CACHE_MIN_TOKENS
+
+    def messages(self, prompt: str, system_prompt: str = None) -> list[dict]:
+        if self.mode != "cache_control":
+            return build_messages(prompt, system_prompt)
+        mark = {"type": "ephemeral"}
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system",
+                             "content": [{"type": "text", "text": system_prompt, "cache_control": mark}]})
+        head, tail = prompt[:self.prefix_len], prompt[self.prefix_len:]
+        if head and tail:
+            content = [{"type": "text", "text": head, "cache_control": mark}, {"type": "text", "text": tail}]
+        else:
+            content = prompt
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    def extra_body(self) -> dict:
+        if self.mode == "openai" and self.cache_key:
+            return {"prompt_cache_key": self.cache_key}
+        return None
+
+
+def usage_dict(usage) -> dict:
+    """把 usage 转成 dict，cached_tokens 兼容 OpenAI / DeepSeek / Anthropic 兼容接口的不同字段"""
+    if usage is None:
+        return None
+    # SDK 对象或 Batch API 输出文件中的原始 dict
+    field = (lambda obj, name: obj.get(name)) if isinstance(usage, dict) else \
+        (lambda obj, name: getattr(obj, name, None))
+    details = field(usage, "prompt_tokens_details")
+    cached = field(details, "cached_tokens") if details is not None else None
+    for name in ("prompt_cache_hit_tokens", "cache_read_input_tokens"):
+        if cached is None:
+            cached = field(usage, name)
+    return {"prompt_tokens": field(usage, "prompt_tokens") or 0,
+            "completion_tokens": field(usage, "completion_tokens") or 0, "cached_tokens": cached or 0}
+
+
+# ============== 流式与延迟指标 ==============
+
+class StreamMonitor:
+    """流式模式下在途响应的实时快照，页面用它展示正在生成的内容（live tail）"""
+
+    def __init__(self, tail_chars: int = 120):
+        self.tail_chars = tail_chars
+        self._lock = threading.Lock()
+        self._active = {}
+        self._next = 0
+
+    def open(self, model: str) -> int:
+        with self._lock:
+            self._next += 1
+            self._active[self._next] = [model, 0, ""]
+            return self._next
+
+    def update(self, handle: int, text: str):
+        with self._lock:
+            item = self._active.get(handle)
+            if item is not None:
+                item[1] += len(text)
+                item[2] = (item[2] + text)[-self.tail_chars:]
+
+    def close(self, handle: int):
+        with self._lock:
+            self._active.pop(handle, None)
+
+    def snapshot(self, limit: int = 6) -> list[tuple[str, int, str]]:
+        """最近开始的 limit 个在途响应：(模型, 已输出字符数, 末尾内容)"""
+        with self._lock:
+            return [tuple(item) for _, item in sorted(self._active.items(), reverse=True)[:limit]]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._active)
+
+
+class StreamState:
+    """累积一次流式响应的正文、usage 和首 token 时间"""
+
+    def __init__(self, monitor: StreamMonitor, model: str):
+        self.monitor = monitor
+        self.handle = monitor.open(model)
+        self.parts = []
+        self.usage = None
+        self.first_token = None
+
+    def feed(self, chunk):
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage
+        if not chunk.choices:
+            return
+        delta = chunk.choices[0].delta
+        text = delta.content or ""
+        # 推理模型先输出 reasoning_content，同样算作首 token
+        if self.first_token is None and (text or getattr(delta, "reasoning_content", None)):
+            self.first_token = time.time()
+        if text:
+            self.parts.append(text)
+            self.monitor.update(self.handle, text)
+
+    def close(self):
+        self.monitor.close(self.handle)
+
+    def result(self, start_time: float, attempt_start: float, attempt: int) -> dict:
+        ttft = self.first_token - attempt_start if self.first_token else None
+        return success_result("".join(self.parts), self.usage, start_time, attempt_start, attempt, ttft)
+
+
+def success_result(content: str, usage, start_time: float, attempt_start: float, attempt: int,
+                   ttft: float = None) -> dict:
+    """成功调用的结果 dict
+
+    time 为含排队和重试的总耗时，wait 为最后一次请求发出前的等待（限流排队 + 重试退避），
+    tokens_per_sec 为生成速度：输出 token 数 / (请求耗时 - 首 token 延迟)。
+    """
+    now = time.time()
+    usage = usage_dict(usage)
+    output_tokens = usage["completion_tokens"] if usage else approx_token_count(content or "")
+    generation = now - attempt_start - (ttft or 0)
+    result = {"response": content, "time": now - start_time, "attempts": attempt + 1, "usage": usage,
+              "wait": attempt_start - start_time, "output_tokens": output_tokens,
+              "tokens_per_sec": output_tokens / generation if generation > 0 else None}
+    if ttft is not None:
+        result["ttft"] = ttft
+    return result
+
+
+LATENCY_METRICS = {"time": "耗时(秒)", "ttft": "首 token(秒)", "tokens_per_sec": "tokens/s"}
+
+
+def percentile(values: list[float], q: float) -> float:
+    """最近秩法百分位，values 需已排序"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(q / 100 * len(values)) - 1))]
+
+
+def latency_percentiles(results, percentiles=(50, 95, 99)) -> dict[str, dict[str, list]]:
+    """按模型统计成功调用（不含缓存命中）的 p50 / p95 / p99：{模型: {指标: [p50, p95, p99]}}"""
+    samples = {}
+    for res in results:
+        if res.get("error") or res.get("cached"):
+            continue
+        by_metric = samples.setdefault(res.get("model"), {metric: [] for metric in LATENCY_METRICS})
+        for metric in LATENCY_METRICS:
+            if res.get(metric) is not None:
+                by_metric[metric].append(res[metric])
+    return {
+        key: {metric: [percentile(sorted(values), q) for q in percentiles] for metric, values in by_metric.items()}
+        for key, by_metric in samples.items()
+    }
+
+
+# ============== 异步引擎 ==============
+
+class AdaptiveConcurrency:
+    """AIMD 自适应并发控制
+
+    - 慢启动：首次拥塞前每成功一次并发 +1
+    - 加性增：拥塞后每成功一次并发 +1/limit，约每轮 +1
+    - 乘性减：遇到 429、超时 / 连接错误，或平滑延迟超过基线 latency_tolerance 倍时并发乘以 decrease，
+      同一个延迟窗口内只回退一次
+
+    LLM 的延迟主要取决于输出长度，单次请求之间差异很大，基线取最近 window 次成功请求延迟的中位数，
+    而不是历史最小值；只有延迟整体抬升（服务端排队）才触发回退，正常的长短波动不会让并发塌缩。
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 256,
+                 decrease: float = 0.5, latency_tolerance: float = 2.0, window: int = 100):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self.slow_start = True
+        self.base_latency = None
+        self.smoothed_latency = None
+        self._latencies = deque(maxlen=window)
+        self._last_backoff = 0.0
+        self._retrying = 0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self, retry: bool = False):
+        """retry=True 的重试请求优先于新行拿到名额，回退后重试的行不会被后续新行一直挤在后面"""
+        async with self._cond:
+            self._retrying += retry
+            try:
+                await self._cond.wait_for(
+                    lambda: self.in_flight < int(self.limit) and (retry or not self._retrying))
+            finally:
+                self._retrying -= retry
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def release(self, latency: float = None, throttled: bool = False, overloaded: bool = False):
+        """latency 为成功请求的耗时；throttled 为 429，overloaded 为超时 / 连接错误，两者都立即回退"""
+        async with self._cond:
+            self.in_flight -= 1
+            if throttled or overloaded:
+                self.throttled += throttled
+                self._backoff()
+            elif latency is not None:
+                self._observe(latency)
+            self._cond.notify_all()
+
+    def _observe(self, latency: float):
+        self._latencies.append(latency)
+        # 窗口未满一半前样本太少，不用延迟判断拥塞
+        if len(self._latencies) >= self._latencies.maxlen // 2:
+            self.base_latency = percentile(sorted(self._latencies), 50)
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency
+        else:
+            self.smoothed_latency = 0.8 * self.smoothed_latency + 0.2 * latency
+
+        if self.latency_tolerance and self.base_latency is not None \
+                and self.smoothed_latency > self.base_latency * self.latency_tolerance:
+            self._backoff()
+        elif self.slow_start:
+            self.limit = min(self.limit + 1, self.max_limit)
+        else:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def _backoff(self):
+        now = time.monotonic()
+        if now - self._last_backoff < (self.smoothed_latency or 0):
+            return
+        self._last_backoff = now
+        self.slow_start = False
+        self.limit = max(self.limit * self.decrease, self.min_limit)
+
+
+async def async_batch_evaluate(prompts: list[str], client: AsyncOpenAI, model: str,
+                               system_prompt: str, temperature: float, max_tokens: int,
+                               max_concurrency: int = 256, initial_concurrency: int = 8,
+                               max_retries: int = 5, progress_callback=None,
+                               on_result=None, scheduler: EndpointScheduler = None,
+                               plan: "PrefixCachePlan" = None, monitor: "StreamMonitor" = None) -> list[dict]:
+    """异步批量调用 LLM，返回与 batch_evaluate 相同结构的结果列表
+
+    启动 max_concurrency 个 worker 按顺序领取行，由 AdaptiveConcurrency 控制实际在途请求数，
+    scheduler 控制 RPM / TPM；429 会触发并发回退，可重试错误按 retry_delay 退避后重试，
+    重试用尽或不可重试的错误与 call_llm_result 一样记为 [ERROR] 并标注 error 类型。
+    """
+    results = [None] * len(prompts)
+    limiter = AdaptiveConcurrency(initial=initial_concurrency, max_limit=max_concurrency)
+    pending = iter(range(len(prompts)))
+    completed = 0
+
+    async def process_one(idx: int) -> dict:
+        messages = plan.messages(prompts[idx], system_prompt) if plan else build_messages(prompts[idx], system_prompt)
+        extra_body = plan.extra_body() if plan else None
+        estimated = estimate_request_tokens(messages, max_tokens)
+        start_time = None
+        for attempt in range(max_retries + 1):
+            if scheduler:
+                await asyncio.sleep(scheduler.reserve(estimated))
+            await limiter.acquire(retry=attempt > 0)
+            attempt_start = time.time()
+            # 与线程池引擎一样，等待并发名额的排队时间不计入该行耗时
+            start_time = start_time or attempt_start
+            stream = None
+            try:
+                if monitor is None:
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        extra_body=extra_body
+                    )
+                else:
+                    stream = StreamState(monitor, model)
+                    try:
+                        async for chunk in await client.chat.completions.create(
+                            model=model,
+                            messages=messages,
+                            temperature=temperature,
+                            max_tokens=max_tokens,
+                            extra_body=extra_body,
+                            stream=True,
+                            stream_options={"include_usage": True}
+                        ):
+                            stream.feed(chunk)
+                    finally:
+                        stream.close()
+            except Exception as e:
+                throttled = is_rate_limited(e)
+                transient = is_transient_error(e)
+                await limiter.release(throttled=throttled,
+                                      overloaded=isinstance(e, (APIConnectionError, TimeoutError)))
+                if transient and attempt < max_retries:
+                    delay = retry_delay(e, attempt)
+                    if scheduler and throttled:
+                        scheduler.pause(delay)
+                    await asyncio.sleep(delay)
+                    continue
+                return {"response": f"[ERROR] {str(e)}", "time": time.time() - start_time,
+                        "attempts": attempt + 1, "error": "transient" if transient else "permanent"}
+            await limiter.release(latency=time.time() - attempt_start)
+            if stream is not None:
+                result = stream.result(start_time, attempt_start, attempt)
+            else:
+                result = success_result(response.choices[0].message.content, response.usage,
+                                        start_time, attempt_start, attempt)
+            if scheduler:
+                scheduler.settle(estimated, used_request_tokens(result, estimated, max_tokens))
+            return result
+
+    async def worker():
+        nonlocal completed
+        for idx in pending:
+            results[idx] = await process_one(idx)
+            if on_result:
+                on_result(idx, results[idx])
+            completed += 1
+            if progress_callback:
+                progress_callback(completed / len(prompts))
+
+    await asyncio.gather(*(worker() for _ in range(min(max_concurrency, len(prompts)))))
+    return results
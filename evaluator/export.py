@@ -0,0 +1,165 @@
+"""结果导出：把运行日志与评估集原始字段写成 xlsx / parquet / jsonl"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+from evaluator.dataset import DatasetReader
+from evaluator.storage import RunJournal, pivot_results
+from evaluator.templates import _is_missing
+
+# ============== 结果导出 ==============
+
+EXPORT_FORMATS = {
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+    "jsonl": ("JSONL", "application/x-ndjson"),
+}
+
+
+def result_columns(model_keys: list[str], source_columns: list[str], dimensions: list[str] = ()) -> list[str]:
+    """结果宽表的列顺序，与 pivot_results 的列名保持一致"""
+    suffixes = [f"[{key}]" for key in model_keys] if len(model_keys) > 1 else [""]
+    columns = ["序号"]
+    for suffix in suffixes:
+        columns += [f"模型响应{suffix}", f"耗时(秒){suffix}", f"首 token(秒){suffix}",
+                    f"输出 tokens{suffix}", f"tokens/s{suffix}"]
+        if dimensions:
+            columns += [f"评分({dim}){suffix}" for dim in dimensions] + [f"加权分{suffix}", f"评语{suffix}"]
+    return columns + [f"[原]{col}" for col in source_columns]
+
+
+def iter_result_frames(results: list[dict], model_keys: list[str], dataset: DatasetReader = None,
+                       chunk_size: int = 2000, judgments: dict[tuple, dict] = None,
+                       dimensions: list[str] = ()):
+    """分块生成结果宽表 DataFrame，原始字段按块读取后整列拼接（[原] 前缀）"""
+    import pandas as pd
+    columns = result_columns(model_keys, dataset.columns if dataset is not None else [], dimensions)
+    rows = pivot_results(results, model_keys, judgments, dimensions)
+    for start in range(0, len(rows), chunk_size):
+        frame = pd.DataFrame(rows[start:start + chunk_size])
+        if dataset is not None:
+            source = pd.DataFrame(dataset.fetch(frame["序号"].tolist())).add_prefix("[原]")
+            frame = pd.concat([frame, source.set_axis(frame.index)], axis=1)
+        yield frame.reindex(columns=columns)
+
+
+def _text_value(value):
+    """写入文本列的值：缺失为 None，嵌套的 dict / list 转成 JSON 字符串"""
+    if _is_missing(value):
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+_EXCEL_ILLEGAL_CHARS = re.compile(r"[\000-\010\013\014\016-\037]")
+
+
+def _excel_value(value):
+    """openpyxl 不接受控制字符、NaN 和嵌套结构，写入前清理"""
+    if _is_missing(value):
+        return None
+    if isinstance(value, (dict, list)):
+        value = _text_value(value)
+    if isinstance(value, str):
+        return _EXCEL_ILLEGAL_CHARS.sub("", value)
+    return value
+
+
+def _write_xlsx(path: Path, columns: list[str], frames, dataset: DatasetReader = None):
+    """openpyxl write-only 模式逐行写入，内存占用与行数无关"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("评估结果")
+    sheet.append(columns)
+    for frame in frames:
+        for row in frame.itertuples(index=False, name=None):
+            sheet.append([_excel_value(value) for value in row])
+    workbook.save(path)
+
+
+def _result_schema(columns: list[str], dataset: DatasetReader = None):
+    """固定 parquet schema：parquet 评估集沿用原列类型，其余来源的原始字段统一存为字符串"""
+    import pyarrow as pa
+    source_types = {}
+    if dataset is not None and dataset.format == "parquet":
+        import pyarrow.parquet as pq
+        source_types = {f"[原]{field.name}": field.type for field in pq.ParquetFile(dataset.path).schema_arrow}
+    fields = []
+    for col in columns:
+        if col == "序号":
+            fields.append(pa.field(col, pa.int64()))
+        elif col.startswith(("耗时(秒)", "首 token(秒)", "tokens/s", "评分(", "加权分")):
+            fields.append(pa.field(col, pa.float64()))
+        elif col.startswith("输出 tokens"):
+            fields.append(pa.field(col, pa.int64()))
+        else:
+            fields.append(pa.field(col, source_types.get(col, pa.string())))
+    return pa.schema(fields)
+
+
+def _write_parquet(path: Path, columns: list[str], frames, dataset: DatasetReader = None):
+    """pyarrow ParquetWriter 每块写一个 row group"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _result_schema(columns, dataset)
+    text_columns = [field.name for field in schema
+                    if field.name.startswith("[原]") and pa.types.is_string(field.type)]
+    with pq.ParquetWriter(path, schema) as writer:
+        for frame in frames:
+            for col in text_columns:
+                frame[col] = frame[col].map(_text_value)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+
+
+def _write_jsonl(path: Path, columns: list[str], frames, dataset: DatasetReader = None):
+    with open(path, 'w', encoding='utf-8') as f:
+        for frame in frames:
+            text = frame.to_json(orient="records", lines=True, force_ascii=False, date_format="iso")
+            f.write(text if text.endswith("\n") else text + "\n")
+
+
+_EXPORT_WRITERS = {"xlsx": _write_xlsx, "parquet": _write_parquet, "jsonl": _write_jsonl}
+
+
+def export_results(journal: RunJournal, dataset: DatasetReader = None, fmt: str = "xlsx",
+                   chunk_size: int = 2000) -> Path:
+    """把运行结果流式写成导出文件，存放在运行目录的 exports/ 下
+
+    文件名由 journal 状态、评估集和格式决定，结果没有新增时直接返回上次的文件，不会重复生成。
+    """
+    if fmt not in _EXPORT_WRITERS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    source = None
+    if dataset is not None:
+        stat = dataset.path.stat()
+        source = [str(dataset.path.resolve()), stat.st_size, stat.st_mtime_ns]
+    signature = hashlib.sha256(
+        json.dumps([journal.stamp(), source]).encode('utf-8')
+    ).hexdigest()[:16]
+    export_dir = journal.dir / "exports"
+    path = export_dir / f"{signature}.{fmt}"
+    if path.exists():
+        return path
+
+    export_dir.mkdir(parents=True, exist_ok=True)
+    meta = journal.read_meta()
+    model_keys = list(meta["models"])
+    dimensions = (meta.get("judge") or {}).get("dimensions", [])
+    columns = result_columns(model_keys, dataset.columns if dataset is not None else [], dimensions)
+    frames = iter_result_frames(journal.load_results(), model_keys, dataset, chunk_size,
+                                journal.load_judgments(), dimensions)
+    tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    _EXPORT_WRITERS[fmt](tmp_path, columns, frames, dataset)
+    os.replace(tmp_path, path)
+    for old in export_dir.glob(f"*.{fmt}"):
+        if old != path:
+            old.unlink(missing_ok=True)
+    return path
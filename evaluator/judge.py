@@ -0,0 +1,247 @@
+"""LLM 评分：按模块 evaluation.md 的评分 prompt 为每条结果打分"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from evaluator.clients import client_for, model_concurrency
+from evaluator.config import BASE_DIR
+from evaluator.engine import call_llm_result
+from evaluator.ratelimit import get_scheduler
+from evaluator.storage import ResponseCache, RunJournal, response_hash
+from prompt_store import CODE_BLOCK_PATTERN, MODULES_DIR
+
+# ============== LLM 评分 ==============
+
+# 评分标准文件中 LLM Judge 段落的标题，其后第一个代码块为评分 prompt
+JUDGE_HEADING_PATTERN = re.compile(r'^#+[^\n]*LLM Judge[^\n]*$', re.MULTILINE)
+# 「### 1. 定位准确度 (40%)」形式的维度标题，按出现顺序对应 scores 中的 key
+WEIGHT_HEADING_PATTERN = re.compile(r'^#{2,4}\s*\d+\.\s*(.+?)\s*[(（]\s*(\d+(?:\.\d+)?)\s*%\s*[)）]', re.MULTILINE)
+SCORES_BLOCK_PATTERN = re.compile(r'"scores"\s*:\s*\{(.*?)\}', re.DOTALL)
+SCORE_KEY_PATTERN = re.compile(r'"(\w+)"\s*:')
+JSON_OBJECT_PATTERN = re.compile(r'\{.*\}', re.DOTALL)
+JUDGE_TEMPERATURE = 0.0
+JUDGE_MAX_TOKENS = 1024
+
+
+def discover_rubrics() -> dict[str, str]:
+    """扫描 01_Modules 下的 evaluation.md，返回 {模块目录: 相对仓库根目录的路径}"""
+    rubrics = {}
+    for root, dirs, files in os.walk(MODULES_DIR):
+        dirs.sort()
+        if "evaluation.md" in files:
+            module_dir = os.path.relpath(root, MODULES_DIR).replace(os.sep, '/')
+            rubrics[module_dir] = os.path.relpath(os.path.join(root, "evaluation.md"),
+                                                  BASE_DIR).replace(os.sep, '/')
+    return rubrics
+
+
+def load_rubric(path: str | Path) -> dict:
+    """从 evaluation.md 提取评分 prompt、维度和权重
+
+    权重取 LLM Judge 段落之前的维度标题（百分比），按顺序对应 prompt 输出格式中 scores 的 key；
+    段落前没有对应数量的标题时改用 prompt 内的维度标题，仍对不上则各维度等权。
+    返回的 dict 原样写入运行的 meta["judge"]，评分标准文件之后被修改也不影响已有运行。
+    """
+    path = Path(path)
+    text = path.read_text(encoding='utf-8')
+    heading = JUDGE_HEADING_PATTERN.search(text)
+    block = CODE_BLOCK_PATTERN.search(text, heading.end()) if heading else None
+    if block is None:
+        raise ValueError(f"{path} 中没有 LLM Judge 评分 prompt")
+    prompt = block.group(1).strip()
+    scores = SCORES_BLOCK_PATTERN.search(prompt)
+    dimensions = SCORE_KEY_PATTERN.findall(scores.group(1)) if scores else []
+    if not dimensions:
+        raise ValueError(f"{path} 的评分 prompt 中没有 scores 输出格式")
+    weights = [float(w) for _, w in WEIGHT_HEADING_PATTERN.findall(text[:heading.start()])]
+    if len(weights) != len(dimensions):
+        weights = [float(w) for _, w in WEIGHT_HEADING_PATTERN.findall(prompt)]
+    if len(weights) != len(dimensions):
+        weights = [1.0] * len(dimensions)
+    title = re.search(r'^#\s+(.+)$', text, re.MULTILINE)
+    try:
+        rel_path = path.resolve().relative_to(BASE_DIR.resolve()).as_posix()
+    except ValueError:
+        rel_path = str(path)
+    return {
+        "path": rel_path,
+        "name": title.group(1).strip() if title else path.parent.name,
+        "prompt": prompt,
+        "dimensions": dimensions,
+        "weights": dict(zip(dimensions, weights)),
+    }
+
+
+def judge_input(prompt: str, response: str) -> str:
+    """评分请求的 User 消息，对应评分 prompt 中的 Input Data"""
+    return f"User Input:\n{prompt}\n\nModel Output:\n{response}"
+
+
+def weighted_score(scores: dict[str, float], weights: dict[str, float]) -> float:
+    """有分数的维度按权重加权平均（与单项分同一量纲），没有任何分数时返回 None"""
+    total = sum(weights[dim] for dim, score in scores.items() if score is not None)
+    if not total:
+        return None
+    return sum(weights[dim] * score for dim, score in scores.items() if score is not None) / total
+
+
+def parse_judgment(text: str, rubric: dict) -> dict:
+    """解析评分模型输出的 JSON（允许前后有说明文字或代码块标记）
+
+    返回 {"scores": {维度: 分数}, "weighted": 加权分, "reasoning": 评语}，
+    无法解析时带 error: "parse" 并保留原始输出的开头。
+    """
+    match = JSON_OBJECT_PATTERN.search(text or "")
+    try:
+        data = json.loads(match.group(0)) if match else None
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {"scores": {}, "weighted": None, "reasoning": (text or "")[:500], "error": "parse"}
+    raw = data.get("scores") if isinstance(data.get("scores"), dict) else data
+    scores = {}
+    for dim in rubric["dimensions"]:
+        try:
+            scores[dim] = float(raw[dim])
+        except (KeyError, TypeError, ValueError):
+            scores[dim] = None
+    reasoning = data.get("reasoning") or ""
+    return {
+        "scores": scores,
+        "weighted": weighted_score(scores, rubric["weights"]),
+        "reasoning": reasoning if isinstance(reasoning, str) else json.dumps(reasoning, ensure_ascii=False),
+    }
+
+
+class JudgePipeline:
+    """LLM 评分阶段：生成结果一写入 journal 就提交评分，评分与其余行的生成并行
+
+    评分请求在独立的线程池中执行，与被评模型共用按 api_base 的 EndpointScheduler 限流；
+    评分模型的原始输出按 (评分模型, 评分 prompt, 用户输入 + 模型响应) 存入 ResponseCache，
+    响应没有变化的行（续跑、换数据范围重跑）直接复用缓存，不会重复评分。
+    评分结果写入 journal 的 judgments.jsonl，记录被评响应的哈希，响应被重跑改变后才重新评分。
+    """
+
+    def __init__(self, journal: RunJournal, rubric: dict, judge_config: dict, max_workers: int = 8,
+                 cache: ResponseCache = None, max_tokens: int = JUDGE_MAX_TOKENS):
+        self.journal = journal
+        self.rubric = rubric
+        self.model = judge_config["model_name"]
+        max_workers = model_concurrency(judge_config, max_workers)
+        self.client = client_for(judge_config, max_workers)
+        self.scheduler = get_scheduler(judge_config["api_base"])
+        self.scheduler.configure(judge_config.get("rpm"), judge_config.get("tpm"))
+        self.cache = cache
+        self.max_tokens = max_tokens
+        self.stats = {"submitted": 0, "judged": 0, "cache_hits": 0, "failed": 0}
+        self._judged = journal.judged()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+
+    def submit(self, row: int, model: str, prompt: str, result: dict):
+        """提交一条生成结果；失败、跳过的结果和已按当前响应评过分的行不提交"""
+        if result.get("error"):
+            return
+        digest = response_hash(result["response"])
+        with self._lock:
+            if self._judged.get((row, model)) == digest:
+                return
+            self._judged[(row, model)] = digest
+            self.stats["submitted"] += 1
+            self._futures.append(self._executor.submit(self._judge, row, model, prompt, result["response"], digest))
+
+    def _judge(self, row: int, model: str, prompt: str, response: str, digest: str):
+        user = judge_input(prompt, response)
+        key = None
+        text = None
+        if self.cache is not None:
+            key = self.cache.make_key(self.client.base_url, self.model, self.rubric["prompt"], JUDGE_TEMPERATURE,
+                                      self.max_tokens, user)
+            text = self.cache.get_many([key]).get(key)
+        record = {"model": model, "response_hash": digest, "cached": text is not None}
+        if text is None:
+            res = call_llm_result(self.client, self.model, user, self.rubric["prompt"], JUDGE_TEMPERATURE,
+                                  self.max_tokens, self.scheduler)
+            record["time"] = res["time"]
+            if res.get("error"):
+                self._finish(row, {**record, "scores": {}, "weighted": None,
+                                   "reasoning": res["response"], "error": res["error"]})
+                return
+            text = res["response"]
+        judgment = parse_judgment(text, self.rubric)
+        if key is not None and not record["cached"] and "error" not in judgment:
+            self.cache.put(key, text)
+        self._finish(row, {**record, **judgment})
+
+    def _finish(self, row: int, record: dict):
+        self.journal.append_judgment(row, record)
+        with self._lock:
+            if "error" in record:
+                self.stats["failed"] += 1
+                # 失败的评分不算完成，同一进程内再次提交（如 backfill）时重试
+                self._judged.pop((row, record["model"]), None)
+            else:
+                self.stats["judged"] += 1
+                self.stats["cache_hits"] += record["cached"]
+
+    def backfill(self, rows: range, render_chunk, chunk_size: int = 500):
+        """为 journal 中已有但还没有评分的结果补交评分（续跑、中途开启评分时使用）
+
+        render_chunk 与 evaluate_to_journal 相同，只渲染需要补评分的行。
+        """
+        pending = {}
+        for res in self.journal.load_results():
+            if res["row"] in rows and not res.get("error") \
+                    and self._judged.get((res["row"], res.get("model"))) != response_hash(res["response"]):
+                pending.setdefault(res["row"], []).append(res)
+        todo = sorted(pending)
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            for row, prompt in zip(chunk, render_chunk(chunk)):
+                for res in pending[row]:
+                    self.submit(row, res.get("model"), prompt, res)
+
+    def close(self) -> dict:
+        """等待已提交的评分全部完成，返回统计"""
+        try:
+            while True:
+                with self._lock:
+                    futures, self._futures = self._futures, []
+                if not futures:
+                    break
+                for future in futures:
+                    future.result()
+        finally:
+            self._executor.shutdown(wait=True)
+            self.journal.close()
+        return dict(self.stats)
+
+
+def summarize_judgments(journal: RunJournal) -> dict[str, dict]:
+    """每个模型的评分条数和各维度、加权分的平均值（只统计与当前响应一致的评分）"""
+    current = {(res["row"], res.get("model") or ""): response_hash(res["response"])
+               for res in journal.load_results() if not res.get("error")}
+    stats = {}
+    for key, item in journal.load_judgments().items():
+        if current.get(key) != item.get("response_hash"):
+            continue
+        model = stats.setdefault(key[1], {"judged": 0, "failed": 0, "totals": {}, "counts": {}})
+        if "error" in item:
+            model["failed"] += 1
+            continue
+        model["judged"] += 1
+        for dim, score in [*item["scores"].items(), ("weighted", item["weighted"])]:
+            if score is not None:
+                model["totals"][dim] = model["totals"].get(dim, 0.0) + score
+                model["counts"][dim] = model["counts"].get(dim, 0) + 1
+    for model in stats.values():
+        totals, counts = model.pop("totals"), model.pop("counts")
+        model["averages"] = {dim: totals[dim] / counts[dim] for dim in totals}
+    return stats
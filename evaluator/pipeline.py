@@ -0,0 +1,288 @@
+"""多阶段流水线：按行把上游阶段的输出映射进下游模板"""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from graphlib import CycleError, TopologicalSorter
+from pathlib import Path
+
+from evaluator.clients import client_for, model_concurrency
+from evaluator.config import BASE_DIR, describe_targets, resolve_targets
+from evaluator.dataset import DatasetReader
+from evaluator.engine import call_llm_result
+from evaluator.ratelimit import get_scheduler
+from evaluator.storage import ResponseCache, RunJournal
+from evaluator.templates import extract_placeholders, parse_path, render_columns, required_columns
+from prompt_store import load_library, resolve_modules
+
+# ============== 多阶段流水线 ==============
+
+STAGE_NAME_PATTERN = re.compile(r'[\w-]+')
+# 映射来源以 @ 开头时取上游阶段的输出，如 @hub 或 @hub.routing.status_route.target
+STAGE_REF_PREFIX = "@"
+
+
+def stage_ref(source: str) -> str:
+    """映射来源引用的上游阶段名，不是阶段引用时返回 None"""
+    if not isinstance(source, str) or not source.startswith(STAGE_REF_PREFIX):
+        return None
+    steps = parse_path(source[len(STAGE_REF_PREFIX):])
+    return steps[0] if steps and isinstance(steps[0], str) else None
+
+
+def _spec_text(stage: dict, text_key: str, file_key: str, base_dir: Path) -> str:
+    """阶段的内联文本或文件内容，文件路径相对 spec 所在目录，找不到时相对仓库根目录
+
+    文件中的 MODULE 块替换为全局模块的当前内容并去掉标记，与策略库编译结果一致。
+    """
+    if stage.get(text_key):
+        return stage[text_key]
+    if not stage.get(file_key):
+        return None
+    path = Path(stage[file_key])
+    if not path.is_absolute():
+        path = base_dir / path if (base_dir / path).exists() else BASE_DIR / path
+    return resolve_modules(path.read_text(encoding='utf-8'), {})[0]
+
+
+def load_pipeline(spec: dict | str | Path, default_model: str = None) -> dict:
+    """解析流水线定义，返回已解析模板、按拓扑序排列阶段的 pipeline（原样写入运行的 meta）
+
+    spec 为 JSON 文件路径或 dict，stages 中每个阶段：
+        module / template_file / prompt   User 模板：策略库模块 key、模板文件或内联文本
+        system / system_file              System Prompt（缺省取 module 自带的 System 模板）
+        mapping                           {占位符: 来源}，来源为评估集字段或 @阶段[.JSON 路径]，缺省按同名字段；
+                                          System 中的占位符按同一映射逐行填充，映射的 key 必须是模板中的占位符
+        when                              {来源: 取值或取值列表}，不满足时该行跳过此阶段（及依赖它的阶段）
+        after                             额外的依赖阶段（mapping / when 中引用的阶段自动成为依赖）
+        model / temperature / max_tokens  缺省用运行参数
+    例：Decision Hub 的输出路由到卫星模块（tests/test_pipeline.py 按此示例运行）
+        {"stages": {
+            "hub": {"module": "decision_hub", "mapping": {"new_info": "message"}},
+            "status": {"module": "status_refiner",
+                       "mapping": {"original_status": "status", "new_info": "@hub.routing.status_route.payload"},
+                       "when": {"@hub.routing.status_route.target": "SATELLITE_REFINER"}}}}
+    """
+    base_dir = BASE_DIR
+    if not isinstance(spec, dict):
+        base_dir = Path(spec).resolve().parent
+        spec = json.loads(Path(spec).read_text(encoding='utf-8'))
+    if not spec.get("stages"):
+        raise ValueError("流水线没有定义 stages")
+    library = None
+    stages = {}
+    for name, stage in spec["stages"].items():
+        if not STAGE_NAME_PATTERN.fullmatch(name):
+            raise ValueError(f"阶段名只能包含字母、数字、下划线和 -: {name}")
+        system = ""
+        if stage.get("module"):
+            if library is None:
+                library = load_library()
+            module = library.get(stage["module"])
+            if module is None:
+                raise ValueError(f"阶段 {name}: 策略库中没有模块 {stage['module']}")
+            system, template = module["system"], module["user"]
+        else:
+            template = _spec_text(stage, "prompt", "template_file", base_dir)
+        system = _spec_text(stage, "system", "system_file", base_dir) or system
+        if not template:
+            raise ValueError(f"阶段 {name} 没有 prompt 模板")
+        placeholders = extract_placeholders(f"{system}\n{template}")
+        mapping = stage.get("mapping") or {p: p for p in placeholders}
+        unknown = [key for key in mapping if key not in placeholders]
+        if unknown:
+            raise ValueError(f"阶段 {name} 的 mapping 中 {', '.join(unknown)} 不是模板中的占位符"
+                             f"（模板占位符: {', '.join(placeholders) or '无'}）")
+        when = {source: [str(v) for v in (value if isinstance(value, list) else [value])]
+                for source, value in (stage.get("when") or {}).items()}
+        refs = [stage_ref(source) for source in [*mapping.values(), *when]]
+        stages[name] = {
+            "model": stage.get("model") or default_model,
+            "system": system,
+            "template": template,
+            "mapping": mapping,
+            "when": when,
+            "deps": list(dict.fromkeys([*stage.get("after", []), *(ref for ref in refs if ref)])),
+            "temperature": stage.get("temperature"),
+            "max_tokens": stage.get("max_tokens"),
+        }
+    for name, stage in stages.items():
+        unknown = [dep for dep in stage["deps"] if dep not in stages]
+        if unknown:
+            raise ValueError(f"阶段 {name} 引用了不存在的阶段: {', '.join(unknown)}")
+        if not stage["model"]:
+            raise ValueError(f"阶段 {name} 没有指定模型")
+    try:
+        order = list(TopologicalSorter({name: stage["deps"] for name, stage in stages.items()}).static_order())
+    except CycleError as e:
+        raise ValueError(f"流水线存在循环依赖: {' -> '.join(e.args[1])}")
+    return {"stages": {name: stages[name] for name in order}}
+
+
+def pipeline_columns(pipeline: dict, columns) -> list[str]:
+    """各阶段模板和 when 条件实际需要读取的评估集字段"""
+    all_columns = [*columns, *(f"{STAGE_REF_PREFIX}{name}" for name in pipeline["stages"])]
+    needed = []
+    for stage in pipeline["stages"].values():
+        needed += required_columns(f"{stage['system']}\n{stage['template']}", stage["mapping"], all_columns)
+        for source in stage["when"]:
+            needed += required_columns("{{value}}", {"value": source}, all_columns)
+    return [col for col in dict.fromkeys(needed) if col in columns]
+
+
+def stage_skip_reason(stage: dict, outputs: dict[str, dict], values: dict) -> str:
+    """该行不执行此阶段的原因：上游已跳过，或 when 条件不满足；需要执行时返回 None"""
+    for dep in stage["deps"]:
+        if outputs[dep].get("error") == "skipped":
+            return f"上游阶段 {dep} 已跳过"
+    for source, expected in stage["when"].items():
+        actual = render_columns("{{value}}", {"value": source}, values, 1)[0]
+        if actual not in expected:
+            return f"条件不满足: {source} = {actual!r}"
+    return None
+
+
+def run_pipeline(journal: RunJournal, pipeline: dict, dataset: "DatasetReader", rows: range,
+                 temperature: float, max_tokens: int, max_workers: int = 16,
+                 cache: ResponseCache = None, progress_callback=None, chunk_size: int = 200) -> dict:
+    """按行流水线执行各阶段，结果逐条写入 journal（model 字段为阶段名）
+
+    每行在上一阶段完成后立即渲染并提交下一阶段，不等整批完成；同一行互不依赖的分支并发执行。
+    在途调用少于 max_workers 时才按行号顺序放入新行，已进入流水线的行优先推进，
+    单行的端到端延迟不随总行数增长。
+    journal 中已成功或按条件跳过的 (行, 阶段) 在续跑时直接复用；失败阶段的下游不执行也不记录，续跑时一并重试。
+    返回 {"calls", "cache_hits", "errors", "skipped", "blocked", "rows", "row_latency": [每行端到端秒数]}。
+    """
+    stages = pipeline["stages"]
+    targets = resolve_targets(list(dict.fromkeys(stage["model"] for stage in stages.values())))
+    clients = {}
+    # 配置了 max_concurrency 的模型额外限制自身的在途调用数
+    limits = {}
+    for key, config in targets.items():
+        clients[key] = client_for(config, model_concurrency(config, max_workers))
+        get_scheduler(config["api_base"]).configure(config.get("rpm"), config.get("tpm"))
+        if model_concurrency(config, max_workers) < max_workers:
+            limits[key] = threading.BoundedSemaphore(config["max_concurrency"])
+    columns = pipeline_columns(pipeline, dataset.columns)
+
+    outputs = {}
+    for res in journal.load_results():
+        if res.get("model") in stages and res.get("error") in (None, "skipped"):
+            outputs.setdefault(res["row"], {})[res["model"]] = res
+    todo = [row for row in rows if len(outputs.get(row, {})) < len(stages)]
+    total = sum(len(stages) - len(outputs.get(row, {})) for row in todo) or 1
+    stats = {"calls": 0, "cache_hits": 0, "errors": 0, "skipped": 0, "blocked": 0, "rows": 0, "row_latency": []}
+    settled = 0
+    values = {}
+    started = {}
+    running = {}
+    failed = set()
+    in_flight = {}
+    buffer = {}
+    next_row = iter(todo)
+    position = 0
+
+    def call_stage(name: str, prompt: str, system_prompt: str) -> dict:
+        stage = stages[name]
+        config = targets[stage["model"]]
+        stage_temperature = temperature if stage["temperature"] is None else stage["temperature"]
+        stage_max_tokens = stage["max_tokens"] or max_tokens
+        key = None
+        if cache is not None:
+            key = cache.make_key(config["api_base"], config["model_name"], system_prompt, stage_temperature,
+                                 stage_max_tokens, prompt)
+            hit = cache.get_many([key]).get(key)
+            if hit is not None:
+                return {"response": hit, "time": 0.0, "cached": True}
+        with limits.get(stage["model"]) or nullcontext():
+            res = call_llm_result(clients[stage["model"]], config["model_name"], prompt, system_prompt or None,
+                                  stage_temperature, stage_max_tokens, get_scheduler(config["api_base"]))
+        if key is not None and not res.get("error"):
+            cache.put(key, res["response"])
+            res["cached"] = False
+        return res
+
+    def record(row: int, name: str, res: dict):
+        nonlocal settled
+        journal.append(row, {"model": name, **res})
+        settled += 1
+        if progress_callback:
+            progress_callback(min(settled / total, 1.0))
+        if res.get("error") == "skipped":
+            stats["skipped"] += 1
+        elif res.get("error"):
+            stats["errors"] += 1
+            failed.add((row, name))
+            return
+        else:
+            stats["calls"] += 1
+            stats["cache_hits"] += bool(res.get("cached"))
+        outputs[row][name] = res
+
+    def advance(row: int):
+        """提交该行所有依赖已满足的阶段，按条件跳过的阶段直接记录"""
+        for name, stage in stages.items():
+            if name in outputs[row] or (row, name) in running or (row, name) in failed \
+                    or any(dep not in outputs[row] for dep in stage["deps"]):
+                continue
+            row_values = {**values[row], **{f"{STAGE_REF_PREFIX}{dep}": [res["response"]]
+                                            for dep, res in outputs[row].items()}}
+            reason = stage_skip_reason(stage, outputs[row], row_values)
+            if reason:
+                # stages 按拓扑序排列，跳过后依赖它的阶段在本轮循环中随后处理
+                record(row, name, {"response": f"[SKIPPED] {reason}", "time": 0.0, "error": "skipped"})
+                continue
+            prompt = render_columns(stage["template"], stage["mapping"], row_values, 1)[0]
+            system_prompt = render_columns(stage["system"], stage["mapping"], row_values, 1)[0]
+            running[(row, name)] = True
+            in_flight[executor.submit(call_stage, name, prompt, system_prompt)] = (row, name)
+        if not any(key[0] == row for key in running):
+            if len(outputs[row]) == len(stages):
+                stats["rows"] += 1
+                stats["row_latency"].append(time.time() - started[row])
+            else:
+                stats["blocked"] += 1
+            values.pop(row)
+
+    def admit():
+        nonlocal position, buffer
+        while len(in_flight) < max_workers:
+            row = next(next_row, None)
+            if row is None:
+                return
+            if row not in buffer:
+                block = todo[position:position + chunk_size]
+                fetched = dataset.fetch(block, columns)
+                buffer = {r: {col: [fetched[col][i]] for col in columns} for i, r in enumerate(block)}
+                position += len(block)
+            values[row] = buffer.pop(row)
+            started[row] = time.time()
+            outputs.setdefault(row, {})
+            advance(row)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            admit()
+            while in_flight:
+                finished, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    row, name = in_flight.pop(future)
+                    del running[(row, name)]
+                    record(row, name, future.result())
+                    advance(row)
+                admit()
+    finally:
+        journal.close()
+    return stats
+
+
+def describe_pipeline(pipeline: dict) -> dict[str, dict]:
+    """运行记录中的 models：每个阶段一列结果，记录所用模型（不含 api_key）"""
+    targets = describe_targets(resolve_targets(list(dict.fromkeys(s["model"] for s in pipeline["stages"].values()))))
+    return {name: {**targets[stage["model"]], "config": stage["model"], "deps": stage["deps"]}
+            for name, stage in pipeline["stages"].items()}
@@ -0,0 +1,136 @@
+"""按 endpoint 的 RPM / TPM 限流与重试策略"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+
+from openai import APIConnectionError
+
+# ============== 限流与重试 ==============
+
+class TokenBucket:
+    """令牌桶：每分钟 per_minute 个令牌匀速补充，最多积攒 burst_seconds 秒的额度
+
+    reserve 允许透支，返回调用方需要等待的秒数，线程和协程都可以直接用。
+    """
+
+    def __init__(self, per_minute: float, burst_seconds: float = 5.0):
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refund(self, amount: float):
+        """归还预约时多扣的令牌（amount 为负时补扣），不超过桶容量"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class EndpointScheduler:
+    """同一 api_base 共享的限流器：requests/min 与 tokens/min 两个令牌桶
+
+    收到 429 时 pause 让该 endpoint 的所有调用一起等待 Retry-After，避免各自重试造成震荡。
+    TPM 预约按 max_tokens 估算输出，请求完成后用 settle 按实际用量归还多扣的部分。
+    """
+
+    def __init__(self, rpm: float = None, tpm: float = None):
+        self._lock = threading.Lock()
+        self.requests = None
+        self.tokens = None
+        self.paused_until = 0.0
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm: float = None, tpm: float = None):
+        with self._lock:
+            if (self.requests.rate * 60 if self.requests else None) != rpm:
+                self.requests = TokenBucket(rpm) if rpm else None
+            if (self.tokens.rate * 60 if self.tokens else None) != tpm:
+                self.tokens = TokenBucket(tpm) if tpm else None
+
+    def reserve(self, tokens: int) -> float:
+        """预约一次请求，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.paused_until - now, 0.0)
+            if self.requests:
+                wait = max(wait, self.requests.reserve(1, now))
+            if self.tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now))
+            return wait
+
+    def settle(self, reserved: int, used: int):
+        """请求完成后按实际 token 用量修正 TPM 令牌桶"""
+        with self._lock:
+            if self.tokens:
+                self.tokens.refund(reserved - used)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_scheduler(api_base: str) -> EndpointScheduler:
+    """进程内按 api_base 共享的限流器"""
+    with _SCHEDULERS_LOCK:
+        if api_base not in _SCHEDULERS:
+            _SCHEDULERS[api_base] = EndpointScheduler()
+        return _SCHEDULERS[api_base]
+
+
+def estimate_request_tokens(messages: list[dict], max_tokens: int) -> int:
+    """粗略估算一次请求占用的 TPM：输入按 UTF-8 字节数 / 3（中文约 1 字 1 token），加上 max_tokens"""
+    return sum(len(message_text(m).encode("utf-8")) for m in messages) // 3 + max_tokens
+
+
+def used_request_tokens(result: dict, estimated: int, max_tokens: int) -> int:
+    """成功请求实际占用的 TPM：有 usage 时取 prompt + completion，否则把估算中的 max_tokens 换成实际输出"""
+    usage = result.get("usage")
+    if usage and usage.get("prompt_tokens") is not None and usage.get("completion_tokens") is not None:
+        return usage["prompt_tokens"] + usage["completion_tokens"]
+    return estimated - max_tokens + result["output_tokens"]
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """判断异常是否为限流 (HTTP 429)"""
+    return getattr(error, "status_code", None) == 429
+
+
+def is_transient_error(error: Exception) -> bool:
+    """429 / 408 / 409 / 5xx 与网络错误可重试，其余（鉴权、参数错误等）直接失败"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        return isinstance(error, (APIConnectionError, ConnectionError, TimeoutError))
+    return status in (408, 409, 429) or status >= 500
+
+
+def retry_delay(error: Exception, attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """重试等待时间：优先使用 Retry-After，否则指数退避加全抖动"""
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    try:
+        return float(headers.get("retry-after-ms")) / 1000
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def message_text(message: dict) -> str:
+    """content 可能是字符串或 [{"type": "text", "text": ...}] 片段列表"""
+    content = message["content"]
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content)
@@ -0,0 +1,342 @@
+"""响应缓存（SQLite）与运行日志（JSONL，支持断点续跑）"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from evaluator.config import BASE_DIR
+from evaluator.engine import StreamMonitor, batch_evaluate_models
+
+if TYPE_CHECKING:
+    from evaluator.judge import JudgePipeline
+
+# ============== 响应缓存 ==============
+
+CACHE_FILE = BASE_DIR / ".eval_cache" / "responses.sqlite"
+
+
+class ResponseCache:
+    """基于 SQLite 的 LLM 响应缓存
+
+    key 为 (api_base, model, system_prompt, temperature, max_tokens, prompt) 的 sha256，
+    不同 provider 上同名的模型不会共用缓存；
+    超过 max_age_days 的条目失效，总大小超过 max_bytes 时按最近访问时间淘汰（每 evict_interval 次写入执行一次）。
+    """
+
+    def __init__(self, path: Path = CACHE_FILE, max_bytes: int = 512 * 1024 * 1024,
+                 max_age_days: float = 30, evict_interval: int = 500):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self.evict_interval = evict_interval
+        self._writes = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # 结果逐条写入，WAL 下 NORMAL 不必每次提交都 fsync，断电最多丢失最近几条缓存
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+
+    @staticmethod
+    def make_key(api_base, model: str, system_prompt: str, temperature: float, max_tokens: int,
+                 prompt: str) -> str:
+        """api_base 可为配置中的字符串或 client.base_url，末尾的 / 不影响 key"""
+        payload = json.dumps([str(api_base or "").rstrip("/"), model, system_prompt or "", temperature,
+                              max_tokens, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """批量查询，返回命中的 {key: response}"""
+        now = time.time()
+        found = {}
+        with self._lock, self._conn:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, response FROM responses WHERE key IN ({marks}) AND created_at >= ?",
+                    (*chunk, now - self.max_age)
+                ).fetchall()
+                found.update(rows)
+            self._conn.executemany(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+        return found
+
+    def put_many(self, items: dict[str, str]):
+        """批量写入，累计写入 evict_interval 条后执行一次淘汰"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                [(key, response, len(key) + len(response.encode("utf-8")), now, now)
+                 for key, response in items.items()]
+            )
+            self._writes += len(items)
+            if self._writes >= self.evict_interval:
+                self._writes = 0
+                self._evict(now)
+
+    def put(self, key: str, response: str):
+        """写入单条结果（每条结果完成时调用）"""
+        self.put_many({key: response})
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        self._conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            "SELECT key FROM (SELECT key, SUM(size) OVER ("
+            "ORDER BY accessed_at DESC, key ROWS UNBOUNDED PRECEDING) AS total "
+            "FROM responses) WHERE total > ?)",
+            (self.max_bytes,)
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"entries": count, "bytes": size}
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+
+# ============== 运行日志 ==============
+
+RUNS_DIR = BASE_DIR / ".eval_runs"
+
+
+class RunJournal:
+    """评估运行日志
+
+    每个运行一个目录：meta.json 记录模板、映射和参数，results.jsonl 在每条结果完成时追加一行，
+    judgments.jsonl 记录 LLM 评分（见 JudgePipeline）。
+    页面刷新或进程崩溃后按 run_id 重新挂载，已写入的行在续跑时跳过。
+    """
+
+    def __init__(self, run_id: str = None, runs_dir: Path = RUNS_DIR):
+        self.run_id = run_id or f"{datetime.now():%Y%m%d_%H%M%S}_{uuid.uuid4().hex[:6]}"
+        self.dir = Path(runs_dir) / self.run_id
+        self.meta_path = self.dir / "meta.json"
+        self.results_path = self.dir / "results.jsonl"
+        self.judgments_path = self.dir / "judgments.jsonl"
+        self._lock = threading.Lock()
+        self._files = {}
+
+    @staticmethod
+    def list_runs(runs_dir: Path = RUNS_DIR) -> list[str]:
+        """按时间倒序列出已有的 run_id"""
+        if not Path(runs_dir).exists():
+            return []
+        return sorted((p.name for p in Path(runs_dir).iterdir() if (p / "meta.json").exists()),
+                      reverse=True)
+
+    def exists(self) -> bool:
+        return self.meta_path.exists()
+
+    def write_meta(self, meta: dict):
+        self.dir.mkdir(parents=True, exist_ok=True)
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    def read_meta(self) -> dict:
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    @staticmethod
+    def _iter_lines(path: Path):
+        if not path.exists():
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def iter_results(self):
+        """逐行读取已完成的结果，跳过崩溃时写了一半的行"""
+        return self._iter_lines(self.results_path)
+
+    def iter_judgments(self):
+        """逐行读取 LLM 评分记录（judgments.jsonl）"""
+        return self._iter_lines(self.judgments_path)
+
+    def _last_errors(self) -> dict[str, dict[int, str]]:
+        """{模型: {行号: 最后一次结果的 error（成功为 None）}}"""
+        states = {}
+        for res in self.iter_results():
+            states.setdefault(res.get("model"), {})[res["row"]] = res.get("error")
+        return states
+
+    def done_indexes(self) -> dict[str, set[int]]:
+        """每个模型已完成的行号
+
+        最后一次结果为临时失败（429 / 超时 / 5xx，见 is_transient_error）的行不算完成，续跑时重新调用；
+        永久失败和超出上下文跳过的行算完成。
+        """
+        return {model: {row for row, error in rows.items() if error != "transient"}
+                for model, rows in self._last_errors().items()}
+
+    def retry_indexes(self) -> dict[str, set[int]]:
+        """每个模型最后一次结果为临时失败、续跑时会重试的行号"""
+        return {model: {row for row, error in rows.items() if error == "transient"}
+                for model, rows in self._last_errors().items()}
+
+    def load_results(self) -> list[dict]:
+        """按行号、模型排序返回全部结果（同一行同一模型以最后一次为准）"""
+        by_key = {(res["row"], res.get("model") or ""): res for res in self.iter_results()}
+        return [by_key[key] for key in sorted(by_key)]
+
+    def load_judgments(self) -> dict[tuple, dict]:
+        """{(行号, 模型): 评分记录}，同一行同一模型以最后一次为准"""
+        return {(item["row"], item.get("model") or ""): item for item in self.iter_judgments()}
+
+    def judged(self) -> dict[tuple, str]:
+        """{(行号, 模型): 已成功评分的响应哈希}，响应被重跑改变后哈希不再匹配，需要重新评分"""
+        return {key: item["response_hash"] for key, item in self.load_judgments().items()
+                if "error" not in item}
+
+    def stamp(self) -> tuple:
+        """results.jsonl 与 judgments.jsonl 的 (大小, 修改时间)，追加结果或评分后会变化，
+        用于判断导出文件和页面缓存是否过期"""
+        stamp = ()
+        for path in (self.results_path, self.judgments_path):
+            stat = path.stat() if path.exists() else None
+            stamp += (stat.st_size, stat.st_mtime_ns) if stat else (0, 0)
+        return stamp
+
+    def _write(self, path: Path, record: dict):
+        with self._lock:
+            f = self._files.get(path)
+            if f is None:
+                self.dir.mkdir(parents=True, exist_ok=True)
+                f = self._files[path] = open(path, 'a', encoding='utf-8')
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+
+    def append(self, row_idx: int, result: dict):
+        self._write(self.results_path, {"row": row_idx, **result})
+
+    def append_judgment(self, row_idx: int, judgment: dict):
+        self._write(self.judgments_path, {"row": row_idx, **judgment})
+
+    def close(self):
+        with self._lock:
+            for f in self._files.values():
+                f.close()
+            self._files.clear()
+
+
+def evaluate_to_journal(journal: RunJournal, rows: range, render_chunk,
+                        targets: dict[str, dict], system_prompt: str, temperature: float,
+                        max_tokens: int, max_workers: int = 3, engine: str = "thread",
+                        cache: ResponseCache = None, progress_callback=None,
+                        chunk_size: int = 500, skip: dict[str, dict[int, dict]] = None,
+                        monitor: "StreamMonitor" = None, judge: "JudgePipeline" = None) -> int:
+    """分块渲染并评估 rows，结果逐条写入 journal，返回本次新完成的调用数
+
+    render_chunk(row_indexes) 返回这些行拼接好的 prompt 列表，每块只渲染一次、发给 targets 中所有模型；
+    journal 中已完成的 (行, 模型) 直接跳过（续跑）；每次只渲染 chunk_size 行，内存占用与总行数无关。
+    skip 为 {配置名: {行号: 结果}}（见 skipped_results），这些行不调用 API，直接写入给定结果。
+    传入 judge 时每条结果写入后立即提交评分，评分与后续生成并行；调用方负责 judge.close()。
+    """
+    done = journal.done_indexes()
+    write_skipped(journal, rows, skip, done)
+    todo = [i for i in rows if any(i not in done.get(key, ()) for key in targets)]
+    pending = sum(1 for key in targets for i in todo if i not in done.get(key, ()))
+    total = len(rows) * len(targets)
+    finished = total - pending
+    if progress_callback and finished:
+        progress_callback(finished / total)
+
+    def record(row: int, key: str, prompt: str, res: dict):
+        journal.append(row, {"model": key, **res})
+        if judge is not None:
+            judge.submit(row, key, prompt, res)
+
+    try:
+        for start in range(0, len(todo), chunk_size):
+            chunk = todo[start:start + chunk_size]
+            prompts = render_chunk(chunk)
+            indexes = {
+                key: [j for j, row in enumerate(chunk) if row not in done.get(key, ())]
+                for key in targets
+            }
+            size = sum(len(idx) for idx in indexes.values())
+            chunk_progress = None
+            if progress_callback:
+                def chunk_progress(p, base=finished, size=size):
+                    progress_callback((base + p * size) / total)
+            batch_evaluate_models(
+                prompts, targets, system_prompt, temperature, max_tokens, max_workers,
+                progress_callback=chunk_progress, engine=engine, cache=cache, indexes=indexes, monitor=monitor,
+                on_result=lambda key, j, res, chunk=chunk, prompts=prompts: record(chunk[j], key, prompts[j], res)
+            )
+            finished += size
+    finally:
+        journal.close()
+    return pending
+
+
+def write_skipped(journal: RunJournal, rows: range, skip: dict[str, dict[int, dict]], done: dict[str, set[int]]):
+    """把预检跳过的行直接写入 journal，并更新 done"""
+    for key, skipped in (skip or {}).items():
+        for row in rows:
+            if row in skipped and row not in done.get(key, ()):
+                journal.append(row, {"model": key, **skipped[row]})
+                done.setdefault(key, set()).add(row)
+
+
+def pivot_results(results: list[dict], model_keys: list[str], judgments: dict[tuple, dict] = None,
+                  dimensions: list[str] = ()) -> list[dict]:
+    """把 (行, 模型) 结果转成宽表：单模型为 模型响应/耗时(秒)/首 token/输出 tokens/tokens/s，
+    多模型每列带 [模型名] 后缀；非流式运行没有首 token 延迟，缓存命中没有 token 指标。
+    传入 dimensions 时追加 评分(维度)/加权分/评语 列，judgments 为 RunJournal.load_judgments()，
+    评分对应的响应已被重跑替换时留空"""
+    judgments = judgments or {}
+    by_row = {}
+    for res in results:
+        row_data = by_row.setdefault(res["row"], {"序号": res["row"]})
+        suffix = f"[{res.get('model')}]" if len(model_keys) > 1 else ""
+        row_data[f"模型响应{suffix}"] = res["response"]
+        row_data[f"耗时(秒){suffix}"] = round(res["time"], 2)
+        row_data[f"首 token(秒){suffix}"] = round(res["ttft"], 3) if res.get("ttft") is not None else None
+        row_data[f"输出 tokens{suffix}"] = res.get("output_tokens")
+        tps = res.get("tokens_per_sec")
+        row_data[f"tokens/s{suffix}"] = round(tps, 1) if tps is not None else None
+        if dimensions:
+            judgment = judgments.get((res["row"], res.get("model") or ""))
+            if judgment is not None and judgment.get("response_hash") != response_hash(res["response"]):
+                judgment = None
+            judgment = judgment or {}
+            for dim in dimensions:
+                row_data[f"评分({dim}){suffix}"] = (judgment.get("scores") or {}).get(dim)
+            weighted = judgment.get("weighted")
+            row_data[f"加权分{suffix}"] = round(weighted, 2) if weighted is not None else None
+            row_data[f"评语{suffix}"] = judgment.get("reasoning")
+    return [by_row[row] for row in sorted(by_row)]
+
+
+def response_hash(response: str) -> str:
+    return hashlib.sha256(response.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,248 @@
+"""{{占位符}} 模板：解析、字段映射与按列批量渲染"""
+
+from __future__ import annotations
+
+import json
+import re
+from functools import lru_cache
+from itertools import repeat
+from typing import TYPE_CHECKING
+
+from prompt_store import PLACEHOLDER_PATTERN
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from evaluator.dataset import DatasetReader
+
+# ============== 工具函数 ==============
+
+class CompiledTemplate:
+    """预编译的 prompt 模板
+
+    模板只解析一次，拆成 literal 片段和占位符槽位交替的列表；
+    渲染时把每个槽位替换为对应占位符的值，再做一次 join。
+    """
+
+    def __init__(self, template: str):
+        parts = PLACEHOLDER_PATTERN.split(template)
+        names = parts[1::2]
+        # 去重并保持顺序
+        self.placeholders = list(dict.fromkeys(names))
+        index = {name: i for i, name in enumerate(self.placeholders)}
+        # 未映射的占位符保留原样
+        self.defaults = [f"{{{{{name}}}}}" for name in self.placeholders]
+        self.segments = parts
+        self.slots = [(2 * i + 1, index[name]) for i, name in enumerate(names)]
+
+    def render(self, values) -> str:
+        """values 按 self.placeholders 的顺序给出每个占位符的取值"""
+        parts = self.segments[:]
+        for pos, slot in self.slots:
+            parts[pos] = values[slot]
+        return "".join(parts)
+
+
+@lru_cache(maxsize=64)
+def compile_template(prompt_template: str) -> CompiledTemplate:
+    """编译 prompt 模板（按模板内容缓存）"""
+    return CompiledTemplate(prompt_template)
+
+
+def extract_placeholders(prompt_template: str) -> list[str]:
+    """从 prompt 模板中提取所有 {{xxx}} 占位符"""
+    return list(compile_template(prompt_template).placeholders)
+
+
+# 映射到该键的字段视为整行 JSON，未单独映射的占位符按完整路径从中取值
+JSON_ROOT_KEY = "*"
+
+PATH_TOKEN_PATTERN = re.compile(r'\[(\d+)\]|([^.\[\]]+)')
+# 模型输出常把 JSON 包在 ```json 代码块里（流水线中上游阶段的输出作为下游的字段）
+JSON_FENCE_PATTERN = re.compile(r'```(?:json)?[^\n]*\n(.*?)```', re.DOTALL)
+
+
+def parse_path(path: str) -> tuple:
+    """把 `a.b[0].c` 拆成 ("a", "b", 0, "c")"""
+    return tuple(
+        int(index) if index else key.strip()
+        for index, key in PATH_TOKEN_PATTERN.findall(path)
+    )
+
+
+def placeholder_roots(placeholders: list[str]) -> dict[str, list[str]]:
+    """按根字段归组带路径的占位符，如 user_info -> [user_info.user_name, ...]"""
+    roots = {}
+    for placeholder in placeholders:
+        steps = parse_path(placeholder)
+        if len(steps) > 1:
+            roots.setdefault(steps[0], []).append(placeholder)
+    return roots
+
+
+class FieldAccessor:
+    """占位符取值器：column 为评估集字段，steps 为在该字段 JSON 内的 key/下标路径"""
+
+    __slots__ = ("column", "steps")
+
+    def __init__(self, column: str, steps: tuple = ()):
+        self.column = column
+        self.steps = steps
+
+    def walk(self, doc) -> str:
+        """从已解析的 JSON 中按路径取值"""
+        value = doc
+        for step in self.steps:
+            if isinstance(step, int) and isinstance(value, list) and -len(value) <= step < len(value):
+                value = value[step]
+            elif isinstance(step, str) and isinstance(value, dict) and step in value:
+                value = value[step]
+            else:
+                return ""
+        if value is None:
+            return ""
+        if isinstance(value, (dict, list)):
+            return json.dumps(value, ensure_ascii=False)
+        return str(value)
+
+
+def _resolve_source(source: str, steps: tuple, columns: tuple):
+    """source 为字段名或 `字段名.路径`，steps 为追加在其后的路径"""
+    if source in columns:
+        return FieldAccessor(source, steps)
+    source_steps = parse_path(source)
+    if source_steps and source_steps[0] in columns:
+        return FieldAccessor(source_steps[0], source_steps[1:] + steps)
+    return None
+
+
+@lru_cache(maxsize=64)
+def _compile_accessors(template: str, mapping_items: tuple, columns: tuple) -> tuple:
+    mapping = dict(mapping_items)
+    accessors = []
+    for placeholder in compile_template(template).placeholders:
+        steps = parse_path(placeholder)
+        accessor = None
+        if mapping.get(placeholder):
+            accessor = _resolve_source(mapping[placeholder], (), columns)
+        elif len(steps) > 1 and mapping.get(steps[0]):
+            accessor = _resolve_source(mapping[steps[0]], steps[1:], columns)
+        elif mapping.get(JSON_ROOT_KEY):
+            accessor = _resolve_source(mapping[JSON_ROOT_KEY], steps, columns)
+        accessors.append(accessor)
+    return tuple(accessors)
+
+
+def compile_accessors(template: str, mapping: dict, columns) -> tuple:
+    """为模板中每个占位符预编译取值器，未映射的为 None
+
+    解析优先级：占位符本身的映射 > 根字段的映射（如 user_info）> 整行 JSON 字段（JSON_ROOT_KEY）
+    """
+    return _compile_accessors(template, tuple(mapping.items()), tuple(columns))
+
+
+def _is_missing(value) -> bool:
+    """None / NaN / pd.NA 视为缺失"""
+    if value is None:
+        return True
+    try:
+        return bool(value != value)
+    except (TypeError, ValueError):
+        return True
+
+
+def _cell_to_str(value) -> str:
+    return "" if _is_missing(value) else str(value)
+
+
+def _load_json(value):
+    """解析 JSON 单元格（整格为 JSON 或含 ```json 代码块），已是 dict/list 的直接返回，无法解析返回 None"""
+    if isinstance(value, (dict, list)):
+        return value
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+        fence = JSON_FENCE_PATTERN.search(value)
+        if fence:
+            try:
+                return json.loads(fence.group(1))
+            except ValueError:
+                pass
+    return None
+
+
+def fill_prompt(template: str, mapping: dict, row: pd.Series | dict) -> str:
+    """根据映射关系，用评估集数据（pandas 行或 dict）填充 prompt 模板"""
+    if hasattr(row, "tolist"):
+        # pandas 逐个 row[列] 取值的开销远大于渲染本身，先整体转成 dict
+        row = dict(zip(row.index.tolist(), row.tolist()))
+    compiled = compile_template(template)
+    values = compiled.defaults[:]
+    # 同一行里每个 JSON 字段只解析一次
+    parsed = {}
+    for i, accessor in enumerate(compile_accessors(template, mapping, row.keys())):
+        if accessor is None:
+            continue
+        if accessor.steps:
+            if accessor.column not in parsed:
+                parsed[accessor.column] = _load_json(row[accessor.column])
+            values[i] = accessor.walk(parsed[accessor.column])
+        else:
+            values[i] = _cell_to_str(row[accessor.column])
+    return compiled.render(values)
+
+
+def render_values(template: str, mapping: dict, data, length: int) -> list:
+    """按列取出每个占位符的值，返回与 compile_template(template).placeholders 对应的列列表
+
+    data 为列式数据：{列名: [值, ...]} 或 pandas DataFrame，length 为行数。
+    """
+    compiled = compile_template(template)
+    columns = []
+    parsed = {}
+    for i, accessor in enumerate(compile_accessors(template, mapping, data.keys())):
+        if accessor is None:
+            columns.append(repeat(compiled.defaults[i], length))
+            continue
+        col = data[accessor.column]
+        if accessor.steps:
+            if accessor.column not in parsed:
+                values = col.tolist() if hasattr(col, "tolist") else col
+                parsed[accessor.column] = [_load_json(v) for v in values]
+            columns.append([accessor.walk(doc) for doc in parsed[accessor.column]])
+        elif hasattr(col, "notna"):
+            columns.append(col.astype(str).where(col.notna(), "").tolist())
+        else:
+            columns.append([_cell_to_str(v) for v in col])
+    return columns
+
+
+def render_columns(template: str, mapping: dict, data, length: int) -> list[str]:
+    """按列批量填充，结果与逐行调用 fill_prompt 一致
+
+    data 为列式数据：{列名: [值, ...]} 或 pandas DataFrame，length 为行数。
+    """
+    compiled = compile_template(template)
+    if not compiled.placeholders:
+        return [template] * length
+    return [compiled.render(values) for values in zip(*render_values(template, mapping, data, length))]
+
+
+def render_frame(template: str, mapping: dict, df: pd.DataFrame) -> list[str]:
+    """按列批量填充整个 DataFrame，结果与逐行调用 fill_prompt 一致"""
+    return render_columns(template, mapping, df, len(df))
+
+
+def render_row(template: str, mapping: dict, dataset: "DatasetReader", idx: int) -> str:
+    """渲染评估集中的单行（页面预览用）：只读取模板需要的字段，与 render_columns 走同一路径"""
+    columns = required_columns(template, mapping, dataset.columns)
+    return render_columns(template, mapping, dataset.fetch([idx], columns), 1)[0]
+
+
+def required_columns(template: str, mapping: dict, columns) -> list[str]:
+    """渲染模板实际需要读取的评估集字段"""
+    return list(dict.fromkeys(
+        accessor.column for accessor in compile_accessors(template, mapping, columns) if accessor
+    ))
@@ -0,0 +1,165 @@
+"""调用前的 token 预检：按模型分词器计数并找出超出上下文窗口的行"""
+
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from evaluator.templates import compile_template, render_values, required_columns
+
+if TYPE_CHECKING:
+    from evaluator.dataset import DatasetReader
+
+# ============== Token 预检 ==============
+
+DEFAULT_TOKENIZER = "tiktoken:cl100k_base"
+# 模型配置未填 context_window 时使用
+DEFAULT_CONTEXT_WINDOW = 65536
+# chat 格式每条消息的固定开销，以及回复起始的开销（按 OpenAI 的计数规则）
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+# 分段计数在片段边界处可能与整体编码差几个 token，接近预算的行按完整文本重新计数
+EXACT_RECOUNT_RATIO = 0.9
+
+CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+
+def approx_token_count(text: str) -> int:
+    """离线近似计数：中日韩字符每字 1 token，其余按 4 字节 1 token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    rest = len(text.encode("utf-8")) - cjk * 3
+    return cjk + (rest + 3) // 4
+
+
+class TokenCounter:
+    """分词器 + 文本级计数缓存
+
+    模板中的 literal 片段（人设、core_laws 等共享前缀）和重复出现的字段值只编码一次。
+    name 为实际使用的分词器，加载失败回退到近似计数时为 "approx"，fallback 记录原因。
+    """
+
+    def __init__(self, spec: str = DEFAULT_TOKENIZER, cache_size: int = 65536):
+        self.spec = spec
+        self.cache_size = cache_size
+        self.fallback = None
+        self._cache = {}
+        try:
+            self._encode_len = self._load(spec)
+            self.name = spec
+        except Exception as e:
+            self._encode_len = approx_token_count
+            self.name = "approx"
+            self.fallback = None if spec == "approx" else f"{type(e).__name__}: {e}"
+
+    @staticmethod
+    def _load(spec: str):
+        kind, _, arg = spec.partition(":")
+        if kind == "tiktoken":
+            import tiktoken
+            encoding = tiktoken.get_encoding(arg or "cl100k_base")
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        if kind == "hf":
+            # 本地 tokenizer.json（如 DeepSeek / Qwen 发布的分词器），不需要联网
+            from tokenizers import Tokenizer
+            tokenizer = Tokenizer.from_file(arg)
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+        if kind == "approx":
+            return approx_token_count
+        raise ValueError(f"未知的分词器: {spec}")
+
+    def count(self, text: str, cache: bool = True) -> int:
+        if not text:
+            return 0
+        if not cache:
+            return self._encode_len(text)
+        n = self._cache.get(text)
+        if n is None:
+            n = self._encode_len(text)
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[text] = n
+        return n
+
+
+@lru_cache(maxsize=8)
+def get_token_counter(spec: str = DEFAULT_TOKENIZER) -> TokenCounter:
+    """按分词器配置复用 TokenCounter
+
+    spec 取值：tiktoken:<encoding>（需安装 tiktoken 并已缓存编码文件）、
+    hf:<tokenizer.json 路径>（需安装 tokenizers）、approx（离线近似）。
+    """
+    return TokenCounter(spec)
+
+
+def precheck_tokens(template: str, mapping: dict, dataset: "DatasetReader", rows: range,
+                    system_prompt: str, targets: dict[str, dict], max_tokens: int,
+                    chunk_size: int = 2000) -> dict:
+    """调用前统计每行的输入 token，标出超出上下文窗口的行并估算总用量和费用
+
+    不拼接整条 prompt：模板 literal 片段与 System Prompt 每个分词器只计数一次，
+    每行只对占位符的取值计数；接近预算的行再按完整文本精确计数。
+    返回 {"rows": 行数, "models": {配置名: {...}}}，其中 over_budget 为 {行号: 输入 token 数}，
+    这些行不计入 input_tokens / output_tokens / cost；output_tokens 按 max_tokens 上限估算。
+    """
+    compiled = compile_template(template)
+    columns = required_columns(template, mapping, dataset.columns)
+    groups = {}
+    for key, config in targets.items():
+        groups.setdefault(config.get("tokenizer") or DEFAULT_TOKENIZER, []).append(key)
+    windows = {key: int(config.get("context_window") or DEFAULT_CONTEXT_WINDOW) for key, config in targets.items()}
+    report = {key: {"input_tokens": 0, "max_input": 0, "over_budget": {}} for key in targets}
+
+    fixed = {}
+    for spec in groups:
+        counter = get_token_counter(spec)
+        fixed[spec] = (MESSAGE_OVERHEAD + REPLY_OVERHEAD
+                       + (MESSAGE_OVERHEAD + counter.count(system_prompt) if system_prompt else 0))
+
+    for start in range(rows.start, rows.stop, chunk_size):
+        idx = list(range(start, min(start + chunk_size, rows.stop)))
+        values = render_values(template, mapping, dataset.fetch(idx, columns), len(idx))
+        row_values = list(zip(*values)) if values else [()] * len(idx)
+        for spec, keys in groups.items():
+            counter = get_token_counter(spec)
+            literal = fixed[spec] + sum(counter.count(seg) for seg in compiled.segments[0::2])
+            recount_at = EXACT_RECOUNT_RATIO * (min(windows[key] for key in keys) - max_tokens)
+            for row, vals in zip(idx, row_values):
+                n = literal + sum(counter.count(vals[slot]) for _, slot in compiled.slots)
+                if n >= recount_at:
+                    n = fixed[spec] + counter.count(compiled.render(vals) if vals else template, cache=False)
+                for key in keys:
+                    item = report[key]
+                    if n + max_tokens > windows[key]:
+                        item["over_budget"][row] = n
+                        continue
+                    item["input_tokens"] += n
+                    item["max_input"] = max(item["max_input"], n)
+
+    for spec, keys in groups.items():
+        counter = get_token_counter(spec)
+        for key in keys:
+            item = report[key]
+            config = targets[key]
+            sent = len(rows) - len(item["over_budget"])
+            item.update(tokenizer=counter.name, tokenizer_fallback=counter.fallback,
+                        context_window=windows[key], output_tokens=sent * max_tokens)
+            if config.get("price_input") is not None or config.get("price_output") is not None:
+                item["cost"] = (item["input_tokens"] * float(config.get("price_input") or 0)
+                                + item["output_tokens"] * float(config.get("price_output") or 0)) / 1e6
+            else:
+                item["cost"] = None
+    return {"rows": len(rows), "models": report}
+
+
+def skipped_results(report: dict, max_tokens: int) -> dict[str, dict[int, dict]]:
+    """把预检中超出上下文窗口的行转成不调用 API 的结果，供 evaluate_to_journal 直接写入"""
+    return {
+        key: {
+            row: {"response": f"[SKIPPED] 输入约 {tokens} tokens + max_tokens {max_tokens} "
+                              f"超出上下文窗口 {item['context_window']}",
+                  "time": 0.0, "error": "overflow"}
+            for row, tokens in item["over_budget"].items()
+        }
+        for key, item in report["models"].items()
+    }
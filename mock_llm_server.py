@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+本地 OpenAI 兼容 Mock 服务
+===========================
+用于在不产生真实 API 费用的情况下压测评估引擎。
+实现 POST /v1/chat/completions，按配置的延迟返回固定格式的响应，
+在途请求超过 --max-in-flight 或每分钟 token 数超过 --tpm 时返回 429。
+延迟按 --distribution 采样（uniform / normal / lognormal / exponential），--output-tps 模拟生成速度；
+--error-rate / --throttle-rate 按概率注入 5xx / 429，用于测试重试与恢复。
+模拟 provider 的前缀缓存：messages 按 PREFIX_BLOCK 字符分块，与之前请求相同的前缀块计入
+usage.prompt_tokens_details.cached_tokens（token 数按字符数计）。
+请求带 stream=true 时按 SSE 返回：等待延迟后逐字符输出 chunk，
+stream_options.include_usage 为 true 时最后附带 usage chunk。
+
+用法：
+    python mock_llm_server.py --port 8765 --latency 0.2
+    python mock_llm_server.py --latency 0.5 --jitter 0.6 --distribution lognormal --error-rate 0.05
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 前缀缓存的块大小（字符），对应 provider 按固定 token 数分块缓存
+PREFIX_BLOCK = 64
+# 记录的前缀块上限，超出后清空
+PREFIX_CACHE_LIMIT = 1_000_000
+# 延迟分布：jitter 在 uniform 中为抖动幅度，normal 中为标准差，lognormal 中为对数标准差（latency 为中位数），
+# exponential 只使用 latency（均值）
+LATENCY_DISTRIBUTIONS = ("uniform", "normal", "lognormal", "exponential")
+# 注入的服务端错误
+ERROR_STATUSES = (500, 502, 503)
+
+
+def message_text(message: dict) -> str:
+    content = message.get("content", "")
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(body or b"{}")
+
+        server = self.server
+        messages = request.get("messages", [{}])
+        text = "\0".join(message_text(m) for m in messages)
+        prompt = message_text(messages[-1])
+        content = server.make_content(prompt)
+        keys = server.prefix_keys(text)
+        fault = server.inject_fault()
+        if fault is not None and fault != 429:
+            self._send_json(fault, {"error": {"message": f"Injected server error {fault}", "type": "server_error"}})
+            return
+        if fault == 429 or not server.reserve_tokens(len(text) + len(content)) or not server.enter():
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}},
+                headers={"Retry-After": str(server.retry_after)}
+            )
+            return
+        cached = server.lookup_prefix(keys)
+        stream = request.get("stream")
+        try:
+            # 流式响应的生成时间在逐字符发送时体现
+            time.sleep(server.sample_latency() + (0 if stream else server.generation_time(content)))
+        finally:
+            server.leave()
+        server.store_prefix(keys)
+
+        usage = {
+            "prompt_tokens": len(text),
+            "completion_tokens": len(content),
+            "total_tokens": len(text) + len(content),
+            "prompt_tokens_details": {"cached_tokens": cached}
+        }
+        if stream:
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._send_stream(request.get("model", "mock"), content, usage if include_usage else None)
+            return
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    def _send_stream(self, model: str, content: str, usage: dict = None):
+        """SSE 流式响应，每个字符一个 chunk；不定长响应体，发送完毕后关闭连接"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def event(choices: list, extra: dict = None):
+            payload = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": model, "choices": choices, **(extra or {})}
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+        delay = self.server.generation_time(content) / max(len(content), 1)
+        for char in content:
+            if delay:
+                time.sleep(delay)
+            event([{"index": 0, "delta": {"content": char}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if usage is not None:
+            event([], {"usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """每个连接一个线程的 Mock 服务，可在后台线程中启动供压测脚本使用"""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2,
+                 jitter: float = 0.0, max_in_flight: int = 0, retry_after: int = 1,
+                 distribution: str = "uniform", error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 output_tps: float = 0.0, tpm: int = 0, response_chars: int = 0):
+        super().__init__((host, port), MockHandler)
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"未知的延迟分布: {distribution}")
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.max_in_flight = max_in_flight
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.output_tps = output_tps
+        self.tpm = tpm
+        self.response_chars = response_chars
+        self.in_flight = 0
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "peak_in_flight": 0, "cached_tokens": 0}
+        self._lock = threading.Lock()
+        self._prefixes = set()
+        self._tokens = deque()
+        self._tokens_total = 0
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def sample_latency(self) -> float:
+        if self.distribution == "normal":
+            value = random.gauss(self.latency, self.jitter)
+        elif self.distribution == "lognormal":
+            value = self.latency * math.exp(random.gauss(0.0, self.jitter))
+        elif self.distribution == "exponential":
+            value = random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+        else:
+            value = self.latency + random.uniform(-self.jitter, self.jitter)
+        return max(0.0, value)
+
+    def generation_time(self, content: str) -> float:
+        """按 output_tps 生成 content 所需的时间（token 数按字符数计）"""
+        return len(content) / self.output_tps if self.output_tps > 0 else 0.0
+
+    def make_content(self, prompt: str) -> str:
+        content = f"mock response: {prompt[:50]}"
+        if self.response_chars > len(content):
+            content = (content * (self.response_chars // len(content) + 1))[:self.response_chars]
+        return content
+
+    def inject_fault(self):
+        """按概率注入故障，返回要返回的状态码（429 或 5xx），不注入时返回 None"""
+        roll = random.random()
+        with self._lock:
+            if roll < self.error_rate:
+                self.stats["requests"] += 1
+                self.stats["errors"] += 1
+                return random.choice(ERROR_STATUSES)
+            if roll < self.error_rate + self.throttle_rate:
+                self.stats["requests"] += 1
+                self.stats["throttled"] += 1
+                return 429
+        return None
+
+    def reserve_tokens(self, tokens: int) -> bool:
+        """每分钟 token 数限制（滑动窗口），超出时计入 throttled 并返回 False"""
+        if not self.tpm:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._tokens and self._tokens[0][0] <= now - 60:
+                self._tokens_total -= self._tokens.popleft()[1]
+            if self._tokens_total + tokens > self.tpm:
+                self.stats["requests"] += 1
+                self.stats["throttled"] += 1
+                return False
+            self._tokens.append((now, tokens))
+            self._tokens_total += tokens
+            return True
+
+    def enter(self) -> bool:
+        with self._lock:
+            self.stats["requests"] += 1
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.stats["throttled"] += 1
+                return False
+            self.in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+            return True
+
+    @staticmethod
+    def prefix_keys(text: str) -> list[bytes]:
+        """每个完整前缀块的累计哈希"""
+        keys = []
+        digest = hashlib.sha256()
+        for end in range(PREFIX_BLOCK, len(text) + 1, PREFIX_BLOCK):
+            digest.update(text[end - PREFIX_BLOCK:end].encode("utf-8"))
+            keys.append(digest.copy().digest())
+        return keys
+
+    def lookup_prefix(self, keys: list[bytes]) -> int:
+        """请求开始时查询命中的前缀长度"""
+        hits = 0
+        with self._lock:
+            for key in keys:
+                if key not in self._prefixes:
+                    break
+                hits += 1
+            self.stats["cached_tokens"] += hits * PREFIX_BLOCK
+        return hits * PREFIX_BLOCK
+
+    def store_prefix(self, keys: list[bytes]):
+        """请求完成后写入前缀块，与 provider 一样，并发中的同前缀请求在此之前都不会命中"""
+        with self._lock:
+            if len(self._prefixes) > PREFIX_CACHE_LIMIT:
+                self._prefixes.clear()
+            self._prefixes.update(keys)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def start(self) -> "MockLLMServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 Mock 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="每个请求的平均延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟的均匀抖动幅度（秒）")
+    parser.add_argument("--max-in-flight", type=int, default=0, help="在途请求上限，超出返回 429（0 表示不限）")
+    parser.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default="uniform", help="延迟分布")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入 5xx 的概率")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="注入 429 的概率")
+    parser.add_argument("--output-tps", type=float, default=0.0, help="生成速度（token/秒，0 表示不限）")
+    parser.add_argument("--tpm", type=int, default=0, help="每分钟 token 上限，超出返回 429（0 表示不限）")
+    parser.add_argument("--response-chars", type=int, default=0, help="响应长度（字符），缺省为回显 prompt 开头")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.latency, args.jitter, args.max_in_flight,
+                           distribution=args.distribution, error_rate=args.error_rate,
+                           throttle_rate=args.throttle_rate, output_tps=args.output_tps, tpm=args.tpm,
+                           response_chars=args.response_chars)
+    print(f"🧪 Mock 服务已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,152 +5,106 @@ Prompt 批量评估工具
 1. 导入评估集（Excel）
 2. 自动识别 prompt 中的 {{占位符}}，映射到评估集字段
 3. 批量拼接 prompt 并调用模型 API
-4. 输出结果到 Excel
+4. 输出结果到 Excel / Parquet / JSONL
+5. 可选：按模块 evaluation.md 中的 LLM Judge 为每条结果评分（与生成并行）
 
 使用方法：
     streamlit run prompt_evaluator.py
 
+命令行（无需 streamlit / pandas）：
+    python -m prompt_evaluator run --template t.md --dataset d.csv --mapping m.json --model KEY
+    python -m prompt_evaluator run ... --judge Strategy_Library/01_Modules/.../evaluation.md --judge-model KEY
+    python -m prompt_evaluator pipeline --spec pipeline.json --dataset d.csv
+    python -m prompt_evaluator export RUN_ID --format parquet
+
+实现位于 evaluator/ 包（配置、模板渲染、引擎、缓存与运行日志、Batch API、评分、流水线、
+数据集读取、导出、命令行），本文件只有 Streamlit 页面和入口。
+
 依赖安装：
     pip install streamlit pandas openpyxl openai
+    pip install h2          # 可选：endpoint 支持时使用 HTTP/2
 """
 
-import streamlit as st
-import pandas as pd
-import re
-import json
-import time
-import os
+from __future__ import annotations
+
+import sys
 from datetime import datetime
-from io import BytesIO
 from pathlib import Path
-from openai import OpenAI
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-
-# ============== 配置管理 ==============
-
-CONFIG_FILE = Path(__file__).parent / "model_configs.json"
-
-def load_model_configs() -> dict:
-    """加载模型配置"""
-    if CONFIG_FILE.exists():
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"models": {}, "default": None}
-
-def save_model_configs(configs: dict):
-    """保存模型配置"""
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(configs, f, ensure_ascii=False, indent=2)
-
-def get_model_list() -> list[str]:
-    """获取所有模型名称列表"""
-    configs = load_model_configs()
-    return list(configs.get("models", {}).keys())
 
-def get_model_config(model_key: str) -> dict:
-    """获取指定模型的配置"""
-    configs = load_model_configs()
-    return configs.get("models", {}).get(model_key, {})
+from evaluator.batch import BATCH_BACKENDS, BatchLedger, evaluate_batch_to_journal
+from evaluator.cli import cli
+from evaluator.clients import (ClientRegistry, connection_report, connection_snapshot, format_connection_report,
+                               use_client_registry)
+from evaluator.config import (add_model_config, delete_model_config, describe_targets, get_model_config,
+                              get_model_list, load_model_configs, resolve_targets)
+from evaluator.dataset import DATASET_TYPES, DatasetReader, save_upload
+from evaluator.engine import LATENCY_METRICS, PROMPT_CACHE_MODES, StreamMonitor, latency_percentiles
+from evaluator.export import EXPORT_FORMATS, export_results, iter_result_frames, result_columns
+from evaluator.judge import JudgePipeline, discover_rubrics, load_rubric, summarize_judgments
+from evaluator.storage import ResponseCache, RunJournal, evaluate_to_journal, response_hash
+from evaluator.templates import (JSON_ROOT_KEY, extract_placeholders, placeholder_roots, render_columns, render_row,
+                                 required_columns)
+from evaluator.tokens import DEFAULT_CONTEXT_WINDOW, DEFAULT_TOKENIZER, precheck_tokens, skipped_results
+from prompt_store import PromptLibrary
 
-def add_model_config(name: str, api_base: str, api_key: str, model_name: str, description: str = ""):
-    """添加新的模型配置"""
-    configs = load_model_configs()
-    configs["models"][name] = {
-        "api_base": api_base,
-        "api_key": api_key,
-        "model_name": model_name,
-        "description": description
-    }
-    if not configs.get("default"):
-        configs["default"] = name
-    save_model_configs(configs)
 
-def delete_model_config(name: str):
-    """删除模型配置"""
-    configs = load_model_configs()
-    if name in configs.get("models", {}):
-        del configs["models"][name]
-        if configs.get("default") == name:
-            configs["default"] = list(configs["models"].keys())[0] if configs["models"] else None
-        save_model_configs(configs)
-
-
-# ============== 工具函数 ==============
-
-def extract_placeholders(prompt_template: str) -> list[str]:
-    """从 prompt 模板中提取所有 {{xxx}} 占位符"""
-    pattern = r'\{\{([^}]+)\}\}'
-    matches = re.findall(pattern, prompt_template)
-    # 去重并保持顺序
-    seen = set()
-    unique = []
-    for m in matches:
-        if m not in seen:
-            seen.add(m)
-            unique.append(m)
-    return unique
-
-
-def fill_prompt(template: str, mapping: dict, row: pd.Series) -> str:
-    """根据映射关系，用评估集数据填充 prompt 模板"""
-    filled = template
-    for placeholder, excel_field in mapping.items():
-        if excel_field and excel_field in row.index:
-            value = str(row[excel_field]) if pd.notna(row[excel_field]) else ""
-            filled = filled.replace(f"{{{{{placeholder}}}}}", value)
-    return filled
+# ============== Streamlit UI ==============
 
+# 页面各引擎的默认并发（旧运行的 meta 没有记录 concurrency 时续跑也用它）
+UI_DEFAULT_CONCURRENCY = {"thread": 3, "async": 128}
 
-def call_llm(client: OpenAI, model: str, prompt: str, system_prompt: str = None, 
-             temperature: float = 0.7, max_tokens: int = 2000) -> tuple[str, float]:
-    """调用 LLM API，返回 (响应内容, 耗时秒数)"""
-    messages = []
-    if system_prompt:
-        messages.append({"role": "system", "content": system_prompt})
-    messages.append({"role": "user", "content": prompt})
+def main():
+    import streamlit as st
+    import pandas as pd
     
-    start_time = time.time()
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        elapsed = time.time() - start_time
-        return response.choices[0].message.content, elapsed
-    except Exception as e:
-        elapsed = time.time() - start_time
-        return f"[ERROR] {str(e)}", elapsed
-
-
-def batch_evaluate(prompts: list[str], client: OpenAI, model: str, 
-                   system_prompt: str, temperature: float, max_tokens: int,
-                   max_workers: int = 3, progress_callback=None) -> list[dict]:
-    """批量调用 LLM，返回结果列表"""
-    results = [None] * len(prompts)
+    @st.cache_data(max_entries=4)
+    def load_result_frame(run_id: str, stamp: tuple, dataset_path: str = None) -> pd.DataFrame:
+        """结果宽表按 (run_id, journal 状态, 评估集) 缓存，页面交互时不重复构建"""
+        journal = RunJournal(run_id)
+        meta = journal.read_meta()
+        model_keys = list(meta["models"])
+        dimensions = (meta.get("judge") or {}).get("dimensions", [])
+        dataset = DatasetReader(dataset_path) if dataset_path else None
+        frames = list(iter_result_frames(journal.load_results(), model_keys, dataset,
+                                         judgments=journal.load_judgments(), dimensions=dimensions))
+        if not frames:
+            return pd.DataFrame(columns=result_columns(model_keys, [], dimensions))
+        return pd.concat(frames, ignore_index=True)
     
-    def process_one(idx: int, prompt: str):
-        response, elapsed = call_llm(client, model, prompt, system_prompt, temperature, max_tokens)
-        return idx, response, elapsed
+    @st.cache_resource
+    def get_response_cache() -> ResponseCache:
+        """跨 rerun 复用同一个缓存连接"""
+        return ResponseCache()
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_one, i, p): i for i, p in enumerate(prompts)}
-        completed = 0
-        for future in as_completed(futures):
-            idx, response, elapsed = future.result()
-            results[idx] = {"response": response, "time": elapsed}
-            completed += 1
-            if progress_callback:
-                progress_callback(completed / len(prompts))
+    @st.cache_resource
+    def get_client_registry() -> ClientRegistry:
+        """HTTP 客户端与连接池跨 rerun、跨运行复用"""
+        return ClientRegistry()
+    
+    use_client_registry(get_client_registry())
+    
+    @st.cache_data(max_entries=8, show_spinner="正在统计 token...")
+    def cached_precheck(dataset_path: str, template: str, mapping: dict, system_prompt: str,
+                        start: int, end: int, targets: dict, max_tokens: int) -> dict:
+        """token 预检按 (评估集, 模板, 映射, 范围, 模型配置, max_tokens) 缓存"""
+        return precheck_tokens(template, mapping, DatasetReader(dataset_path), range(start, end + 1),
+                               system_prompt, targets, max_tokens)
+    
+    @st.cache_resource
+    def get_prompt_library() -> PromptLibrary:
+        """预编译的策略库，跨 rerun 共享；源文件变化时在 refresh 中增量重编译"""
+        return PromptLibrary()
+    
+    def load_library_prompt():
+        """从策略库选择模块后填入 System / User 模板"""
+        key = st.session_state.library_prompt
+        module = get_prompt_library().get(key) if key else None
+        if module is None:
+            return
+        st.session_state.system_prompt = module["system"]
+        st.session_state.prompt_template = module["user"]
+        st.session_state.library_module = module
     
-    return results
-
-
-# ============== Streamlit UI ==============
-
-def main():
     st.set_page_config(
         page_title="Prompt 批量评估工具",
         page_icon="🧪",
@@ -161,10 +115,8 @@ def main():
     st.caption("导入评估集 → 映射字段 → 批量推理 → 导出结果")
     
     # 初始化 session state
-    if "prompts_generated" not in st.session_state:
-        st.session_state.prompts_generated = []
-    if "results" not in st.session_state:
-        st.session_state.results = []
+    if "run_id" not in st.session_state:
+        st.session_state.run_id = None
     
     # ===== 侧边栏：API 配置 =====
     with st.sidebar:
@@ -197,13 +149,33 @@ def main():
             with st.expander("📋 当前模型配置", expanded=False):
                 st.text(f"API Base: {api_base}")
                 st.text(f"模型: {model_name}")
+                st.text(f"限流: RPM {model_config.get('rpm') or '不限'} / TPM {model_config.get('tpm') or '不限'}")
+                st.text(f"并发上限: {model_config.get('max_concurrency') or '跟随运行设置'}  ·  "
+                        f"请求超时: {str(model_config['timeout']) + 's' if model_config.get('timeout') else '默认'}")
+                st.text(f"上下文窗口: {model_config.get('context_window') or DEFAULT_CONTEXT_WINDOW}"
+                        f"{'' if model_config.get('context_window') else ' (默认)'}")
+                st.text(f"分词器: {model_config.get('tokenizer') or DEFAULT_TOKENIZER}")
+                st.text(f"前缀缓存: {PROMPT_CACHE_MODES.get(model_config.get('prompt_cache') or 'auto')}")
+                st.text(f"Batch 后端: {BATCH_BACKENDS.get(model_config.get('batch') or 'openai')}")
+                if model_config.get("price_input") is not None or model_config.get("price_output") is not None:
+                    st.text(f"单价 (每百万 token): 输入 {model_config.get('price_input') or 0} / "
+                            f"输出 {model_config.get('price_output') or 0}")
                 if model_config.get("description"):
                     st.caption(model_config["description"])
+            
+            # 多模型对比：prompt 只渲染一次，同时发给所有模型
+            compare_keys = st.multiselect(
+                "同时对比的模型 (可选)",
+                [key for key in model_list if key != selected_model_key],
+                help="所有模型同时调用，并发数按模型计；同一 API Base 共享限流与并发名额"
+            )
+            model_keys = [selected_model_key] + compare_keys
         else:
             st.warning("暂无模型配置，请添加")
             api_base = ""
             api_key = ""
             model_name = ""
+            model_keys = []
         
         st.divider()
         
@@ -214,10 +186,41 @@ def main():
             new_api_key = st.text_input("API Key", type="password", placeholder="sk-xxx")
             new_model_name = st.text_input("模型名称", placeholder="gpt-4o")
             new_description = st.text_input("备注 (可选)", placeholder="用途描述")
+            rpm_col, tpm_col = st.columns(2)
+            with rpm_col:
+                new_rpm = st.number_input("RPM 上限", 0, 1000000, 0, help="每分钟请求数，0 表示不限")
+            with tpm_col:
+                new_tpm = st.number_input("TPM 上限", 0, 100000000, 0, help="每分钟 token 数，0 表示不限")
+            concurrency_col, timeout_col = st.columns(2)
+            with concurrency_col:
+                new_max_concurrency = st.number_input("并发上限", 0, 1024, 0,
+                                                      help="该模型的最大并发，低于运行设置的并发时生效，0 表示不限")
+            with timeout_col:
+                new_timeout = st.number_input("请求超时 (秒)", 0, 3600, 0, help="单次请求的超时，0 表示使用 SDK 默认值")
+            new_context = st.number_input("上下文窗口 (token)", 0, 10000000, 0,
+                                          help=f"用于调用前的超长检查，0 表示使用默认值 {DEFAULT_CONTEXT_WINDOW}")
+            price_in_col, price_out_col = st.columns(2)
+            with price_in_col:
+                new_price_input = st.number_input("输入单价", 0.0, 10000.0, 0.0, help="每百万输入 token 的价格，用于费用预估")
+            with price_out_col:
+                new_price_output = st.number_input("输出单价", 0.0, 10000.0, 0.0, help="每百万输出 token 的价格")
+            new_tokenizer = st.text_input("分词器", placeholder=DEFAULT_TOKENIZER,
+                                          help="tiktoken:<encoding>、hf:<本地 tokenizer.json 路径> 或 approx（离线近似）")
+            new_prompt_cache = st.selectbox("前缀缓存", list(PROMPT_CACHE_MODES),
+                                            format_func=PROMPT_CACHE_MODES.get,
+                                            help="同一批 prompt 的公共前缀（System Prompt、人设等）按 provider 的方式复用缓存")
+            new_batch = st.selectbox("Batch 后端", list(BATCH_BACKENDS), format_func=BATCH_BACKENDS.get,
+                                     help="执行引擎选择 Batch API 时使用")
             
             if st.button("💾 保存配置", use_container_width=True):
                 if new_name and new_api_base and new_api_key and new_model_name:
-                    add_model_config(new_name, new_api_base, new_api_key, new_model_name, new_description)
+                    add_model_config(new_name, new_api_base, new_api_key, new_model_name, new_description,
+                                     rpm=int(new_rpm), tpm=int(new_tpm), context_window=int(new_context),
+                                     max_concurrency=int(new_max_concurrency), timeout=int(new_timeout),
+                                     price_input=new_price_input, price_output=new_price_output,
+                                     tokenizer=new_tokenizer.strip(),
+                                     prompt_cache=None if new_prompt_cache == "auto" else new_prompt_cache,
+                                     batch=None if new_batch == "openai" else new_batch)
                     st.success(f"✅ 已添加 {new_name}")
                     st.rerun()
                 else:
@@ -236,13 +239,60 @@ def main():
         st.subheader("推理参数")
         temperature = st.slider("Temperature", 0.0, 2.0, 0.7, 0.1)
         max_tokens = st.number_input("Max Tokens", 100, 8000, 2000, 100)
-        max_workers = st.slider("并发数", 1, 10, 3, help="同时调用 API 的线程数")
+        engine = st.radio(
+            "执行引擎",
+            ["thread", "async", "batch"],
+            format_func=lambda x: {"thread": "线程池", "async": "异步 (自适应并发)", "batch": "Batch API"}[x],
+            horizontal=True,
+            help="Batch API 适合不需要即时结果的大评估集：提交后由服务端离线处理，通常半价且不受 RPM / TPM 限制"
+        )
+        stream = False
+        if engine != "batch":
+            stream = st.toggle("流式输出", value=False,
+                               help="使用流式接口，记录每行的首 token 延迟和生成速度，运行时实时显示生成中的内容")
+        if engine == "batch":
+            max_workers = None
+            st.caption("提交后可离开页面，之后挂载该运行并刷新批次状态取回结果")
+        elif engine == "async":
+            max_workers = st.slider("最大并发", 8, 512, UI_DEFAULT_CONCURRENCY["async"], 8,
+                                    help="异步引擎的并发上限，实际并发根据 429 和响应延迟自动调整")
+        else:
+            max_workers = st.slider("并发数", 1, 10, UI_DEFAULT_CONCURRENCY["thread"], help="同时调用 API 的线程数")
+        
+        st.divider()
+        st.subheader("响应缓存")
+        use_cache = st.toggle("使用响应缓存", value=True,
+                              help="模型、参数和拼接后的 prompt 都相同时直接复用上次的响应；关闭则全部重新调用")
+        response_cache = get_response_cache()
+        cache_stats = response_cache.stats()
+        st.caption(f"已缓存 {cache_stats['entries']} 条，{cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+        if st.button("清空缓存", use_container_width=True):
+            response_cache.clear()
+            st.rerun()
     
     # ===== 主界面 =====
     tab1, tab2, tab3 = st.tabs(["📝 Step 1: 配置 Prompt", "🔗 Step 2: 映射字段", "🚀 Step 3: 批量评估"])
     
     # ----- Tab 1: Prompt 配置 -----
     with tab1:
+        prompt_library = get_prompt_library()
+        prompt_library.refresh()
+        lib_col, refresh_col = st.columns([4, 1])
+        with lib_col:
+            st.selectbox(
+                "从策略库加载",
+                [None, *prompt_library.modules],
+                format_func=lambda key: "（手动输入）" if key is None else f"{key} · {prompt_library.modules[key]['title']}",
+                key="library_prompt",
+                on_change=load_library_prompt,
+                help="模板来自 prompt_store.py 编译的 Strategy_Library，全局模块已展开"
+            )
+        with refresh_col:
+            st.write("")
+            if st.button("🔄 重新编译", use_container_width=True, help="忽略增量记录，重新编译整个策略库"):
+                prompt_library.refresh(force=True)
+                st.rerun()
+        
         col1, col2 = st.columns([1, 1])
         
         with col1:
@@ -264,35 +314,42 @@ def main():
             )
         
         # 识别占位符
+        module = st.session_state.get("library_module")
+        if module is not None and module["user"] != prompt_template:
+            module = None
         if prompt_template:
-            placeholders = extract_placeholders(prompt_template)
+            # 模板未经修改时直接使用编译时提取好的占位符
+            placeholders = list(module["placeholders"]) if module else extract_placeholders(prompt_template)
             if placeholders:
                 st.success(f"✅ 识别到 {len(placeholders)} 个占位符：`{'`, `'.join(placeholders)}`")
             else:
                 st.warning("⚠️ 未识别到 {{}} 格式的占位符")
+        if module and module["system_placeholders"] and system_prompt == module["system"]:
+            st.caption(f"ℹ️ System Prompt 中的 `{'`, `'.join(module['system_placeholders'])}` 不参与字段映射，"
+                       "评估时按原文发送")
     
     # ----- Tab 2: 字段映射 -----
     with tab2:
         st.subheader("上传评估集")
         uploaded_file = st.file_uploader(
             "选择评估集文件",
-            type=["xlsx", "xls", "csv"],
-            help="支持 Excel (.xlsx/.xls) 和 CSV (.csv) 格式"
+            type=DATASET_TYPES,
+            help="支持 CSV、JSONL、Parquet、Excel (.xlsx/.xls) 和 JSON 格式；大文件建议使用 Parquet 或 JSONL"
         )
         
         if uploaded_file:
             try:
-                # 根据文件类型选择读取方式
-                file_name = uploaded_file.name.lower()
-                if file_name.endswith('.csv'):
-                    df = pd.read_csv(uploaded_file)
-                else:
-                    df = pd.read_excel(uploaded_file)
-                st.success(f"✅ 成功加载 {len(df)} 条数据")
+                # 落盘后按需流式读取，不把整个文件解析成 DataFrame
+                if st.session_state.get("dataset_file_id") != uploaded_file.file_id:
+                    path = save_upload(uploaded_file.name, uploaded_file, uploaded_file.file_id)
+                    st.session_state.dataset = DatasetReader(path)
+                    st.session_state.dataset_file_id = uploaded_file.file_id
+                dataset = st.session_state.dataset
+                st.success(f"✅ 成功加载 {len(dataset)} 条数据")
                 
                 # 预览数据
                 with st.expander("📊 预览评估集数据", expanded=True):
-                    st.dataframe(df.head(10), use_container_width=True)
+                    st.dataframe(pd.DataFrame(dataset.head(10)), use_container_width=True)
                 
                 # 字段映射
                 prompt_template = st.session_state.get("prompt_template", "")
@@ -302,29 +359,53 @@ def main():
                     st.subheader("🔗 字段映射")
                     st.caption("将 Prompt 中的占位符映射到评估集的字段")
                     
-                    excel_columns = ["(不映射)"] + list(df.columns)
+                    excel_columns = ["(不映射)"] + list(dataset.columns)
                     mapping = {}
                     
-                    cols = st.columns(min(len(placeholders), 3))
-                    for i, placeholder in enumerate(placeholders):
-                        with cols[i % 3]:
-                            selected = st.selectbox(
-                                f"`{{{{{placeholder}}}}}`",
-                                excel_columns,
-                                key=f"map_{placeholder}"
-                            )
-                            if selected != "(不映射)":
-                                mapping[placeholder] = selected
+                    def mapping_selectors(names: list[str]):
+                        cols = st.columns(min(len(names), 3))
+                        for i, placeholder in enumerate(names):
+                            with cols[i % 3]:
+                                selected = st.selectbox(
+                                    f"`{{{{{placeholder}}}}}`",
+                                    excel_columns,
+                                    key=f"map_{placeholder}"
+                                )
+                                if selected != "(不映射)":
+                                    mapping[placeholder] = selected
+                    
+                    # 带路径的占位符（如 user_info.user_name）可以直接从 JSON 字段取值
+                    roots = placeholder_roots(placeholders)
+                    nested = [p for names in roots.values() for p in names]
+                    flat = [p for p in placeholders if p not in nested]
+                    if roots:
+                        st.caption("带路径的占位符可映射到 JSON 字段，按路径自动取值，无需预先拆成多列")
+                        selected = st.selectbox(
+                            "整行 JSON 字段 (可选)",
+                            excel_columns,
+                            key="map_json_root",
+                            help="字段内容为包含 user_info、crush_info 等键的 JSON，未单独映射的占位符按完整路径取值"
+                        )
+                        if selected != "(不映射)":
+                            mapping[JSON_ROOT_KEY] = selected
+                        mapping_selectors([f"{root}.*" for root in roots])
+                        for root in roots:
+                            if f"{root}.*" in mapping:
+                                mapping[root] = mapping.pop(f"{root}.*")
+                    if flat:
+                        mapping_selectors(flat)
+                    if nested:
+                        with st.expander("单独映射路径占位符"):
+                            mapping_selectors(nested)
                     
                     # 保存映射到 session
                     st.session_state.mapping = mapping
-                    st.session_state.df = df
                     
                     # 预览拼接后的 prompt
-                    if mapping and len(df) > 0:
+                    if mapping and len(dataset) > 0:
                         st.subheader("👀 预览拼接效果")
-                        preview_idx = st.slider("选择预览行", 0, len(df)-1, 0)
-                        preview_prompt = fill_prompt(prompt_template, mapping, df.iloc[preview_idx])
+                        preview_idx = st.slider("选择预览行", 0, len(dataset)-1, 0)
+                        preview_prompt = render_row(prompt_template, mapping, dataset, preview_idx)
                         st.text_area("拼接后的 Prompt", preview_prompt, height=200, disabled=True)
                 else:
                     st.warning("⚠️ 请先在 Step 1 中设置包含 {{}} 占位符的 Prompt 模板")
@@ -344,110 +425,315 @@ def main():
         if not st.session_state.get("prompt_template"):
             st.warning("⚠️ 请在 Step 1 配置 Prompt 模板")
             ready = False
-        if "df" not in st.session_state:
+        if "dataset" not in st.session_state:
             st.warning("⚠️ 请在 Step 2 上传评估集")
             ready = False
         
         if ready:
-            df = st.session_state.df
+            dataset = st.session_state.dataset
             mapping = st.session_state.get("mapping", {})
             prompt_template = st.session_state.prompt_template
             system_prompt = st.session_state.get("system_prompt", "")
             
-            st.info(f"📊 评估集共 {len(df)} 条数据，已映射 {len(mapping)} 个字段")
-            st.success(f"🤖 当前模型: **{model_name}** ({api_base})")
+            st.info(f"📊 评估集共 {len(dataset)} 条数据，已映射 {len(mapping)} 个字段")
+            if len(model_keys) > 1:
+                st.success(f"🤖 对比模型: **{'**, **'.join(model_keys)}**")
+            else:
+                st.success(f"🤖 当前模型: **{model_name}** ({api_base})")
             
             # 选择评估范围
             col1, col2 = st.columns(2)
             with col1:
-                start_idx = st.number_input("起始行", 0, len(df)-1, 0)
+                start_idx = st.number_input("起始行", 0, len(dataset)-1, 0)
             with col2:
-                end_idx = st.number_input("结束行", start_idx, len(df)-1, min(start_idx + 9, len(df)-1))
+                end_idx = st.number_input("结束行", start_idx, len(dataset)-1, min(start_idx + 9, len(dataset)-1))
             
             eval_count = end_idx - start_idx + 1
             st.caption(f"将评估第 {start_idx} 到 {end_idx} 行，共 {eval_count} 条")
             
-            # 开始评估按钮
-            if st.button("🚀 开始批量评估", type="primary", use_container_width=True):
-                # 生成所有 prompt
-                prompts = []
-                for i in range(start_idx, end_idx + 1):
-                    filled = fill_prompt(prompt_template, mapping, df.iloc[i])
-                    prompts.append(filled)
-                
-                st.session_state.prompts_generated = prompts
-                
-                # 调用 API
-                client = OpenAI(base_url=api_base, api_key=api_key)
-                
+            # 调用前的 token 预检：超出上下文窗口的行不会调用 API
+            report = cached_precheck(str(dataset.path), prompt_template, mapping, system_prompt,
+                                     int(start_idx), int(end_idx), resolve_targets(model_keys), max_tokens)
+            with st.expander("🧮 Token 预检", expanded=any(item["over_budget"] for item in report["models"].values())):
+                for key, item in report["models"].items():
+                    if len(report["models"]) > 1:
+                        st.markdown(f"**{key}**")
+                    metric_cols = st.columns(4)
+                    metric_cols[0].metric("输入 tokens", f"{item['input_tokens']:,}")
+                    metric_cols[1].metric("单条最多", f"{item['max_input']:,}",
+                                          help=f"上下文窗口 {item['context_window']:,}，需为 max_tokens 预留 {max_tokens:,}")
+                    metric_cols[2].metric("输出上限", f"{item['output_tokens']:,}", help="按 max_tokens 估算的上限")
+                    metric_cols[3].metric("预估费用", f"{item['cost']:.4f}" if item["cost"] is not None else "-",
+                                          help="按模型配置中的每百万 token 单价计算，未扣除缓存命中")
+                    if item["tokenizer_fallback"]:
+                        st.caption(f"⚠️ 分词器 {item['tokenizer_fallback']}，使用近似计数")
+                    else:
+                        st.caption(f"分词器: {item['tokenizer']}")
+                    if item["over_budget"]:
+                        rows_text = ", ".join(map(str, list(item["over_budget"])[:20]))
+                        st.warning(f"⚠️ {len(item['over_budget'])} 行超出上下文窗口，将跳过不调用 API："
+                                   f"{rows_text}{' ...' if len(item['over_budget']) > 20 else ''}")
+            
+            # LLM 评分：每条结果写入后立即提交评分，与其余行的生成并行
+            rubrics = discover_rubrics()
+            judge_meta = None
+            with st.expander("⚖️ LLM 评分"):
+                judge_enabled = st.checkbox("生成的同时按模块 evaluation.md 中的 LLM Judge 评分", disabled=not rubrics,
+                                            help="评分结果按响应缓存，响应没有变化的行不会重复评分")
+                if judge_enabled:
+                    # 从策略库加载的模块默认使用同目录下的评分标准
+                    module = st.session_state.get("library_module")
+                    module_dir = Path(module["path"]).parent.name if module else None
+                    rubric_keys = list(rubrics)
+                    default_rubric = next((i for i, key in enumerate(rubric_keys)
+                                           if Path(key).name == module_dir), 0)
+                    judge_col1, judge_col2, judge_col3 = st.columns([2, 2, 1])
+                    with judge_col1:
+                        rubric_key = st.selectbox("评分标准", rubric_keys, index=default_rubric)
+                    with judge_col2:
+                        judge_model = st.selectbox("评分模型", model_list)
+                    with judge_col3:
+                        judge_workers = st.number_input("评分并发", 1, 64, 8)
+                    try:
+                        rubric = load_rubric(rubrics[rubric_key])
+                        judge_meta = {**rubric, "model": judge_model}
+                        st.caption("维度权重: " + "，".join(f"{dim} {weight:g}"
+                                                         for dim, weight in rubric["weights"].items()))
+                    except (OSError, ValueError) as e:
+                        st.error(f"❌ {e}")
+            
+            def run_journal(journal: RunJournal):
+                meta = journal.read_meta()
+                if meta.get("dataset_rows") != len(dataset):
+                    st.warning(f"⚠️ 当前评估集有 {len(dataset)} 行，与该运行创建时的 {meta.get('dataset_rows')} 行不一致")
+                try:
+                    targets = resolve_targets(list(meta["models"]))
+                except ValueError as e:
+                    st.error(f"❌ {e}")
+                    return
+                columns = required_columns(meta["template"], meta["mapping"], dataset.columns)
+                report = cached_precheck(str(dataset.path), meta["template"], meta["mapping"],
+                                         meta["system_prompt"], meta["start_idx"], meta["end_idx"],
+                                         targets, meta["max_tokens"])
+                render_chunk = lambda idx: render_columns(meta["template"], meta["mapping"],
+                                                          dataset.fetch(idx, columns), len(idx))
+                rows = range(meta["start_idx"], meta["end_idx"] + 1)
+                judge = None
+                if meta.get("judge"):
+                    try:
+                        judge_config = resolve_targets([meta["judge"]["model"]])[meta["judge"]["model"]]
+                    except ValueError as e:
+                        st.error(f"❌ 评分模型: {e}")
+                        return
+                    judge = JudgePipeline(journal, meta["judge"], judge_config,
+                                          int(judge_workers) if judge_enabled else 8,
+                                          response_cache if use_cache else None)
+                    judge.backfill(rows, render_chunk)
+                if meta.get("engine") == "batch":
+                    with st.spinner("正在提交 / 查询批次..."):
+                        try:
+                            status = evaluate_batch_to_journal(
+                                journal, rows, render_chunk,
+                                targets, meta["system_prompt"] or None, meta["temperature"], meta["max_tokens"],
+                                cache=response_cache if use_cache else None,
+                                skip=skipped_results(report, meta["max_tokens"]), wait=False, judge=judge
+                            )
+                        except ValueError as e:
+                            st.error(f"❌ {e}")
+                            return
+                        finally:
+                            if judge is not None:
+                                judge.close()
+                    if status["batches"]:
+                        st.dataframe(pd.DataFrame(status["batches"]), use_container_width=True, hide_index=True)
+                    st.success(f"📨 新提交 {status['submitted']} 个批次，本次取回 {status['collected']} 条结果，"
+                               f"仍在处理的批次 {status['pending']} 个")
+                    return
                 progress_bar = st.progress(0, text="正在评估...")
+                monitor = StreamMonitor() if meta.get("stream") else None
+                tail_box = st.empty()
+                # 引擎和并发取自运行创建时的 meta，续跑 / 刷新时不受侧边栏当前选择影响
+                run_engine = meta.get("engine") or "thread"
+                run_workers = meta.get("concurrency") or UI_DEFAULT_CONCURRENCY.get(run_engine, 3)
                 
                 def update_progress(p):
                     progress_bar.progress(p, text=f"进度: {int(p*100)}%")
+                    if monitor is not None:
+                        # 正在生成的响应末尾（live tail）
+                        lines = [f"[{model}] {chars} 字 …{tail}".replace("\n", " ")
+                                 for model, chars, tail in monitor.snapshot()]
+                        tail_box.code("\n".join(lines) or "等待首 token...", language=None)
                 
+                connections = connection_snapshot()
                 with st.spinner("正在批量调用 API..."):
-                    results = batch_evaluate(
-                        prompts, client, model_name,
-                        system_prompt if system_prompt else None,
-                        temperature, max_tokens, max_workers,
-                        progress_callback=update_progress
-                    )
+                    try:
+                        finished = evaluate_to_journal(
+                            journal, rows, render_chunk,
+                            targets, meta["system_prompt"] or None,
+                            meta["temperature"], meta["max_tokens"], run_workers,
+                            engine=run_engine,
+                            cache=response_cache if use_cache else None,
+                            progress_callback=update_progress,
+                            skip=skipped_results(report, meta["max_tokens"]),
+                            monitor=monitor,
+                            judge=judge
+                        )
+                        if judge is not None:
+                            progress_bar.progress(1.0, text="正在等待评分完成...")
+                    finally:
+                        judge_stats = judge.close() if judge is not None else None
                 
-                st.session_state.results = results
+                tail_box.empty()
                 progress_bar.progress(1.0, text="✅ 完成!")
-                st.success(f"✅ 评估完成！共处理 {len(results)} 条")
+                st.success(f"✅ 评估完成！本次处理 {finished} 次调用")
+                for line in format_connection_report(connection_report(connections, connection_snapshot())):
+                    st.caption(f"🔌 {line}")
+                if judge_stats:
+                    st.caption(f"⚖️ 本次评分 {judge_stats['judged']} 条（缓存命中 {judge_stats['cache_hits']} 条），"
+                               f"评分失败 {judge_stats['failed']} 条")
+            
+            # 开始评估按钮
+            if st.button("🚀 开始批量评估", type="primary", use_container_width=True):
+                journal = RunJournal()
+                journal.write_meta({
+                    "created_at": datetime.now().isoformat(timespec="seconds"),
+                    "template": prompt_template,
+                    "mapping": mapping,
+                    "system_prompt": system_prompt,
+                    "models": describe_targets(resolve_targets(model_keys)),
+                    "temperature": temperature,
+                    "max_tokens": max_tokens,
+                    "start_idx": int(start_idx),
+                    "end_idx": int(end_idx),
+                    "stream": stream,
+                    "engine": engine,
+                    "concurrency": max_workers,
+                    "dataset_rows": len(dataset),
+                    **({"judge": judge_meta} if judge_meta else {})
+                })
+                st.session_state.run_id = journal.run_id
+                run_journal(journal)
+            
+            # 续跑未完成的运行
+            active_run = st.session_state.run_id
+            if active_run and RunJournal(active_run).exists():
+                journal = RunJournal(active_run)
+                meta = journal.read_meta()
+                done, retries = journal.done_indexes(), journal.retry_indexes()
+                run_rows = range(meta["start_idx"], meta["end_idx"] + 1)
+                remaining = sum(1 for key in meta["models"] for i in run_rows if i not in done.get(key, ()))
+                retrying = sum(1 for key in meta["models"] for i in run_rows if i in retries.get(key, ()))
+                pending_batches = meta.get("engine") == "batch" and BatchLedger(journal).pending()
+                if meta.get("engine") == "pipeline":
+                    if remaining > 0:
+                        st.caption(f"🔗 流水线运行（剩余 {remaining} 个阶段调用）请在命令行续跑："
+                                   f"`python -m prompt_evaluator pipeline --resume {active_run} --dataset <评估集>`")
+                elif pending_batches:
+                    if st.button(f"🔄 刷新批次状态（{len(pending_batches)} 个批次处理中）", use_container_width=True):
+                        run_journal(journal)
+                elif remaining > 0 and st.button(
+                        f"▶️ 续跑 {active_run}（剩余 {remaining} 条"
+                        f"{f'，其中 {retrying} 条临时失败重试' if retrying else ''}）",
+                        use_container_width=True):
+                    run_journal(journal)
+        
+        # 挂载已有运行
+        run_ids = RunJournal.list_runs()
+        if run_ids:
+            with st.expander("🔁 查看 / 续跑已有运行"):
+                attach_id = st.selectbox("Run ID", run_ids, key="attach_run_id")
+                if st.button("挂载该运行"):
+                    st.session_state.run_id = attach_id
+                    st.rerun()
         
         # 展示结果
-        if st.session_state.results:
+        results = []
+        if st.session_state.run_id and RunJournal(st.session_state.run_id).exists():
+            journal = RunJournal(st.session_state.run_id)
+            meta = journal.read_meta()
+            results = journal.load_results()
+            dataset = st.session_state.get("dataset")
+            
             st.subheader("📋 评估结果")
+            planned = (meta["end_idx"] - meta["start_idx"] + 1) * len(meta["models"])
+            st.info(f"🆔 Run ID: `{journal.run_id}`  ·  已完成 {len(results)} / {planned} 次调用  ·  "
+                    f"模型 {', '.join(meta['models'])}")
+        
+        if results:
+            # 构建结果 DataFrame（多模型时每个模型一组响应/耗时列，原始字段整块拼接）
+            result_df = load_result_frame(journal.run_id, journal.stamp(),
+                                          str(dataset.path) if dataset is not None else None)
             
-            results = st.session_state.results
-            df = st.session_state.df
-            start_idx = int(st.session_state.get("start_idx", 0))
+            # 展示结果表格
+            st.dataframe(result_df, use_container_width=True, height=400)
             
-            # 构建结果 DataFrame
-            result_data = []
-            for i, res in enumerate(results):
-                row_idx = start_idx + i
-                row_data = {
-                    "序号": row_idx,
-                    "模型响应": res["response"],
-                    "耗时(秒)": round(res["time"], 2)
-                }
-                # 添加原始数据字段
-                if row_idx < len(df):
-                    for col in df.columns:
-                        row_data[f"[原]{col}"] = df.iloc[row_idx][col]
-                result_data.append(row_data)
+            cache_hits = sum(1 for res in results if res.get("cached"))
+            if cache_hits or any("cached" in res for res in results):
+                st.caption(f"💾 缓存命中 {cache_hits} 条，未命中 {len(results) - cache_hits} 条")
+            transient = sum(1 for res in results if res.get("error") == "transient")
+            permanent = sum(1 for res in results if res.get("error") == "permanent")
+            skipped = sum(1 for res in results if res.get("error") == "overflow")
+            if skipped:
+                st.caption(f"⏭️ {skipped} 条超出上下文窗口，未调用 API")
+            usages = [res["usage"] for res in results if res.get("usage")]
+            prompt_tokens = sum(u["prompt_tokens"] for u in usages)
+            if prompt_tokens:
+                cached_tokens = sum(u["cached_tokens"] for u in usages)
+                st.caption(f"🧊 输入 {prompt_tokens:,} tokens，provider 前缀缓存命中 {cached_tokens:,} "
+                           f"({cached_tokens / prompt_tokens:.0%})，输出 {sum(u['completion_tokens'] for u in usages):,} tokens")
+            if transient or permanent:
+                st.warning(f"❌ 失败 {transient + permanent} 条：重试后仍失败的临时错误 {transient} 条"
+                           f"（限流 / 超时 / 5xx，可续跑重试），永久错误 {permanent} 条（鉴权 / 参数等）")
             
-            result_df = pd.DataFrame(result_data)
+            # 延迟分布
+            percentiles = latency_percentiles(results)
+            if percentiles:
+                st.markdown("**⏱️ 延迟分布（不含缓存命中与失败）**")
+                st.dataframe(pd.DataFrame([
+                    {"模型": key, "指标": LATENCY_METRICS[metric],
+                     **{f"p{q}": None if v is None else round(v, 3) for q, v in zip((50, 95, 99), values)}}
+                    for key, metrics in percentiles.items()
+                    for metric, values in metrics.items() if values[0] is not None
+                ]), use_container_width=True, hide_index=True)
             
-            # 展示结果表格
-            st.dataframe(result_df, use_container_width=True, height=400)
+            # 评分汇总
+            if meta.get("judge"):
+                judge_summary = summarize_judgments(journal)
+                st.markdown(f"**⚖️ LLM 评分（{meta['judge']['name']}，评分模型 {meta['judge']['model']}）**")
+                st.dataframe(pd.DataFrame([
+                    {"模型": key, "已评分": stats["judged"], "评分失败": stats["failed"],
+                     **{dim: round(stats["averages"][dim], 2) if dim in stats["averages"] else None
+                        for dim in meta["judge"]["dimensions"]},
+                     "加权分": round(stats["averages"]["weighted"], 2) if "weighted" in stats["averages"] else None}
+                    for key, stats in judge_summary.items()
+                ]), use_container_width=True, hide_index=True)
             
             # 导出结果
             st.subheader("💾 导出结果")
             
-            # 生成 Excel
-            output = BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                result_df.to_excel(writer, index=False, sheet_name='评估结果')
+            export_format = st.radio(
+                "导出格式",
+                list(EXPORT_FORMATS),
+                format_func=lambda fmt: EXPORT_FORMATS[fmt][0],
+                horizontal=True,
+                help="导出文件按运行缓存，结果没有新增时不会重新生成；大结果集建议 Parquet / JSONL"
+            )
+            export_path = export_results(journal, dataset, export_format)
             
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             st.download_button(
-                label="📥 下载评估结果 (Excel)",
-                data=output.getvalue(),
-                file_name=f"eval_results_{timestamp}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                label=f"📥 下载评估结果 ({EXPORT_FORMATS[export_format][0]})",
+                data=export_path.read_bytes(),
+                file_name=f"eval_results_{journal.run_id}.{export_format}",
+                mime=EXPORT_FORMATS[export_format][1],
                 type="primary"
             )
             
             # 详细查看单条结果
             st.subheader("🔍 详细查看")
-            view_idx = st.selectbox(
+            view_row = st.selectbox(
                 "选择查看的结果",
-                range(len(results)),
-                format_func=lambda x: f"第 {start_idx + x} 行"
+                result_df["序号"].tolist(),
+                format_func=lambda row: f"第 {row} 行"
             )
             
             col1, col2 = st.columns(2)
@@ -455,21 +741,49 @@ def main():
                 st.markdown("**输入 Prompt:**")
                 st.text_area(
                     "prompt",
-                    st.session_state.prompts_generated[view_idx],
+                    render_row(meta["template"], meta["mapping"], dataset, view_row)
+                    if dataset is not None and view_row < len(dataset) else "(请在 Step 2 上传该运行对应的评估集)",
                     height=300,
                     disabled=True,
                     label_visibility="collapsed"
                 )
             with col2:
                 st.markdown("**模型响应:**")
-                st.text_area(
-                    "response",
-                    results[view_idx]["response"],
-                    height=300,
-                    disabled=True,
-                    label_visibility="collapsed"
-                )
+                view_results = [res for res in results if res["row"] == view_row]
+                judgments = journal.load_judgments() if meta.get("judge") else {}
+                for res, model_tab in zip(view_results, st.tabs([res.get("model") or "响应" for res in view_results])):
+                    with model_tab:
+                        st.text_area(
+                            "response",
+                            res["response"],
+                            height=300,
+                            disabled=True,
+                            label_visibility="collapsed",
+                            key=f"response_{res.get('model')}"
+                        )
+                        judgment = judgments.get((view_row, res.get("model") or ""))
+                        if judgment and judgment.get("response_hash") == response_hash(res["response"]):
+                            if "error" in judgment:
+                                st.caption(f"⚖️ 评分失败: {judgment['reasoning'][:200]}")
+                            else:
+                                scores = " / ".join(f"{dim} {score:g}" for dim, score in judgment["scores"].items()
+                                                    if score is not None)
+                                weighted = judgment["weighted"]
+                                st.caption(f"⚖️ 加权分 {'-' if weighted is None else f'{weighted:.2f}'}（{scores or '-'}）"
+                                           f"  {judgment['reasoning']}")
+
+
+def _in_streamlit() -> bool:
+    """是否由 streamlit run 启动"""
+    try:
+        from streamlit import runtime
+    except ImportError:
+        return False
+    return runtime.exists()
 
 
 if __name__ == "__main__":
+    # 只有 streamlit run 启动时渲染页面；直接用 python 运行（含 --help、拼错的子命令、无参数）一律交给命令行
+    if not _in_streamlit():
+        sys.exit(cli())
     main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+预编译的 prompt 库
+==================
+把 Strategy_Library/01_Modules 下每个模块的 prompts.md / prompt.md 编译到 .build/ 下的产物
+（索引 prompt_library.json + 模板正文文件）：MODULE 块替换为全局模块的当前内容并去掉标记，按代码块标记
+（```system / ```user）拆出 System / User 模板，提取占位符并记录内容哈希。没有 User 模板、
+模板尚未填写或没有占位符的文件不进入库，只在索引中记录跳过原因。update_prompts.py 生成网页、prompt_evaluator.py 的 Step 1
+下拉框都读这个产物，不再各自解析 markdown。
+
+产物按源文件 (mtime, size) 增量刷新：只有自身或所引用的全局模块变化的条目会重新编译，
+没有变化时 refresh 只做 stat。
+
+用法：
+    python prompt_store.py           # 编译（有变化时）
+    python prompt_store.py --list    # 列出模块及占位符
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from rewrite_engine import atomic_write
+from sync_prompts import MODULE_PATTERN, ROOT_DIR, file_stamp, get_file_content, module_abspath, read_module, rel
+
+MODULES_DIR = os.path.join(ROOT_DIR, 'Strategy_Library', '01_Modules')
+ARTIFACT_PATH = os.path.join(ROOT_DIR, '.build', 'prompt_library.json')
+# 产物结构或编译规则变化时递增，旧产物整体失效
+ARTIFACT_VERSION = 2
+
+PROMPT_FILES = ('prompts.md', 'prompt.md')
+# 目录下每个 .md 都是独立模块（key 为文件名），不要求 prompts.md 命名
+PROMPT_DIRS = ('Decision_Hub/Satellite_Module_Prompts',)
+
+# 页面按钮使用的 key 与目录名不一致的模块（其余模块的 key 为目录名小写）
+KEY_OVERRIDES = {
+    'Action_Guide/Action_Guide_Gen': 'action_guide',
+    'Action_Guide/Pre_Question_Gen': 'pre_question',
+}
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{([^}]+)\}\}')
+CODE_BLOCK_PATTERN = re.compile(r'```[^\n]*\n(.*?)```', re.DOTALL)
+# 模板代码块：info string 为 system / user；围栏可以多于三个反引号，用来包住内含 ```json 的整段 prompt
+TEMPLATE_BLOCK_PATTERN = re.compile(r'^(`{3,})(system|user)[ \t]*\n(.*?)^\1[ \t]*$', re.DOTALL | re.MULTILINE)
+# 占位说明文字（如 "[这里粘贴决策路由 System Prompt]"），说明模板还没有填写
+STUB_PATTERN = re.compile(r'\[这里粘贴[^\]]*\]')
+TITLE_PATTERN = re.compile(r'^#\s+(.+)$', re.MULTILINE)
+
+
+def discover_manifest() -> dict[str, str]:
+    """扫描 01_Modules，返回 {模块 key: 相对仓库根目录的 prompt 文件路径}"""
+    manifest = {}
+    for root, dirs, files in os.walk(MODULES_DIR):
+        dirs.sort()
+        for filename in PROMPT_FILES:
+            if filename not in files:
+                continue
+            module_dir = os.path.relpath(root, MODULES_DIR).replace(os.sep, '/')
+            key = KEY_OVERRIDES.get(module_dir, os.path.basename(root).lower())
+            rel_path = os.path.relpath(os.path.join(root, filename), ROOT_DIR).replace(os.sep, '/')
+            if key in manifest:
+                raise ValueError(f"模块 key 冲突: {key} ({manifest[key]} / {rel_path})")
+            manifest[key] = rel_path
+            break
+        if os.path.relpath(root, MODULES_DIR).replace(os.sep, '/') in PROMPT_DIRS:
+            for filename in sorted(f for f in files if f.endswith('.md')):
+                key = os.path.splitext(filename)[0].lower()
+                rel_path = os.path.relpath(os.path.join(root, filename), ROOT_DIR).replace(os.sep, '/')
+                if key in manifest:
+                    raise ValueError(f"模块 key 冲突: {key} ({manifest[key]} / {rel_path})")
+                manifest[key] = rel_path
+    return manifest
+
+
+def extract_placeholders(text: str) -> list[str]:
+    return list(dict.fromkeys(PLACEHOLDER_PATTERN.findall(text)))
+
+
+def resolve_modules(text: str, modules: dict) -> tuple[str, list[str]]:
+    """把 MODULE 块替换为全局模块的当前内容（去掉标记），返回 (结果, 引用的模块路径)"""
+    deps = []
+
+    def replace(match):
+        module_path = module_abspath(match.group(2))
+        deps.append(rel(module_path))
+        content = read_module(module_path, modules) if os.path.exists(module_path) else None
+        # 模块文件不存在时保留块内现有内容
+        return (content if content is not None else match.group(3)).strip('\n')
+
+    return MODULE_PATTERN.sub(replace, text), deps
+
+
+def _stamp(rel_path: str):
+    stamp = file_stamp(os.path.join(ROOT_DIR, rel_path))
+    return list(stamp) if stamp else None
+
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def skip_reason(system: str, user: str) -> str:
+    """模板不能进入库的原因，可用时返回 None"""
+    if not user:
+        return "没有 ```user 模板代码块"
+    if STUB_PATTERN.search(user) or STUB_PATTERN.search(system):
+        return "模板尚未填写"
+    if not extract_placeholders(user):
+        return "User 模板没有 {{}} 占位符"
+    return None
+
+
+def compile_module(rel_path: str, modules: dict) -> dict:
+    """编译单个 prompt 文件
+
+    只有显式标记的代码块是模板：```system 为 System Prompt，```user 为 User 模板，
+    其余代码块（输出格式、示例、版本历史）不参与。不能使用的模板在 "skipped" 中给出原因。
+    """
+    content = get_file_content(os.path.join(ROOT_DIR, rel_path)) or ""
+    resolved, deps = resolve_modules(content, modules)
+    blocks = {}
+    for match in TEMPLATE_BLOCK_PATTERN.finditer(resolved):
+        role = match.group(2)
+        if role in blocks:
+            raise ValueError(f"{rel_path} 中有多个 ```{role} 模板代码块")
+        blocks[role] = match.group(3).strip()
+    system, user = blocks.get("system", ""), blocks.get("user", "")
+    title = TITLE_PATTERN.search(content)
+    return {
+        "path": rel_path,
+        "title": title.group(1).strip() if title else rel_path,
+        "system": system,
+        "user": user,
+        "placeholders": extract_placeholders(user),
+        "system_placeholders": extract_placeholders(system),
+        "hash": _hash(system, user),
+        "deps": list(dict.fromkeys(deps)),
+        "skipped": skip_reason(system, user),
+    }
+
+
+class PromptLibrary:
+    """编译产物的读取与增量刷新
+
+    产物分两部分：索引 prompt_library.json（key、标题、占位符、哈希、源文件 stamp），
+    以及按库哈希命名的正文文件 prompt_library.<hash>.bin（各模块的 System / User 模板）。
+    启动时只解析索引，正文在 get() 时按偏移读取，模块数量上千时加载仍是毫秒级。
+    刷新时保留上一代正文文件，其他进程仍持有旧索引时可以继续读取；落后更多代时 get() 重新读取索引。
+    """
+
+    def __init__(self, path: str = ARTIFACT_PATH):
+        self.path = path
+        # 评估工具里同一个实例被多个会话共享，刷新串行执行
+        self._lock = threading.Lock()
+        self.data = self._read_index() or {
+            "version": ARTIFACT_VERSION, "hash": "", "bodies": None, "stamps": {}, "modules": {}, "skipped": {}
+        }
+
+    def _read_index(self) -> dict:
+        """读取磁盘上的索引，不存在或版本不符时返回 None"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data if data.get("version") == ARTIFACT_VERSION else None
+
+    @property
+    def modules(self) -> dict[str, dict]:
+        """{key: 索引条目}，不含模板正文"""
+        return self.data["modules"]
+
+    @property
+    def skipped(self) -> dict[str, dict]:
+        """{key: {path, title, deps, reason}}，未进入库的 prompt 文件"""
+        return self.data["skipped"]
+
+    @property
+    def hash(self) -> str:
+        return self.data["hash"]
+
+    def _bodies_path(self) -> str:
+        return os.path.join(os.path.dirname(self.path), self.data["bodies"])
+
+    @staticmethod
+    def _read_body(entry: dict, f) -> bytes:
+        offset, length = entry["body"]
+        f.seek(offset)
+        return f.read(length)
+
+    def get(self, key: str) -> dict:
+        """完整的模块条目（含 system / user 模板），不存在时返回 None"""
+        entry = self.modules.get(key)
+        if entry is None:
+            return None
+        try:
+            f = open(self._bodies_path(), 'rb')
+        except FileNotFoundError:
+            # 其他进程已刷新多次，手上索引指向的正文文件已被清理：换成磁盘上的最新索引
+            data = self._read_index()
+            if data is None or data["bodies"] == self.data["bodies"]:
+                raise
+            self.data = data
+            entry = self.modules.get(key)
+            if entry is None:
+                return None
+            f = open(self._bodies_path(), 'rb')
+        with f:
+            return {**entry, **json.loads(self._read_body(entry, f))}
+
+    def refresh(self, force: bool = False) -> list[str]:
+        """重新编译源文件有变化的模块并落盘，返回重新编译的 key"""
+        with self._lock:
+            return self._refresh(force)
+
+    def _refresh(self, force: bool) -> list[str]:
+        manifest = discover_manifest()
+        old_stamps = self.data["stamps"]
+        stamps = {}
+
+        def stamp(path: str):
+            if path not in stamps:
+                stamps[path] = _stamp(path)
+            return stamps[path]
+
+        def fresh(entry: dict) -> bool:
+            return all(stamp(p) == old_stamps.get(p) for p in [entry["path"], *entry["deps"]])
+
+        reuse = {}
+        for key, rel_path in manifest.items():
+            entry = self.modules.get(key) or self.skipped.get(key)
+            if not force and entry is not None and entry["path"] == rel_path and fresh(entry):
+                reuse[key] = entry
+        if len(reuse) == len(manifest) == len(self.modules) + len(self.skipped):
+            return []
+
+        modules, skipped, bodies, compiled, cache = {}, {}, [], [], {}
+        old_file = None
+        if any(key in self.modules for key in reuse):
+            try:
+                old_file = open(self._bodies_path(), 'rb')
+            except FileNotFoundError:
+                # 旧正文已被其他进程清理，全部重新编译
+                reuse = {}
+        try:
+            offset = 0
+            for key, rel_path in manifest.items():
+                if key in self.skipped and key in reuse:
+                    skipped[key] = reuse[key]
+                    continue
+                if key in reuse:
+                    entry = dict(reuse[key])
+                    body = self._read_body(entry, old_file)
+                else:
+                    entry = compile_module(rel_path, cache)
+                    compiled.append(key)
+                    reason = entry.pop("skipped")
+                    if reason:
+                        skipped[key] = {"path": rel_path, "title": entry["title"], "deps": entry["deps"],
+                                        "reason": reason}
+                        continue
+                    body = json.dumps({"system": entry.pop("system"), "user": entry.pop("user")},
+                                      ensure_ascii=False).encode('utf-8')
+                entry["body"] = [offset, len(body)]
+                offset += len(body)
+                bodies.append(body)
+                modules[key] = entry
+        finally:
+            if old_file is not None:
+                old_file.close()
+
+        library_hash = _hash(*(f"{key}:{entry['hash']}" for key, entry in modules.items()))
+        directory = os.path.dirname(self.path)
+        bodies_name = f"{os.path.splitext(os.path.basename(self.path))[0]}.{library_hash}.bin"
+        os.makedirs(directory, exist_ok=True)
+        # 正文文件名带库哈希，先写正文再替换索引，读者任何时刻看到的索引都指向完整的正文
+        tmp_path = os.path.join(directory, bodies_name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.writelines(bodies)
+        os.replace(tmp_path, os.path.join(directory, bodies_name))
+
+        previous = self.data["bodies"]
+        self.data = {
+            "version": ARTIFACT_VERSION,
+            "hash": library_hash,
+            "bodies": bodies_name,
+            "stamps": {p: stamp(p) for entry in [*modules.values(), *skipped.values()]
+                       for p in [entry["path"], *entry["deps"]]},
+            "modules": modules,
+            "skipped": skipped,
+        }
+        atomic_write(self.path, json.dumps(self.data, ensure_ascii=False))
+        # 上一代正文保留到下次刷新，其他进程用旧索引读取时不会找不到文件
+        for name in os.listdir(directory):
+            if name.endswith(".bin") and name not in (bodies_name, previous):
+                try:
+                    os.unlink(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+        return compiled
+
+
+def load_library(path: str = ARTIFACT_PATH) -> PromptLibrary:
+    """读取产物并确保与源文件一致"""
+    library = PromptLibrary(path)
+    library.refresh()
+    return library
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="把 Strategy_Library 编译为预解析的 prompt 库")
+    parser.add_argument("--force", action="store_true", help="忽略已有产物，全部重新编译")
+    parser.add_argument("--list", action="store_true", help="列出模块及占位符")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    library = PromptLibrary()
+    compiled = library.refresh(force=args.force)
+    elapsed = time.perf_counter() - start
+    print(f"📦 {rel(library.path)}: {len(library.modules)} 个模块，重新编译 {len(compiled)} 个，"
+          f"用时 {elapsed * 1000:.0f}ms (hash {library.hash})")
+    if args.list:
+        for key, entry in library.modules.items():
+            print(f"   {key:<24} {entry['title']}  [{', '.join(entry['placeholders'])}]")
+    for key, entry in library.skipped.items():
+        print(f"⚠️ 跳过 {key} ({entry['path']}): {entry['reason']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+把全局模块推送到所有引用它的 MODULE 块
+用法：
+    python push_modules.py persona core_laws      # 推送指定模块（文件名或路径均可）
+    python push_modules.py --all                  # 推送 00_Global/Prompts 下的全部模块
+    python push_modules.py --all --dry-run        # 只输出 diff，不写入
+
+所有模块共用 sync_prompts.MODULE_PATTERN 一个扫描器，一次遍历 Strategy_Library 完成，
+N 个模块不会扫 N 遍；改写交给 rewrite_engine 并发、原子写入。
+"""
+
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+from rewrite_engine import rewrite_files
+from sync_prompts import (ROOT_DIR, STRATEGY_LIB_DIR, get_file_content, iter_md_files,
+                          rel, sync_content)
+
+GLOBAL_PROMPTS_DIR = os.path.join(STRATEGY_LIB_DIR, "00_Global", "Prompts")
+
+
+def list_global_modules() -> list[str]:
+    return sorted(
+        os.path.join(GLOBAL_PROMPTS_DIR, name)
+        for name in os.listdir(GLOBAL_PROMPTS_DIR) if name.endswith(".md")
+    )
+
+
+def resolve_module(name: str) -> str:
+    """persona / persona.md / 完整路径 -> 模块文件绝对路径"""
+    candidates = [name, os.path.join(ROOT_DIR, name), os.path.join(GLOBAL_PROMPTS_DIR, name)]
+    if not name.endswith(".md"):
+        candidates.append(os.path.join(GLOBAL_PROMPTS_DIR, name + ".md"))
+    for path in candidates:
+        if os.path.isfile(path):
+            return os.path.normpath(os.path.abspath(path))
+    raise FileNotFoundError(f"未找到模块: {name}")
+
+
+def push_transform(file_path, content, modules):
+    """rewrite_engine transform：返回 (新内容, {模块路径: 更新的块数})"""
+    updated = {}
+    return sync_content(content, modules, updated), updated
+
+
+def push_modules(module_paths: list[str], dry_run: bool = False, max_workers: int = None):
+    """把指定模块的当前内容写入所有引用它的 MODULE 块
+
+    返回 (改动列表, {模块路径: {"files": 文件数, "blocks": 块数}}, 耗时秒数)
+    """
+    start = time.perf_counter()
+    modules = {path: get_file_content(path) for path in module_paths}
+    rewrites = rewrite_files(iter_md_files(), partial(push_transform, modules=modules),
+                             dry_run=dry_run, max_workers=max_workers, root=ROOT_DIR)
+    counts = {path: {"files": 0, "blocks": 0} for path in module_paths}
+    for rewrite in rewrites:
+        for path, blocks in rewrite.info.items():
+            counts[path]["files"] += 1
+            counts[path]["blocks"] += blocks
+    return rewrites, counts, time.perf_counter() - start
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="把 00_Global/Prompts 下的模块推送到所有 MODULE 块")
+    parser.add_argument("modules", nargs="*", help="模块名，如 persona、core_laws.md")
+    parser.add_argument("--all", action="store_true", help="推送全部全局模块")
+    parser.add_argument("--dry-run", action="store_true", help="只输出 diff，不写入文件")
+    parser.add_argument("--workers", type=int, help="进程数，缺省为 CPU 核数")
+    args = parser.parse_args(argv)
+
+    if not args.modules and not args.all:
+        parser.error("请指定模块名，或使用 --all")
+    try:
+        module_paths = list_global_modules() if args.all else [resolve_module(m) for m in args.modules]
+    except FileNotFoundError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    rewrites, counts, elapsed = push_modules(module_paths, args.dry_run, args.workers)
+
+    if not args.dry_run:
+        for rewrite in rewrites:
+            print(f"✅ 已更新: {rel(rewrite.path)}")
+    print(f"\n📊 汇总：{'将更新' if args.dry_run else '共更新'} {len(rewrites)} 个文件，用时 {elapsed:.2f}s"
+          f"{'（dry-run，未写入）' if args.dry_run else ''}")
+    for path, item in counts.items():
+        print(f"   - {rel(path)}: {item['blocks']} 个模块块 / {item['files']} 个文件")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Strategy_Library 批量改写引擎
+=============================
+sync_prompts.py 与 update_persona.py 共用：
+1. 规划：并发读取文件并计算新内容，只收集真正有变化的文件
+2. 预览：dry-run 时输出 unified diff，不落盘
+3. 应用：并发原子写入（临时文件 + fsync + rename），写入前确认文件在规划后没有被改过
+
+transform 是 (path, content) -> new_content 的纯函数，在子进程中执行，
+因此必须可 pickle（模块级函数或 functools.partial）。
+transform 也可以返回 (new_content, info)，info 会挂在 Rewrite.info 上带回主进程（如统计信息）。
+"""
+
+import difflib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# 文件数少于该值时直接在当前进程执行，省掉进程池启动开销
+PARALLEL_THRESHOLD = 64
+
+
+class Rewrite:
+    """一个待写入的改动：path 从 old 改为 new"""
+
+    def __init__(self, path: str, old: str, new: str, info=None):
+        self.path = path
+        self.old = old
+        self.new = new
+        self.info = info
+
+    def diff(self, root: str = None) -> str:
+        name = os.path.relpath(self.path, root) if root else self.path
+        return "".join(difflib.unified_diff(
+            self.old.splitlines(keepends=True),
+            self.new.splitlines(keepends=True),
+            fromfile=f"a/{name}",
+            tofile=f"b/{name}",
+        ))
+
+
+def _read(path: str):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+
+def atomic_write(path: str, content: str):
+    """写入同目录临时文件并 fsync 后 rename 覆盖，崩溃时原文件保持完整"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except OSError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 目录项也落盘，rename 本身才算持久（Windows 不支持打开目录，忽略）
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def _plan_one(path: str, transform):
+    old = _read(path)
+    if old is None:
+        return None
+    new, info = transform(path, old), None
+    if isinstance(new, tuple):
+        new, info = new
+    if new is None or new == old:
+        return None
+    return Rewrite(path, old, new, info)
+
+
+def _apply_one(rewrite: Rewrite) -> bool:
+    current = _read(rewrite.path)
+    if current != rewrite.old:
+        return False
+    atomic_write(rewrite.path, rewrite.new)
+    return True
+
+
+def _map(fn, items: list, max_workers: int = None, *args):
+    if len(items) < PARALLEL_THRESHOLD or max_workers == 1:
+        return [fn(item, *args) for item in items]
+    chunksize = max(1, len(items) // ((max_workers or os.cpu_count() or 1) * 4))
+    with ProcessPoolExecutor(max_workers) as pool:
+        return list(pool.map(fn, items, *(repeat(arg) for arg in args), chunksize=chunksize))
+
+
+def plan_rewrites(paths, transform, max_workers: int = None) -> list[Rewrite]:
+    """并发计算每个文件的新内容，返回有变化的 Rewrite 列表（顺序与 paths 一致）"""
+    return [r for r in _map(_plan_one, list(paths), max_workers, transform) if r is not None]
+
+
+def apply_rewrites(rewrites: list[Rewrite], max_workers: int = None) -> tuple[list[Rewrite], list[Rewrite]]:
+    """并发原子写入，返回 (已写入, 冲突跳过)；冲突指规划后文件又被修改过"""
+    results = _map(_apply_one, rewrites, max_workers)
+    written = [r for r, ok in zip(rewrites, results) if ok]
+    conflicts = [r for r, ok in zip(rewrites, results) if not ok]
+    return written, conflicts
+
+
+def rewrite_files(paths, transform, dry_run: bool = False, max_workers: int = None,
+                  root: str = None) -> list[Rewrite]:
+    """规划 + (预览 | 写入)，返回已写入（dry-run 时为将要写入）的改动"""
+    rewrites = plan_rewrites(paths, transform, max_workers)
+    if dry_run:
+        for rewrite in rewrites:
+            print(rewrite.diff(root), end="")
+        return rewrites
+    written, conflicts = apply_rewrites(rewrites, max_workers)
+    for rewrite in conflicts:
+        name = os.path.relpath(rewrite.path, root) if root else rewrite.path
+        print(f"  [WARN] {name} changed while syncing, skipped")
+    return written
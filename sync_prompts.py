@@ -3,11 +3,28 @@ import os
 import re
 import time
 import sys
+import json
 import hashlib
+import argparse
+import threading
+from functools import partial
+
+from rewrite_engine import rewrite_files
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pip install watchdog; falls back to polling
+    FileSystemEventHandler = object
+    Observer = None
 
 # Configuration
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 STRATEGY_LIB_DIR = os.path.join(ROOT_DIR, "Strategy_Library")
+INDEX_FILE = os.path.join(ROOT_DIR, ".sync_index.json")  # Persisted dependency index
+INDEX_VERSION = 1
+DEBOUNCE_SECONDS = 0.3  # Wait for a burst of saves to settle before syncing
+POLL_INTERVAL = 1.0  # Only used when watchdog is not installed
 
 # Patterns
 # Match <!-- MODULE START: path/to/file.md --> content <!-- MODULE END -->
@@ -15,6 +32,7 @@ MODULE_PATTERN = re.compile(
     r'(<!-- MODULE START: (.+?) -->)(.*?)(<!-- MODULE END -->)', 
     re.DOTALL
 )
+MODULE_REF_PATTERN = re.compile(r'<!-- MODULE START: (.+?) -->')
 
 def get_file_content(path):
     """Read file content safely."""
@@ -31,28 +49,30 @@ def get_file_content(path):
         print(f"Error reading {path}: {e}")
         return None
 
-def sync_file(file_path):
-    """Sync modules in a single file."""
-    content = get_file_content(file_path)
-    if not content:
-        return False
-    
-    new_content = content
-    modified = False
+def read_module(module_full_path, modules=None):
+    """Read a module, memoised in `modules` so each one is read once per sync."""
+    if modules is None:
+        return get_file_content(module_full_path)
+    if module_full_path not in modules:
+        modules[module_full_path] = get_file_content(module_full_path)
+    return modules[module_full_path]
+
+def sync_content(content, modules, updated=None):
+    """Return content with every MODULE block refreshed from `modules`.
     
+    `modules` maps module path -> content; blocks whose module is missing or
+    None are kept as they are. If `updated` is a dict, it counts the blocks
+    rewritten per module path.
+    """
     def replace_callback(match):
-        nonlocal modified
         start_tag = match.group(1)
         module_rel_path = match.group(2).strip()
         current_module_content = match.group(3)
         end_tag = match.group(4)
         
-        # Read the source module
-        module_full_path = os.path.join(ROOT_DIR, module_rel_path)
-        module_content = get_file_content(module_full_path)
-        
+        module_path = module_abspath(module_rel_path)
+        module_content = modules.get(module_path)
         if module_content is None:
-            print(f"  [WARN] Module not found: {module_rel_path} (referenced in {os.path.basename(file_path)})")
             return match.group(0) # Keep original if not found
             
         # Ensure module content ends with newline for cleanliness
@@ -62,81 +82,383 @@ def sync_file(file_path):
         # Check if update is needed
         # We normalize newlines to avoid false positives
         if current_module_content.strip() != module_content.strip():
-            modified = True
-            # print(f"  [UPDATE] Updating module {module_rel_path}")
+            if updated is not None:
+                updated[module_path] = updated.get(module_path, 0) + 1
             return f"{start_tag}\n{module_content}{end_tag}"
         
         return match.group(0)
 
-    # Perform replacement
-    new_content = MODULE_PATTERN.sub(replace_callback, content)
-    
-    if modified:
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(new_content)
-            print(f"[SYNCED] {os.path.relpath(file_path, ROOT_DIR)}")
-            return True
-        except Exception as e:
-            print(f"Error writing {file_path}: {e}")
-            
-    return False
+    return MODULE_PATTERN.sub(replace_callback, content)
 
-def scan_and_sync():
-    """Scan all md files and sync them."""
-    count = 0
-    # print("Scanning for updates...")
+def sync_transform(file_path, content, modules):
+    """rewrite_engine transform; module-level so it can run in worker processes."""
+    return sync_content(content, modules)
+
+def load_modules(file_path, module_paths, modules):
+    """Read the modules one file embeds into the shared cache, warning about missing ones."""
+    for module_path in module_paths:
+        if read_module(module_path, modules) is None:
+            print(f"  [WARN] Module not found: {rel(module_path)} (referenced in {os.path.basename(file_path)})")
+
+def iter_md_files():
+    """Yield every .md file under Strategy_Library."""
     for root, dirs, files in os.walk(STRATEGY_LIB_DIR):
         for file in files:
             if file.endswith(".md"):
-                file_path = os.path.join(root, file)
-                if sync_file(file_path):
-                    count += 1
+                yield os.path.join(root, file)
+
+def module_abspath(module_rel_path):
+    """Resolve a MODULE START path relative to the repo root."""
+    return os.path.normpath(os.path.join(ROOT_DIR, module_rel_path.strip()))
+
+def rel(path):
+    return os.path.relpath(path, ROOT_DIR)
+
+def file_stamp(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        return None
+
+def content_hash(content):
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+class DependencyIndex:
+    """Persisted map of which files embed which modules.
+    
+    Each file entry records its stamp (mtime_ns, size), content hash, the modules
+    it embeds, and the module hashes it was last synced against. Files whose stamp
+    is unchanged are not read again.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self.files = {}
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        index = cls(path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return index
+        if data.get("version") != INDEX_VERSION:
+            return index
+        for file_rel, entry in data["files"].items():
+            index.files[module_abspath(file_rel)] = {
+                "stamp": tuple(entry["stamp"]),
+                "hash": entry["hash"],
+                "modules": [module_abspath(m) for m in entry["modules"]],
+                "synced": {module_abspath(m): h for m, h in entry["synced"].items()},
+            }
+        return index
+
+    def save(self):
+        data = {"version": INDEX_VERSION, "files": {
+            rel(file_path): {
+                "stamp": list(entry["stamp"]),
+                "hash": entry["hash"],
+                "modules": [rel(m) for m in entry["modules"]],
+                "synced": {rel(m): h for m, h in entry["synced"].items()},
+            }
+            for file_path, entry in sorted(self.files.items())
+        }}
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def update(self, file_path):
+        """Re-read one file (or forget it if it was deleted). Returns True if its content changed."""
+        stamp = file_stamp(file_path)
+        content = get_file_content(file_path) if stamp else None
+        old = self.files.get(file_path)
+        if content is None:
+            return self.files.pop(file_path, None) is not None
+        self.files[file_path] = {
+            "stamp": stamp,
+            "hash": content_hash(content),
+            "modules": list(dict.fromkeys(module_abspath(m) for m in MODULE_REF_PATTERN.findall(content))),
+            "synced": old["synced"] if old else {},
+        }
+        return old is None or old["hash"] != self.files[file_path]["hash"]
+
+    def refresh(self):
+        """Stat every .md file, re-read only those whose stamp moved. Returns the changed paths."""
+        changed = set()
+        seen = set()
+        for file_path in iter_md_files():
+            seen.add(file_path)
+            entry = self.files.get(file_path)
+            if (entry is None or entry["stamp"] != file_stamp(file_path)) and self.update(file_path):
+                changed.add(file_path)
+        for file_path in set(self.files) - seen:
+            del self.files[file_path]
+            changed.add(file_path)
+        return changed
+
+    def module_hash(self, module_path):
+        entry = self.files.get(module_path)
+        if entry is not None:
+            return entry["hash"]
+        content = get_file_content(module_path) if os.path.exists(module_path) else None
+        return content_hash(content) if content is not None else None
+
+    def reverse(self):
+        """module path -> set of files embedding it"""
+        reverse = {}
+        for file_path, entry in self.files.items():
+            for module in entry["modules"]:
+                reverse.setdefault(module, set()).add(file_path)
+        return reverse
+
+    def affected(self, paths):
+        """The given files plus everything that embeds them, transitively."""
+        reverse = self.reverse()
+        result, stack = set(), list(paths)
+        while stack:
+            path = stack.pop()
+            if path not in result:
+                result.add(path)
+                stack.extend(reverse.get(path, ()))
+        return result
+
+    def stale(self):
+        """Files whose embedded modules changed since they were last synced."""
+        return {
+            file_path for file_path, entry in self.files.items()
+            if set(entry["modules"]) != set(entry["synced"])
+            or any(self.module_hash(m) != h for m, h in entry["synced"].items())
+        }
+
+    def cycles(self):
+        """Module include cycles, each as a list of paths ending with its first node."""
+        cycles, state = [], {}
+        def visit(path, stack):
+            state[path] = "active"
+            stack.append(path)
+            for module in self.files[path]["modules"]:
+                if state.get(module) == "active":
+                    cycles.append(stack[stack.index(module):] + [module])
+                elif module not in state and module in self.files:
+                    visit(module, stack)
+            stack.pop()
+            state[path] = "done"
+        for path in sorted(self.files):
+            if path not in state:
+                visit(path, [])
+        return cycles
+
+    def sync_order(self, paths):
+        """Order paths so nested modules are synced before the files embedding them.
+        
+        Returns (ordered paths, paths skipped because they are part of a cycle).
+        """
+        cyclic = {path for cycle in self.cycles() for path in cycle}
+        order, visited = [], set()
+        def visit(path):
+            visited.add(path)
+            for module in self.files.get(path, {}).get("modules", ()):
+                if module in paths and module not in cyclic and module not in visited:
+                    visit(module)
+            order.append(path)
+        for path in sorted(paths - cyclic):
+            if path not in visited:
+                visit(path)
+        return order, sorted(paths & cyclic)
+
+def sync_paths(paths, index, dry_run=False):
+    """Sync the given files, reading each module once.
+    
+    Files are grouped into levels so nested modules are rewritten before the
+    files embedding them; each level is planned and written concurrently by
+    rewrite_engine. With dry_run, diffs are printed and nothing is written.
+    """
+    order, cyclic = index.sync_order(paths)
+    for path in cyclic:
+        print(f"  [WARN] Skipping {rel(path)}: cyclic module include (see --graph)")
+    # Deleted files and files without MODULE blocks have nothing to sync
+    order = [path for path in order if index.files.get(path, {}).get("modules")]
+    levels = {}
+    for path in order:
+        levels[path] = 1 + max((levels[m] for m in index.files[path]["modules"] if m in levels), default=-1)
+    
+    modules = {}
+    count = 0
+    for level in range(max(levels.values(), default=-1) + 1):
+        batch = [path for path in order if levels[path] == level]
+        needed = set()
+        for path in batch:
+            load_modules(path, index.files[path]["modules"], modules)
+            needed.update(index.files[path]["modules"])
+        transform = partial(sync_transform, modules={m: modules[m] for m in needed})
+        written = rewrite_files(batch, transform, dry_run=dry_run, root=ROOT_DIR)
+        for rewrite in written:
+            modules[rewrite.path] = rewrite.new
+            if not dry_run:
+                print(f"[SYNCED] {rel(rewrite.path)}")
+                index.update(rewrite.path)
+        count += len(written)
+        if not dry_run:
+            for path in batch:
+                entry = index.files[path]
+                entry["synced"] = {m: index.module_hash(m) for m in entry["modules"]}
     return count
 
-def get_dir_checksum():
-    """Calculate a simple checksum of all file mtimes to detect changes."""
-    checksum = ""
-    for root, dirs, files in os.walk(STRATEGY_LIB_DIR):
-        for file in files:
-            if file.endswith(".md"):
-                path = os.path.join(root, file)
-                try:
-                    mtime = os.path.getmtime(path)
-                    checksum += f"{path}:{mtime}|"
-                except:
-                    pass
-    return hashlib.md5(checksum.encode('utf-8')).hexdigest()
-
-def watch_mode():
-    """Poll for changes and sync automatically."""
+def scan_and_sync(index=None, dry_run=False):
+    """Sync every file whose content or embedded modules changed since the last run."""
+    if index is None:
+        index = DependencyIndex.load()
+    changed = index.refresh()
+    count = sync_paths(index.affected(changed | index.stale()), index, dry_run)
+    if not dry_run:
+        index.save()
+    return count
+
+def sync_changed(paths, index):
+    """Sync only the files affected by the changed paths.
+    
+    Paths whose stamp still matches the index are skipped; this is how the
+    events caused by our own writes are ignored.
+    """
+    changed = set()
+    for path in paths:
+        entry = index.files.get(path)
+        if entry is not None and entry["stamp"] == file_stamp(path):
+            continue
+        if index.update(path):
+            changed.add(path)
+    if not changed:
+        return 0
+    count = sync_paths(index.affected(changed), index)
+    index.save()
+    return count
+
+def print_graph(index):
+    """Report modules, their dependents, nested includes, missing modules and cycles."""
+    reverse = index.reverse()
+    stale = index.stale()
+    print(f"📦 Module dependency graph ({len(reverse)} modules, {len(index.files)} files)")
+    for module in sorted(reverse):
+        dependents = sorted(reverse[module])
+        missing = module not in index.files and not os.path.exists(module)
+        print(f"\n{rel(module)}  ({len(dependents)} dependents){'  [MISSING]' if missing else ''}")
+        nested = index.files.get(module, {}).get("modules")
+        if nested:
+            print(f"   ↳ embeds: {', '.join(rel(m) for m in nested)}")
+        for file_path in dependents:
+            print(f"   ← {rel(file_path)}{'  [OUT OF DATE]' if file_path in stale else ''}")
+    cycles = index.cycles()
+    if cycles:
+        print("\n❌ Cyclic module includes:")
+        for cycle in cycles:
+            print("   " + " → ".join(rel(p) for p in cycle))
+    return 1 if cycles else 0
+
+class ChangeCollector(FileSystemEventHandler):
+    """Collect changed .md paths from watchdog (or the poller) and debounce them."""
+
+    def __init__(self):
+        self.pending = set()
+        self.last_event = 0.0
+        self.cond = threading.Condition()
+
+    def add(self, path):
+        if not path.endswith(".md"):
+            return
+        with self.cond:
+            self.pending.add(os.path.normpath(path))
+            self.last_event = time.monotonic()
+            self.cond.notify()
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        self.add(os.fsdecode(event.src_path))
+        # Editors often save via "write temp file, rename over original"
+        if getattr(event, "dest_path", None):
+            self.add(os.fsdecode(event.dest_path))
+
+    def wait(self):
+        """Block until events arrived and stayed quiet for DEBOUNCE_SECONDS."""
+        with self.cond:
+            while True:
+                if not self.pending:
+                    self.cond.wait()
+                    continue
+                quiet = time.monotonic() - self.last_event
+                if quiet >= DEBOUNCE_SECONDS:
+                    paths, self.pending = self.pending, set()
+                    return paths
+                self.cond.wait(DEBOUNCE_SECONDS - quiet)
+
+def snapshot_mtimes():
+    """Stat every .md file; used by the polling fallback."""
+    return {path: file_stamp(path) for path in iter_md_files()}
+
+def poll_changes(collector, stop):
+    """Fallback when watchdog is not installed: diff mtimes once per POLL_INTERVAL."""
+    last = snapshot_mtimes()
+    while not stop.wait(POLL_INTERVAL):
+        current = snapshot_mtimes()
+        for path in current.keys() | last.keys():
+            if current.get(path) != last.get(path):
+                collector.add(path)
+        last = current
+
+def watch_mode(index, use_polling=False):
+    """Watch Strategy_Library and sync the files affected by each change."""
+    collector = ChangeCollector()
+    stop = threading.Event()
+    
+    if Observer is not None and not use_polling:
+        observer = Observer()
+        observer.schedule(collector, STRATEGY_LIB_DIR, recursive=True)
+        observer.start()
+        backend = "filesystem events"
+    else:
+        observer = None
+        threading.Thread(target=poll_changes, args=(collector, stop), daemon=True).start()
+        backend = f"polling every {POLL_INTERVAL:g}s (pip install watchdog for event-driven watching)"
+    
     print("👀 Watching for changes in Strategy_Library... (Press Ctrl+C to stop)")
     print("   Any changes to Global Modules will be automatically synced.")
-    
-    last_checksum = get_dir_checksum()
+    print(f"   Backend: {backend}")
     
     try:
         while True:
-            time.sleep(1) # Poll every second
-            current_checksum = get_dir_checksum()
-            
-            if current_checksum != last_checksum:
-                # Give a tiny buffer for write operations to complete
-                time.sleep(0.1) 
-                scan_and_sync()
-                last_checksum = get_dir_checksum() # Update checksum after sync
-                
+            sync_changed(collector.wait(), index)
     except KeyboardInterrupt:
         print("\nStopped watching.")
+    finally:
+        stop.set()
+        if observer is not None:
+            observer.stop()
+            observer.join()
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "--watch":
-        # Initial sync before watching
-        scan_and_sync()
-        watch_mode()
+    parser = argparse.ArgumentParser(description="Sync embedded <!-- MODULE --> blocks in Strategy_Library")
+    parser.add_argument("--watch", action="store_true", help="keep running and sync on every change")
+    parser.add_argument("--poll", action="store_true", help="with --watch: poll mtimes instead of using watchdog")
+    parser.add_argument("--graph", action="store_true", help="print the module dependency graph and exit")
+    parser.add_argument("--full", action="store_true", help="ignore the saved index and re-check every file")
+    parser.add_argument("--dry-run", action="store_true", help="print the diff of every pending change without writing")
+    args = parser.parse_args()
+    
+    index = DependencyIndex() if args.full else DependencyIndex.load()
+    if args.graph:
+        index.refresh()
+        index.save()
+        sys.exit(print_graph(index))
+    
+    updates = scan_and_sync(index, dry_run=args.dry_run)
+    if args.dry_run:
+        print(f"[DRY RUN] {updates} files would be updated.")
+    elif args.watch:
+        watch_mode(index, use_polling=args.poll)
+    elif updates == 0:
+        print("All prompts are up to date.")
     else:
-        updates = scan_and_sync()
-        if updates == 0:
-            print("All prompts are up to date.")
-        else:
-            print(f"Updated {updates} files.")
+        print(f"Updated {updates} files.")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 仓库根目录下的脚本按顶层模块导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
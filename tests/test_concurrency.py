@@ -0,0 +1,91 @@
+import asyncio
+
+from evaluator.engine import AdaptiveConcurrency
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_slow_start_grows_by_one_per_success():
+    async def scenario():
+        limiter = AdaptiveConcurrency(initial=2, max_limit=5)
+        for _ in range(10):
+            await limiter.acquire()
+            await limiter.release(latency=0.1)
+        return limiter
+
+    limiter = run(scenario())
+    assert limiter.limit == 5 and limiter.slow_start
+    assert limiter.in_flight == 0 and limiter.peak_in_flight == 1
+
+
+def test_throttle_halves_limit_once_per_latency_window():
+    async def scenario():
+        limiter = AdaptiveConcurrency(initial=8)
+        await limiter.acquire()
+        await limiter.release(latency=10.0)
+        for _ in range(2):
+            await limiter.acquire()
+        # 同一个延迟窗口内连续两次 429 只回退一次
+        await limiter.release(throttled=True)
+        await limiter.release(throttled=True)
+        return limiter
+
+    limiter = run(scenario())
+    assert limiter.limit == 4.5
+    assert limiter.throttled == 2 and not limiter.slow_start
+
+
+def test_additive_increase_after_backoff():
+    async def scenario():
+        limiter = AdaptiveConcurrency(initial=4)
+        await limiter.acquire()
+        await limiter.release(overloaded=True)
+        for _ in range(2):
+            await limiter.acquire()
+            await limiter.release(latency=0.1)
+        return limiter
+
+    limiter = run(scenario())
+    assert limiter.throttled == 0
+    assert 2 < limiter.limit < 3
+
+
+def test_latency_rise_triggers_backoff():
+    async def scenario():
+        limiter = AdaptiveConcurrency(initial=4, max_limit=64, window=10)
+        for _ in range(10):
+            await limiter.acquire()
+            await limiter.release(latency=0.01)
+        grown = limiter.limit
+        for _ in range(10):
+            await limiter.acquire()
+            await limiter.release(latency=1.0)
+        return grown, limiter
+
+    grown, limiter = run(scenario())
+    assert limiter.base_latency is not None
+    assert limiter.limit < grown and not limiter.slow_start
+
+
+def test_retry_acquires_before_new_rows():
+    async def scenario():
+        limiter = AdaptiveConcurrency(initial=1, max_limit=1)
+        order = []
+
+        async def worker(name: str, retry: bool):
+            await limiter.acquire(retry=retry)
+            order.append(name)
+            await limiter.release()
+
+        await limiter.acquire()
+        fresh = asyncio.create_task(worker("new", False))
+        await asyncio.sleep(0)
+        retried = asyncio.create_task(worker("retry", True))
+        await asyncio.sleep(0)
+        await limiter.release()
+        await asyncio.gather(fresh, retried)
+        return order
+
+    assert run(scenario()) == ["retry", "new"]
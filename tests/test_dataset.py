@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from evaluator.dataset import DatasetReader
+
+ROWS = [{"id": str(i), "text": f"第 {i} 行", "label": "ab"[i % 2]} for i in range(5)]
+
+
+@pytest.fixture(params=["csv", "jsonl"])
+def dataset(request, tmp_path) -> DatasetReader:
+    path = tmp_path / f"data.{request.param}"
+    if request.param == "csv":
+        lines = ["id,text,label"] + [f"{r['id']},{r['text']},{r['label']}" for r in ROWS]
+    else:
+        lines = [json.dumps(r, ensure_ascii=False) for r in ROWS]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return DatasetReader(path)
+
+
+def test_metadata(dataset):
+    assert dataset.columns == ["id", "text", "label"]
+    assert len(dataset) == 5
+
+
+def test_fetch_selected_rows_and_columns(dataset):
+    assert dataset.fetch([3, 1], ["text"]) == {"text": ["第 3 行", "第 1 行"]}
+    # 向后再读、回头重读都能拿到正确的行
+    assert dataset.fetch([4], ["id", "label"]) == {"id": ["4"], "label": ["a"]}
+    assert dataset.fetch([0, 2], ["id"]) == {"id": ["0", "2"]}
+
+
+def test_missing_rows_are_none(dataset):
+    assert dataset.fetch([4, 7], ["id"]) == {"id": ["4", None]}
+    assert dataset.fetch([], ["id"]) == {"id": []}
+
+
+def test_head_and_row(dataset):
+    assert dataset.head(2) == {col: [r[col] for r in ROWS[:2]] for col in ("id", "text", "label")}
+    assert dataset.row(2) == ROWS[2]
+
+
+def test_rejects_unknown_format(tmp_path):
+    with pytest.raises(ValueError, match="不支持的评估集格式"):
+        DatasetReader(tmp_path / "data.txt")
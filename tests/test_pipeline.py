@@ -0,0 +1,83 @@
+import json
+
+import pytest
+
+import evaluator.config
+from evaluator.config import save_model_configs
+from evaluator.dataset import DatasetReader
+from evaluator.pipeline import load_pipeline, run_pipeline
+from evaluator.storage import RunJournal
+from mock_llm_server import MockLLMServer
+
+
+class HubMockServer(MockLLMServer):
+    """Decision Hub 的请求返回路由 JSON，其余请求回显 prompt"""
+
+    def __init__(self):
+        super().__init__(latency=0.0)
+        self.prompts = []
+
+    def make_content(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        if prompt.startswith("`new_info`:"):
+            target = "SATELLITE_REFINER" if "回我" in prompt else "NONE"
+            return json.dumps({"analysis": "-", "routing": {
+                "status_route": {"target": target, "action": "REFINE", "payload": "对方态度积极"},
+                "profile_route": {"target": "NONE"},
+                "action_route": {"target": "NONE"},
+            }}, ensure_ascii=False)
+        return super().make_content(prompt)
+
+
+def documented_spec() -> dict:
+    # 直接取 load_pipeline 文档中的示例，文档与可运行的定义保持一致
+    return json.loads(load_pipeline.__doc__.split("例：", 1)[1].split("\n", 1)[1])
+
+
+def test_documented_example_compiles_real_prompts():
+    pipeline = load_pipeline(documented_spec(), "m")
+    hub, status = pipeline["stages"]["hub"], pipeline["stages"]["status"]
+    assert hub["mapping"] == {"new_info": "message"}
+    assert "Output Schema" in hub["system"] and "{{new_info}}" in hub["template"]
+    assert "{{original_status}}" in status["template"]
+    assert "<!-- MODULE" not in status["system"] and "核心底层法则" in status["system"]
+    assert status["deps"] == ["hub"]
+
+
+def test_documented_example_runs_against_mock(tmp_path, monkeypatch):
+    server = HubMockServer().start()
+    try:
+        monkeypatch.setattr(evaluator.config, "CONFIG_FILE", tmp_path / "model_configs.json")
+        save_model_configs({"models": {"m": {"api_base": server.base_url, "api_key": "k", "model_name": "m"}},
+                               "default": "m"})
+        dataset_path = tmp_path / "ds.csv"
+        dataset_path.write_text("message,status\n她突然回我了,L2\n她说她不吃辣,L1\n", encoding="utf-8")
+        pipeline = load_pipeline(documented_spec(), "m")
+        journal = RunJournal(runs_dir=tmp_path / "runs")
+        stats = run_pipeline(journal, pipeline, DatasetReader(dataset_path), range(2), 0.0, 100, max_workers=4)
+    finally:
+        server.shutdown()
+
+    assert stats["calls"] == 3 and stats["skipped"] == 1 and stats["errors"] == 0
+    results = {(res["row"], res["model"]): res for res in journal.load_results()}
+    assert results[(1, "status")]["error"] == "skipped"
+    satellite_prompt = next(p for p in server.prompts if p.startswith("`original_status`:"))
+    assert "L2" in satellite_prompt and "对方态度积极" in satellite_prompt
+
+
+@pytest.mark.parametrize("stage, message", [
+    ({"module": "decision_hub", "mapping": {"message": "message"}}, "message 不是模板中的占位符"),
+    ({"prompt": "{{a}}", "mapping": {"a": "x", "b": "y"}}, "b 不是模板中的占位符"),
+    ({"prompt": "{{a}}", "mapping": {"a": "@missing"}}, "不存在的阶段"),
+    ({"module": "next_step_decision"}, "没有模块"),
+])
+def test_load_pipeline_rejects_invalid_stages(stage, message):
+    with pytest.raises(ValueError, match=message):
+        load_pipeline({"stages": {"s": stage}}, "m")
+
+
+def test_load_pipeline_rejects_cycles():
+    spec = {"stages": {"a": {"prompt": "{{x}}", "mapping": {"x": "@b"}},
+                       "b": {"prompt": "{{y}}", "mapping": {"y": "@a"}}}}
+    with pytest.raises(ValueError, match="循环依赖"):
+        load_pipeline(spec, "m")
@@ -0,0 +1,67 @@
+import pytest
+
+from evaluator.ratelimit import EndpointScheduler, TokenBucket, used_request_tokens
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(60, burst_seconds=5)
+    now = bucket.updated
+    assert [bucket.reserve(1, now) for _ in range(5)] == [0.0] * 5
+    # 透支 1 个令牌，按每秒 1 个补充需要等 1 秒
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    assert bucket.reserve(1, now + 2) == 0.0
+
+
+def test_token_bucket_refund_is_capped():
+    bucket = TokenBucket(600)
+    now = bucket.updated
+    bucket.reserve(40, now)
+    bucket.refund(30)
+    assert bucket.tokens == pytest.approx(bucket.capacity - 10)
+    bucket.refund(1000)
+    assert bucket.tokens == bucket.capacity
+
+
+def test_scheduler_limits_requests_and_tokens():
+    scheduler = EndpointScheduler(rpm=60)
+    for _ in range(5):
+        assert scheduler.reserve(100) == 0.0
+    assert scheduler.reserve(100) > 0
+
+    scheduler = EndpointScheduler(tpm=6000)
+    assert scheduler.reserve(500) == 0.0
+    assert scheduler.reserve(500) > 0
+
+
+def test_scheduler_settle_returns_unused_tokens():
+    scheduler = EndpointScheduler(tpm=6000)
+    assert scheduler.reserve(500) == 0.0
+    scheduler.settle(500, 50)
+    assert scheduler.reserve(450) == 0.0
+
+
+def test_scheduler_pause_applies_to_all_callers():
+    scheduler = EndpointScheduler()
+    assert scheduler.reserve(1) == 0.0
+    scheduler.pause(5)
+    scheduler.pause(1)
+    assert 4 < scheduler.reserve(1) <= 5
+
+
+def test_scheduler_configure_keeps_state_when_unchanged():
+    scheduler = EndpointScheduler(rpm=60)
+    bucket = scheduler.requests
+    scheduler.configure(60, None)
+    assert scheduler.requests is bucket
+    scheduler.configure(120, 6000)
+    assert scheduler.requests is not bucket and scheduler.requests.rate == 2
+    assert scheduler.tokens.rate == 100
+    scheduler.configure(None, None)
+    assert scheduler.requests is None and scheduler.tokens is None
+    assert scheduler.reserve(10 ** 9) == 0.0
+
+
+def test_used_request_tokens_prefers_usage():
+    result = {"output_tokens": 20, "usage": {"prompt_tokens": 70, "completion_tokens": 30}}
+    assert used_request_tokens(result, estimated=1100, max_tokens=1000) == 100
+    assert used_request_tokens({"output_tokens": 20}, estimated=1100, max_tokens=1000) == 120
@@ -0,0 +1,103 @@
+import time
+
+import evaluator.engine
+from evaluator.storage import ResponseCache, RunJournal, evaluate_to_journal
+from mock_llm_server import MockLLMServer
+
+
+def make_key(**overrides) -> str:
+    params = {"api_base": "http://a/v1", "model": "m", "system_prompt": "s", "temperature": 0.7,
+              "max_tokens": 100, "prompt": "p"}
+    params.update(overrides)
+    return ResponseCache.make_key(**params)
+
+
+def test_cache_key_covers_every_parameter():
+    assert make_key() == make_key(api_base="http://a/v1/")
+    assert make_key(system_prompt=None) == make_key(system_prompt="")
+    keys = {make_key(api_base="http://b/v1"), make_key(model="n"), make_key(system_prompt="t"),
+            make_key(temperature=0.0), make_key(max_tokens=200), make_key(prompt="q"), make_key()}
+    assert len(keys) == 7
+
+
+def test_cache_roundtrip(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite")
+    cache.put_many({"a": "甲", "b": "乙"})
+    cache.put("c", "丙")
+    assert cache.get_many(["a", "c", "missing"]) == {"a": "甲", "c": "丙"}
+    assert cache.stats()["entries"] == 3
+    cache.clear()
+    assert cache.get_many(["a"]) == {} and cache.stats() == {"entries": 0, "bytes": 0}
+
+
+def test_cache_evicts_least_recently_accessed(tmp_path):
+    # 每条 1 + 9 = 10 字节，上限 30 字节只保留 3 条
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_bytes=30, evict_interval=1)
+    for key in "abc":
+        cache.put(key, "x" * 9)
+        time.sleep(0.01)
+    cache.get_many(["a"])
+    time.sleep(0.01)
+    cache.put("d", "x" * 9)
+    assert set(cache.get_many(list("abcd"))) == {"a", "c", "d"}
+    assert cache.stats() == {"entries": 3, "bytes": 30}
+
+
+def test_cache_expires_old_entries(tmp_path):
+    cache = ResponseCache(tmp_path / "cache.sqlite", max_age_days=0.01 / 86400)
+    cache.put("a", "x")
+    time.sleep(0.05)
+    assert cache.get_many(["a"]) == {}
+
+
+def test_journal_resume_state(tmp_path):
+    journal = RunJournal("run", runs_dir=tmp_path)
+    journal.write_meta({"engine": "async"})
+    journal.append(0, {"model": "m", "response": "ok", "error": None})
+    journal.append(1, {"model": "m", "response": "[ERROR] 503", "error": "transient"})
+    journal.append(2, {"model": "m", "response": "[ERROR] 401", "error": "permanent"})
+    journal.append(0, {"model": "n", "response": "[ERROR] 429", "error": "transient"})
+    journal.append(0, {"model": "n", "response": "ok", "error": None})
+    journal.close()
+    # 崩溃时写了一半的行被跳过
+    with open(journal.results_path, "a", encoding="utf-8") as f:
+        f.write('{"row": 3, "mod')
+
+    journal = RunJournal("run", runs_dir=tmp_path)
+    assert journal.exists() and journal.read_meta() == {"engine": "async"}
+    assert RunJournal.list_runs(tmp_path) == ["run"]
+    assert journal.done_indexes() == {"m": {0, 2}, "n": {0}}
+    assert journal.retry_indexes() == {"m": {1}, "n": set()}
+    results = journal.load_results()
+    assert [(res["row"], res["model"]) for res in results] == [(0, "m"), (0, "n"), (1, "m"), (2, "m")]
+    assert results[1]["response"] == "ok"
+
+
+def test_evaluate_to_journal_resumes_transient_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluator.engine, "retry_delay", lambda error, attempt: 0.0)
+    server = MockLLMServer(latency=0.0, error_rate=1.0).start()
+    try:
+        targets = {"m": {"api_base": server.base_url, "api_key": "k", "model_name": "m"}}
+        rows = range(6)
+
+        def render_chunk(indexes):
+            return [f"row {i}" for i in indexes]
+
+        journal = RunJournal("run", runs_dir=tmp_path)
+        assert evaluate_to_journal(journal, rows, render_chunk, targets, "", 0.0, 100, chunk_size=4) == 6
+        assert journal.retry_indexes() == {"m": set(rows)}
+
+        server.error_rate = 0.0
+        requests = server.stats["requests"]
+        journal = RunJournal("run", runs_dir=tmp_path)
+        journal.append(5, {"model": "m", "response": "done", "error": None})
+        assert evaluate_to_journal(journal, rows, render_chunk, targets, "", 0.0, 100, chunk_size=4) == 5
+        assert server.stats["requests"] - requests == 5
+        assert evaluate_to_journal(journal, rows, render_chunk, targets, "", 0.0, 100) == 0
+    finally:
+        server.shutdown()
+
+    results = journal.load_results()
+    assert [res["row"] for res in results] == list(rows)
+    assert not any(res.get("error") for res in results)
+    assert results[0]["response"].endswith("row 0")
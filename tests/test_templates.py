@@ -0,0 +1,53 @@
+import json
+
+import pandas as pd
+import pytest
+
+from evaluator.templates import (
+    JSON_ROOT_KEY, extract_placeholders, fill_prompt, render_columns, render_frame, required_columns,
+)
+
+FRAME = pd.DataFrame({
+    "q": ["你好", None, "第三行"],
+    "profile": [json.dumps({"name": "小明", "tags": ["a", "b"]}, ensure_ascii=False),
+                "```json\n{\"name\": \"小红\", \"tags\": []}\n```",
+                "不是 JSON"],
+    "unused": [1, 2, 3],
+})
+
+
+@pytest.mark.parametrize("template, mapping", [
+    ("问：{{q}}", {"q": "q"}),
+    ("{{q}} / {{q}} / {{missing}}", {"q": "q"}),
+    ("{{name}} 的第一个标签是 {{tag}}", {"name": "profile.name", "tag": "profile.tags[0]"}),
+    ("{{user.name}}: {{user.tags}}", {"user": "profile"}),
+    ("{{profile.name}} {{q}}", {JSON_ROOT_KEY: "profile", "q": "q"}),
+    ("没有占位符", {}),
+])
+def test_render_frame_matches_fill_prompt(template, mapping):
+    expected = [fill_prompt(template, mapping, row) for _, row in FRAME.iterrows()]
+    assert render_frame(template, mapping, FRAME) == expected
+    assert render_columns(template, mapping, FRAME.to_dict("list"), len(FRAME)) == expected
+
+
+def test_json_paths_and_missing_values():
+    template = "{{q}}|{{name}}|{{tag}}|{{tags}}"
+    mapping = {"q": "q", "name": "profile.name", "tag": "profile.tags[0]", "tags": "profile.tags"}
+    assert render_frame(template, mapping, FRAME) == [
+        '你好|小明|a|["a", "b"]',
+        "|小红||[]",
+        "第三行|||",
+    ]
+
+
+def test_unmapped_placeholders_are_kept():
+    assert fill_prompt("{{a}} {{b}}", {"a": "q"}, {"q": "x"}) == "x {{b}}"
+    assert extract_placeholders("{{b}} {{a}} {{b}} {{c.d[0]}}") == ["b", "a", "c.d[0]"]
+
+
+def test_required_columns_only_reads_mapped_fields():
+    columns = list(FRAME.columns)
+    assert required_columns("{{q}} {{x}}", {"q": "q", "x": "nope"}, columns) == ["q"]
+    assert required_columns("{{name}} {{q}}", {"name": "profile.name", "q": "q"}, columns) == ["profile", "q"]
+    assert required_columns("{{a}} {{b}}", {JSON_ROOT_KEY: "profile"}, columns) == ["profile"]
+    assert required_columns("{{q}}", {}, columns) == []
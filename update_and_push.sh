@@ -5,17 +5,17 @@ echo "🚀 开始更新并推送..."
 
 # 1. 更新 index.html
 echo "📝 更新 index.html..."
-cp prompt_builder.html index.html
+python3 update_prompts.py || exit 1
 
 # 2. 检查是否有更改
-if git diff --quiet index.html 2>/dev/null; then
+if git diff --quiet index.html prompt_builder.html 2>/dev/null; then
     echo "✅ 没有需要更新的内容"
     exit 0
 fi
 
 # 3. 添加并提交
 echo "💾 提交更改..."
-git add index.html
+git add index.html prompt_builder.html
 git commit -m "Update prompt templates - $(date '+%Y-%m-%d %H:%M:%S')"
 
 # 4. 推送到 GitHub（已配置 token，无需输入密码）
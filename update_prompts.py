@@ -1,104 +1,158 @@
 #!/usr/bin/env python3
 """
-自动更新 prompt_builder.html 中的 PROMPTS 内容
+自动更新 prompt_builder.html / index.html 中的 PROMPTS 内容
+用法：
+    python update_prompts.py            # 有变化时重新生成
+    python update_prompts.py --force    # 忽略构建哈希，强制重新生成
+    python update_prompts.py --list     # 只打印发现的模块清单
+
+模块清单从 01_Modules 下的 prompts.md / prompt.md 自动发现，不再手工维护；prompt 内容取自
+prompt_store.py 编译的 prompt 库（MODULE 块已替换为全局模块的当前内容并去掉标记）。
+只内联页面标签页（data-module）用到的模块；某个标签页的模块不在库中（未填写的占位文件、
+没有 User 模板等被 prompt_store 跳过）时构建失败，不会把占位文字或输出格式写进页面。
+PROMPTS 以 JSON 形式内联在 // prompts:begin 与 // prompts:end 两个标记之间（页面的「检查更新」直接从
+index.html 解析该对象，因此不拆成单独的 prompts.js）；标记内记录源文件的构建哈希，
+源文件没有变化时不会重写 HTML。index.html 由同一次构建从 prompt_builder.html 生成。
 """
-import re
+import argparse
+import hashlib
+import json
 import os
+import re
+import sys
+
+from prompt_store import discover_manifest, load_library
+from rewrite_engine import atomic_write
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HTML_PATH = os.path.join(BASE_DIR, 'prompt_builder.html')
+INDEX_PATH = os.path.join(BASE_DIR, 'index.html')
 
-# 定义各模块的源文件路径
-PROMPT_SOURCES = {
-    'emotional_compass': 'Strategy_Library/01_Modules/Status_Analysis/Emotional_Compass/prompts.md',
-    'action_guide': 'Strategy_Library/01_Modules/Action_Guide/Action_Guide_Gen/prompts.md',
-    'chat_analysis': 'Strategy_Library/01_Modules/Chat_Analysis/prompts.md',
-    'seek_answer': 'Strategy_Library/01_Modules/Consultation/seek_answer/prompt.md',
-    'seek_support': 'Strategy_Library/01_Modules/Consultation/seek_support/prompt.md',
-    'pre_question': 'Strategy_Library/01_Modules/Action_Guide/Pre_Question_Gen/prompts.md',
-}
-
-def extract_code_block(content: str) -> str:
-    """提取 markdown 中第一个 ``` 代码块的内容"""
-    # 匹配 ```xxx ... ``` 代码块
-    match = re.search(r'```[^\n]*\n(.*?)```', content, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return ""
-
-def extract_seek_prompt(content: str) -> str:
-    """提取咨询类 prompt（System + User Template）"""
-    blocks = re.findall(r'```[^\n]*\n(.*?)```', content, re.DOTALL)
-    if len(blocks) >= 2:
-        # System Prompt + User Template
-        return blocks[0].strip() + "\n\n" + blocks[1].strip()
-    elif len(blocks) == 1:
-        return blocks[0].strip()
-    return ""
-
-def escape_for_js_template(text: str) -> str:
-    """转义 JavaScript 模板字符串中的特殊字符"""
-    # 转义反引号
-    text = text.replace('`', '\\`')
-    # 转义 ${} 模板插值语法
-    text = text.replace('${', '\\${')
-    return text
-
-def read_prompt(module_name: str) -> str:
-    """读取指定模块的 prompt 内容"""
-    file_path = os.path.join(BASE_DIR, PROMPT_SOURCES[module_name])
-    
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # 咨询类模块特殊处理
-    if module_name in ['seek_answer', 'seek_support']:
-        return extract_seek_prompt(content)
-    else:
-        return extract_code_block(content)
+# 升级格式时递增，使旧的构建哈希失效
+BUILD_VERSION = 3
+
+BEGIN_MARKER = '// prompts:begin'
+END_MARKER = '// prompts:end'
+STAMP_PATTERN = re.compile(r'// prompts-build: ([0-9a-f]+)')
+# 旧版页面没有标记，首次构建时按原来的缩进定位 PROMPTS 对象
+LEGACY_PATTERN = re.compile(r'const PROMPTS = \{[\s\S]*?\n        \};')
+PAGE_MODULE_PATTERN = re.compile(r'data-module="([^"]+)"')
+
+
+def page_modules(html: str) -> list[str]:
+    """页面标签页使用的模块 key（按出现顺序）"""
+    return list(dict.fromkeys(PAGE_MODULE_PATTERN.findall(html)))
+
+
+def build_hash(library, keys: list[str]) -> str:
+    digest = hashlib.sha256(f"v{BUILD_VERSION}".encode('utf-8'))
+    for key in sorted(keys):
+        digest.update(f"{key}\0{library.modules[key]['hash']}\0".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def page_prompt(module: dict) -> str:
+    """页面使用的完整 prompt：咨询类为 System + User Template，其余只有 User"""
+    return "\n\n".join(part for part in (module["system"], module["user"]) if part)
+
+
+def render_prompts_block(prompts: dict[str, str], stamp: str) -> str:
+    """生成内联的 PROMPTS 对象（每个值是 JSON 字符串，同时也是合法的 JS）
+
+    < 转义为 \\u003c，prompt 中的 <!-- MODULE --> 注释或 </script> 不会打断页面的 <script> 标签。
+    """
+    lines = [
+        BEGIN_MARKER,
+        f'        // prompts-build: {stamp}  (由 update_prompts.py 生成，请勿手工修改)',
+        '        const PROMPTS = {',
+    ]
+    items = list(prompts.items())
+    for i, (key, text) in enumerate(items):
+        value = json.dumps(text, ensure_ascii=False).replace('<', '\\u003c')
+        lines.append(f'            {json.dumps(key)}: {value}{"," if i < len(items) - 1 else ""}')
+    lines += ['        };', f'        {END_MARKER}']
+    return '\n'.join(lines)
 
-def update_html():
-    """更新 prompt_builder.html"""
-    html_path = os.path.join(BASE_DIR, 'prompt_builder.html')
-    
-    with open(html_path, 'r', encoding='utf-8') as f:
+
+def replace_prompts_block(html: str, block: str) -> str:
+    start = html.find(BEGIN_MARKER)
+    end = html.find(END_MARKER, start)
+    if start != -1 and end != -1:
+        return html[:start] + block + html[end + len(END_MARKER):]
+    match = LEGACY_PATTERN.search(html)
+    if match is None:
+        raise ValueError("未找到 PROMPTS 对象，请检查 HTML 文件结构")
+    return html[:match.start()] + block + html[match.end():]
+
+
+def current_stamp(html: str):
+    start = html.find(BEGIN_MARKER)
+    if start == -1:
+        return None
+    match = STAMP_PATTERN.search(html, start, start + 200)
+    return match.group(1) if match else None
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    atomic_write(path, content)
+    return True
+
+
+def update_html(force: bool = False) -> int:
+    """更新 prompt_builder.html，并让 index.html 与之保持一致"""
+    library = load_library()
+
+    with open(HTML_PATH, 'r', encoding='utf-8') as f:
         html_content = f.read()
-    
-    # 读取所有 prompt
-    prompts = {}
-    for module_name in PROMPT_SOURCES:
-        raw_prompt = read_prompt(module_name)
-        prompts[module_name] = escape_for_js_template(raw_prompt)
-        print(f"✅ 读取 {module_name}: {len(raw_prompt)} 字符")
-    
-    # 构建新的 PROMPTS 对象
-    prompts_js = """const PROMPTS = {
-            emotional_compass: `""" + prompts['emotional_compass'] + """`,
-
-            action_guide: `""" + prompts['action_guide'] + """`,
-
-            chat_analysis: `""" + prompts['chat_analysis'] + """`,
-
-            seek_answer: `""" + prompts['seek_answer'] + """`,
-
-            seek_support: `""" + prompts['seek_support'] + """`,
-
-            pre_question: `""" + prompts['pre_question'] + """`
-        };"""
-    
-    # 替换 HTML 中的 PROMPTS 对象
-    # 使用正则匹配 const PROMPTS = { ... };
-    pattern = r'const PROMPTS = \{[\s\S]*?\n        \};'
-    
-    if re.search(pattern, html_content):
-        new_html = re.sub(pattern, prompts_js, html_content)
-        
-        with open(html_path, 'w', encoding='utf-8') as f:
-            f.write(new_html)
-        
-        print(f"\n🎉 成功更新 prompt_builder.html!")
-        print(f"📊 共更新 {len(prompts)} 个模块的 prompt")
+
+    keys = page_modules(html_content)
+    missing = [key for key in keys if key not in library.modules]
+    if missing:
+        for key in missing:
+            reason = library.skipped[key]["reason"] if key in library.skipped else "01_Modules 中没有对应的 prompt 文件"
+            print(f"❌ 页面模块 {key} 不可用: {reason}")
+        return 1
+    stamp = build_hash(library, keys)
+
+    if force or current_stamp(html_content) != stamp:
+        prompts = {}
+        for key in keys:
+            prompts[key] = page_prompt(library.get(key))
+            print(f"✅ 读取 {key}: {len(prompts[key])} 字符")
+        try:
+            html_content = replace_prompts_block(html_content, render_prompts_block(prompts, stamp))
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        if write_if_changed(HTML_PATH, html_content):
+            print(f"\n🎉 成功更新 prompt_builder.html!")
+            print(f"📊 共更新 {len(prompts)} 个模块的 prompt (build {stamp})")
     else:
-        print("❌ 未找到 PROMPTS 对象，请检查 HTML 文件结构")
+        print(f"✅ prompt 源文件没有变化 (build {stamp})，跳过生成")
+
+    if write_if_changed(INDEX_PATH, html_content):
+        print("📝 已同步 index.html")
+    return 0
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="从 Strategy_Library 生成 prompt_builder.html / index.html 中的 PROMPTS")
+    parser.add_argument("--force", action="store_true", help="忽略构建哈希，强制重新生成")
+    parser.add_argument("--list", action="store_true", help="只打印发现的模块清单")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        library = load_library()
+        for key, rel_path in discover_manifest().items():
+            note = f"  (跳过: {library.skipped[key]['reason']})" if key in library.skipped else ""
+            print(f"{key:<24} {rel_path}{note}")
+        return 0
+    return update_html(force=args.force)
+
 
 if __name__ == '__main__':
-    update_html()
+    sys.exit(main())